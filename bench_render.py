@@ -0,0 +1,219 @@
+"""
+Benchmark ścieżki renderowania raportu (generate_interactive_report_html).
+
+Dla siatki syntetycznych odpowiedzi (liczba serii x liczba punktów) mierzy
+osobno każdy etap renderowania: KPI (analiza serii), wyrównanie osi,
+konfigurację wykresu, tabelę (szablon _table.html) i składanie HTML
+(szablon report.html bez wierszy tabeli) oraz całość. Dla każdego etapu
+zapisuje medianę i minimum czasu (ms) oraz szczytowe zużycie pamięci
+(tracemalloc, KiB, mierzone w osobnym przebiegu, żeby nie zaburzać czasów).
+
+Dane są deterministyczne (stały prompt i data końcowa), więc wyniki z różnych
+commitów można porównywać:
+
+    python bench_render.py --output bench_before.json
+    # ... zmiany w kodzie ...
+    python bench_render.py --output bench_after.json --compare bench_before.json
+
+Przy --compare skrypt kończy się kodem 1, jeśli któryś etap zwolnił o więcej
+niż --threshold (domyślnie 10%).
+"""
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import main
+
+DEFAULT_SERIES = [1, 5, 20, 50]
+DEFAULT_POINTS = [10, 100, 1000, 10000]
+QUICK_SERIES = [1, 5]
+QUICK_POINTS = [10, 100, 1000]
+
+BENCH_PROMPT = 'Benchmark renderowania'
+BENCH_END_DATE = datetime.date(2025, 12, 1)
+
+STAGES = ['kpi', 'align', 'chart', 'table', 'assembly', 'total']
+
+
+def build_stage_calls(gus_data):
+    """
+    Zwraca słownik etap -> funkcja bez argumentów. Wejście każdego etapu jest
+    przygotowane wcześniej, więc mierzymy tylko jego własną pracę.
+    Wiersze tabeli są generatorem, dlatego kontekst tabeli budujemy przy każdym wywołaniu.
+    """
+    data_meta = gus_data['data_meta']
+    data_series = gus_data['data_series']
+    report_template = main.report_template('report/report.html')
+    table_template = main.report_template('report/_table.html')
+
+    analyses = main.build_series_analyses(data_series)
+    aligned = main.align_series(analyses)
+    chart_config = main.build_chart_config(data_series, data_meta, aligned)
+
+    def render_table():
+        return ''.join(table_template.generate(**main.build_table_context(data_series, data_meta, aligned)))
+
+    def render_assembly():
+        # Cały szablon raportu bez wierszy tabeli (te mierzy etap 'table')
+        table_context = {**main.build_table_context(data_series, data_meta, aligned), 'row_chunks': ()}
+        context = main.build_report_context(data_series, data_meta, analyses, chart_config, table_context)
+        return ''.join(report_template.generate(**context))
+
+    return {
+        'kpi': lambda: main.build_series_analyses(data_series),
+        'align': lambda: main.align_series(analyses),
+        'chart': lambda: main.json_lib.dumps(main.build_chart_config(data_series, data_meta, aligned), separators=(',', ':')),
+        'table': render_table,
+        'assembly': render_assembly,
+        'total': lambda: main.generate_interactive_report_html(gus_data)
+    }
+
+
+def measure_time(func, repeat):
+    func() # Rozgrzewka (m.in. cache parse_period)
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), min(samples)
+
+
+def measure_peak_memory(func):
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+def repeat_for(series_count, points, repeat):
+    # Największe przypadki powtarzamy rzadziej, żeby cały przebieg trwał rozsądnie
+    cells = series_count * points
+    if cells >= 100_000:
+        return max(1, repeat // 4)
+    if cells >= 10_000:
+        return max(1, repeat // 2)
+    return repeat
+
+
+def run_case(series_count, points, repeat):
+    gus_data = main.make_synthetic_gus_data(BENCH_PROMPT, series_count, points, end_date=BENCH_END_DATE)
+    calls = build_stage_calls(gus_data)
+    case_repeat = repeat_for(series_count, points, repeat)
+
+    stages = {}
+    for stage in STAGES:
+        median_ms, min_ms = measure_time(calls[stage], case_repeat)
+        stages[stage] = {
+            'median_ms': round(median_ms, 3),
+            'min_ms': round(min_ms, 3),
+            'peak_kib': round(measure_peak_memory(calls[stage]), 1)
+        }
+    return {
+        'series': series_count,
+        'points': points,
+        'repeat': case_repeat,
+        'stages': stages
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(case):
+    return f"{case['series']}x{case['points']}"
+
+
+def compare(results, baseline, threshold):
+    """Wypisuje zmiany mediany czasu względem wyników bazowych; zwraca listę regresji."""
+    baseline_cases = {case_key(case): case for case in baseline['cases']}
+    regressions = []
+
+    print(f"\nPorównanie z {baseline.get('revision') or 'wynikami bazowymi'} (mediana, zmiana w %):")
+    print(f"{'przypadek':<12}" + ''.join(f"{stage:>10}" for stage in STAGES))
+    for case in results['cases']:
+        old_case = baseline_cases.get(case_key(case))
+        if old_case is None:
+            continue
+        cells = []
+        for stage in STAGES:
+            old = old_case['stages'].get(stage, {}).get('median_ms')
+            new = case['stages'][stage]['median_ms']
+            if not old:
+                cells.append(f"{'-':>10}")
+                continue
+            change = (new - old) / old
+            cells.append(f"{change * 100:>+9.1f}%")
+            if change > threshold:
+                regressions.append((case_key(case), stage, old, new))
+        print(f"{case_key(case):<12}" + ''.join(cells))
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark renderowania raportów")
+    parser.add_argument('--series', type=int, nargs='+', help=f"Liczby serii (domyślnie {DEFAULT_SERIES})")
+    parser.add_argument('--points', type=int, nargs='+', help=f"Liczby punktów (domyślnie {DEFAULT_POINTS})")
+    parser.add_argument('--quick', action='store_true', help='Mała siatka do szybkiego sprawdzenia')
+    parser.add_argument('--repeat', type=int, default=8, help='Liczba powtórzeń pomiaru czasu')
+    parser.add_argument('--output', help='Zapisz wyniki do pliku JSON')
+    parser.add_argument('--compare', help='Plik JSON z wynikami bazowymi do porównania')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Dopuszczalny wzrost mediany czasu przy --compare (ułamek, domyślnie 0.10)')
+    args = parser.parse_args()
+
+    series_grid = args.series or (QUICK_SERIES if args.quick else DEFAULT_SERIES)
+    points_grid = args.points or (QUICK_POINTS if args.quick else DEFAULT_POINTS)
+
+    results = {
+        'revision': git_revision(),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'renderer_version': main.RENDERER_VERSION,
+        'cases': []
+    }
+
+    print(f"{'przypadek':<12}" + ''.join(f"{stage:>10}" for stage in STAGES) + "  (mediana ms / szczyt KiB)")
+    for series_count in series_grid:
+        for points in points_grid:
+            case = run_case(series_count, points, args.repeat)
+            results['cases'].append(case)
+            times = ''.join(f"{case['stages'][stage]['median_ms']:>10.2f}" for stage in STAGES)
+            memory = ''.join(f"{case['stages'][stage]['peak_kib']:>10.0f}" for stage in STAGES)
+            print(f"{case_key(case):<12}{times}")
+            print(f"{'':<12}{memory}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nWyniki zapisano w {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegresje powyżej {args.threshold * 100:.0f}%:")
+            for key, stage, old, new in regressions:
+                print(f"  {key} {stage}: {old:.2f} ms -> {new:.2f} ms")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,60 @@
+"""
+Profile konfiguracji wdrożenia, wybierane zmienną środowiskową APP_CONFIG
+('development' - domyślnie, 'production').
+
+Wartości domyślne aplikacji są w main.py; tutaj są tylko ustawienia zależne od
+środowiska. Każdy klucz można dodatkowo nadpisać zmienną FLASK_<KLUCZ>, np.
+FLASK_DB_POOL_SIZE=20. Adres bazy podaje się w DATABASE_URL - SQLite (domyślnie
+instance/app.db) albo PostgreSQL (wymaga sterownika, np. pip install psycopg2-binary).
+"""
+import os
+
+
+def database_uri():
+    uri = os.environ.get('DATABASE_URL')
+    if uri and uri.startswith('postgres://'):
+        # Część usług podaje starą nazwę schematu, której SQLAlchemy już nie obsługuje
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+class Config:
+    DEBUG = False
+
+    if database_uri():
+        SQLALCHEMY_DATABASE_URI = database_uri()
+    if os.environ.get('SECRET_KEY'):
+        SECRET_KEY = os.environ['SECRET_KEY']
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+
+
+class ProductionConfig(Config):
+    # Bez SECRET_KEY w środowisku aplikacja nie wystartuje (zamiast używać przykładowego klucza)
+    SECRET_KEY_REQUIRED = True
+    # Kilka procesów serwera - stan zadań musi być widoczny dla wszystkich
+    JOB_SHARED_STATE = True
+    IDENTITY_CACHE_SHARED = True
+    DB_POOL_SIZE = 10
+    DB_MAX_OVERFLOW = 20
+    # Długie odpowiedzi modelu nie mogą blokować zapisu innych procesów
+    DB_SQLITE_BUSY_TIMEOUT = 30000
+    PROMPT_RELOAD_INTERVAL = 30.0
+    # Metryki zdradzają obciążenie i użycie modeli - włączamy je świadomie, najlepiej z tokenem:
+    # FLASK_METRICS_ENABLED=true FLASK_METRICS_TOKEN=...
+    METRICS_ENABLED = False
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig
+}
+
+
+def get_config(name=None):
+    name = name or os.environ.get('APP_CONFIG', 'development')
+    if name not in CONFIGS:
+        raise ValueError(f"Nieznany profil konfiguracji: {name} (dostępne: {', '.join(CONFIGS)})")
+    return CONFIGS[name]
@@ -0,0 +1,58 @@
+"""
+Konfiguracja gunicorna (tryb produkcyjny):
+
+    APP_CONFIG=production gunicorn -c gunicorn.conf.py wsgi:app
+
+Każdy worker to osobny proces z pulą wątków (gthread): wątki obsługują żądania
+i długie połączenia SSE, a wątki kolejki raportów czekają na model. Parametry
+można zmienić zmiennymi GUNICORN_*, konfigurację aplikacji - zmiennymi FLASK_*.
+"""
+import multiprocessing
+import os
+
+os.environ.setdefault('APP_CONFIG', 'production')
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+# Każde otwarte połączenie SSE zajmuje wątek na czas generowania raportu
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+# Żądania czekające na model (np. /api/prompts/batch) mogą trwać kilkadziesiąt sekund
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 180))
+graceful_timeout = 30
+keepalive = 5
+# Po max_requests worker jest wymieniany - jego zadania raportów kończy lub przerywa worker_exit
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = 200
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    # Schemat bazy przygotowujemy raz, w procesie głównym - workery tylko z niego korzystają
+    from main import app, db, prepare_database
+    prepare_database()
+    with app.app_context():
+        db.engine.dispose() # Połączenia z procesu głównego nie mogą trafić do workerów
+    os.environ['APP_DB_PREPARED'] = '1'
+
+
+def post_fork(server, worker):
+    # Pula połączeń odziedziczona po procesie głównym - nowy proces otwiera własne połączenia
+    from main import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    # Uzupełnianie indeksu wyszukiwania wystarczy w jednym workerze (get_app w workerach go pomija)
+    if worker.age == 1:
+        from main import start_search_backfill
+        start_search_backfill()
+
+
+def worker_exit(server, worker):
+    # Zadania raportów działają w wątkach workera - dajemy im chwilę na dokończenie (JOB_SHUTDOWN_TIMEOUT),
+    # a resztę oznaczamy jako nieudane, aby w report_job nie zostały wiecznie 'queued'/'running'
+    from main import app, report_jobs
+    report_jobs.shutdown(app.config['JOB_SHUTDOWN_TIMEOUT'])
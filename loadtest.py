@@ -0,0 +1,151 @@
+"""
+Test obciążeniowy dla /api/prompt.
+
+Uruchamia wielu równoległych, zalogowanych klientów, którzy wysyłają prompty,
+czekają na zakończenie zadania i mierzą czasy. Na koniec wypisuje przepustowość
+oraz percentyle p50/p95/p99 dla całego żądania oraz etapów po stronie serwera
+(model, zapis w bazie, renderowanie - z pola 'timings' statusu zadania).
+
+Aby nie zużywać limitu API, serwer warto uruchomić z lokalnym backendem i bez
+limitów zapytań na użytkownika, np.:
+
+    FLASK_DATA_BACKEND=local FLASK_LOCAL_BACKEND_LATENCY=0.5 FLASK_RATE_LIMIT_ENABLED=false python main.py
+    python loadtest.py --clients 8 --requests 20
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(values, p):
+    # Percentyl metodą najbliższej rangi
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(p / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None
+    }
+
+
+class LoadTestClient:
+    def __init__(self, base_url, email, password, poll_interval, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.email = email
+        self.password = password
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def login(self):
+        # Rejestracja może się nie udać, jeśli konto już istnieje - wtedy po prostu logujemy
+        self.session.post(f"{self.base_url}/register", data={'email': self.email, 'password': self.password})
+        response = self.session.post(f"{self.base_url}/login", data={'email': self.email, 'password': self.password})
+        if '/login' in response.url:
+            raise RuntimeError(f"Nie udało się zalogować jako {self.email}")
+
+    def run_prompt(self, prompt):
+        """Zwraca (czas całkowity w ms, czasy etapów z serwera) albo rzuca wyjątek."""
+        started = time.perf_counter()
+        response = self.session.post(f"{self.base_url}/api/prompt", json={'prompt': prompt})
+        if response.status_code != 202:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+        status_url = self.base_url + response.json()['status_url']
+
+        deadline = started + self.timeout
+        while time.perf_counter() < deadline:
+            status = self.session.get(status_url).json()
+            if status['status'] == 'done':
+                return (time.perf_counter() - started) * 1000, status.get('timings', {})
+            if status['status'] == 'failed':
+                raise RuntimeError(f"Zadanie nie powiodło się: {status.get('error')}")
+            time.sleep(self.poll_interval)
+        raise TimeoutError("Przekroczono czas oczekiwania na zadanie")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test obciążeniowy /api/prompt")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, default=4, help='Liczba równoległych klientów')
+    parser.add_argument('--requests', type=int, default=10, help='Liczba promptów na klienta')
+    parser.add_argument('--prompt', default='Stopa bezrobocia w Płocku')
+    parser.add_argument('--repeat-prompts', action='store_true',
+                        help='Wysyłaj ten sam prompt (test cache); domyślnie każdy prompt jest unikalny')
+    parser.add_argument('--password', default='loadtest')
+    parser.add_argument('--poll-interval', type=float, default=0.1)
+    parser.add_argument('--timeout', type=float, default=120.0, help='Maks. czas oczekiwania na jedno zadanie (s)')
+    parser.add_argument('--json-out', help='Zapisz wyniki do pliku JSON')
+    args = parser.parse_args()
+
+    run_id = uuid.uuid4().hex[:8]
+    clients = [
+        LoadTestClient(args.url, f"loadtest-{run_id}-{i}@example.com", args.password, args.poll_interval, args.timeout)
+        for i in range(args.clients)
+    ]
+    for client in clients:
+        client.login()
+
+    lock = threading.Lock()
+    end_to_end, stages, errors = [], {'model_ms': [], 'db_ms': [], 'render_ms': []}, []
+
+    def worker(client_index):
+        client = clients[client_index]
+        for i in range(args.requests):
+            prompt = args.prompt if args.repeat_prompts else f"{args.prompt} ({run_id}-{client_index}-{i})"
+            try:
+                total_ms, timings = client.run_prompt(prompt)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                end_to_end.append(total_ms)
+                for stage, values in stages.items():
+                    if stage in timings:
+                        values.append(timings[stage])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        list(pool.map(worker, range(args.clients)))
+    elapsed = time.perf_counter() - started
+
+    results = {
+        'clients': args.clients,
+        'requests_per_client': args.requests,
+        'elapsed_s': round(elapsed, 3),
+        'completed': len(end_to_end),
+        'errors': len(errors),
+        'throughput_rps': round(len(end_to_end) / elapsed, 3) if elapsed else None,
+        'end_to_end_ms': summarize(end_to_end),
+        'stages_ms': {stage: summarize(values) for stage, values in stages.items()}
+    }
+
+    print(f"Zakończone: {results['completed']}, błędy: {results['errors']}, czas: {results['elapsed_s']} s")
+    print(f"Przepustowość: {results['throughput_rps']} żądań/s")
+    print(f"{'etap':<14}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for name, summary in [('end_to_end', results['end_to_end_ms'])] + list(results['stages_ms'].items()):
+        cells = ''.join(f"{summary[k]:>10.1f}" if summary[k] is not None else f"{'-':>10}" for k in ('p50', 'p95', 'p99', 'max'))
+        print(f"{name:<14}{cells}")
+    if errors:
+        print("Przykładowe błędy:", *errors[:5], sep='\n  ')
+
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,44 @@
 import os
+import re
 import time
+import hashlib
+import hmac
+import sqlite3
+import threading
+import queue
+import uuid
+import unicodedata
+import heapq
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+import functools
+import bisect
+import zlib
+import gzip
+import csv
+import io
+import itertools
+import random
+import math
+import datetime
+import html as html_lib
+from collections import OrderedDict, deque, namedtuple
+from typing import List, Optional
 import json as json_lib # Używamy aliasu, aby uniknąć konfliktu z flask.json
-import statistics # Potrzebne do obliczeń
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+import click
+import numpy as np
+import brotli # Kompresja Brotli odpowiedzi z raportami
+import pyarrow as pa # Eksport danych raportów do Parquet
+import pyarrow.parquet as pq
+from flask import Flask, Response, render_template, stream_template, stream_with_context, request, jsonify, redirect, url_for, flash
+from markupsafe import Markup, escape
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateTable
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
 import google.generativeai as genai 
+from config import get_config
 
 # --- Konfiguracja Aplikacji ---
 app = Flask(__name__)
@@ -34,7 +66,156 @@ except OSError:
     pass
 
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(app.instance_path, 'app.db')
-app.config['SECRET_KEY'] = 'twoj-bardzo-tajny-klucz-zmien-to' 
+DEFAULT_SECRET_KEY = 'twoj-bardzo-tajny-klucz-zmien-to'
+app.config['SECRET_KEY'] = DEFAULT_SECRET_KEY
+# Gdy True, aplikacja nie wystartuje bez własnego klucza (SECRET_KEY albo FLASK_SECRET_KEY w środowisku)
+app.config['SECRET_KEY_REQUIRED'] = False
+
+# Model Gemini używany do generowania danych
+app.config['GEMINI_MODEL'] = 'gemini-2.5-pro'
+# Tańszy, szybszy model używany, gdy w kolejce czeka co najmniej MODEL_DOWNGRADE_QUEUE_DEPTH zadań (None = wyłączone)
+app.config['GEMINI_FALLBACK_MODEL'] = 'gemini-2.5-flash'
+app.config['MODEL_DOWNGRADE_QUEUE_DEPTH'] = 8
+# Prompty systemowe: prompt.txt (wariant 'default') i prompt.<wariant>.txt w katalogu aplikacji
+app.config['PROMPT_DIR'] = app.root_path
+app.config['PROMPT_RELOAD_INTERVAL'] = 2.0 # Co ile sekund sprawdzamy mtime pliku promptu
+# Strumieniowanie odpowiedzi modelu (data_meta i kolejne serie trafiają do przeglądarki na bieżąco)
+app.config['GEMINI_STREAMING'] = True
+
+# Cache odpowiedzi modelu (osobny plik SQLite obok app.db)
+app.config['RESPONSE_CACHE_ENABLED'] = True
+app.config['RESPONSE_CACHE_PATH'] = os.path.join(app.instance_path, 'response_cache.db')
+app.config['RESPONSE_CACHE_TTL'] = 24 * 60 * 60 # w sekundach
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = 1000
+
+# Cache tożsamości zalogowanych użytkowników (load_user bez zapytania do bazy przy każdym żądaniu)
+app.config['IDENTITY_CACHE_ENABLED'] = True
+app.config['IDENTITY_CACHE_SIZE'] = 1024
+app.config['IDENTITY_CACHE_TTL'] = 300 # s; po tym czasie dane użytkownika są czytane z bazy ponownie
+# Wspólne unieważnienia (plik SQLite) dla kilku procesów serwera; proces sprawdza je co SYNC_INTERVAL s
+app.config['IDENTITY_CACHE_SHARED'] = False
+app.config['IDENTITY_CACHE_PATH'] = os.path.join(app.instance_path, 'identity_cache.db')
+app.config['IDENTITY_CACHE_SYNC_INTERVAL'] = 2.0
+
+# Lokalna baza wskaźników (SQLite): wartości z odpowiedzi modelu i importów BDL (flask import-bdl)
+app.config['INDICATOR_STORE_ENABLED'] = True
+app.config['INDICATOR_STORE_PATH'] = os.path.join(app.instance_path, 'indicators.db')
+app.config['INDICATOR_MATCH_MIN_COVERAGE'] = 0.6 # Jaka część słów nazwy wskaźnika musi wystąpić w prompcie
+app.config['INDICATOR_PUBLICATION_LAG'] = {'M': 2, 'Q': 2, 'A': 1} # O ile okresów wstecz są zwykle najnowsze dane
+app.config['INDICATOR_GAP_RETRY_AFTER'] = 7 * 24 * 60 * 60 # s; o okresy, których model nie podał, nie pytamy częściej
+
+# Kolejka zadań generowania raportów (limity chroniące serwer przed falą promptów)
+app.config['JOB_WORKERS'] = 4
+app.config['JOB_QUEUE_MAX'] = 32 # Maks. liczba zadań czekających w kolejce
+app.config['JOB_MAX_PENDING_PER_USER'] = 3 # Maks. liczba niezakończonych zadań jednego użytkownika
+app.config['JOB_MAX_RETRIES'] = 2
+app.config['JOB_RETRY_BACKOFF'] = 2.0 # w sekundach, podwajane przy każdej próbie
+app.config['JOB_RESULT_TTL'] = 60 * 60 # Jak długo trzymamy zakończone zadania (w sekundach)
+# Przy zamykaniu procesu serwera (gunicorn worker_exit) tyle sekund czekamy na dokończenie zadań;
+# pozostałe oznaczamy jako nieudane. Musi być krótsze niż graceful_timeout gunicorna
+app.config['JOB_SHUTDOWN_TIMEOUT'] = 20.0
+
+# Cache wyrenderowanych raportów (raporty są renderowane na żądanie z danych strukturalnych)
+app.config['REPORT_RENDER_CACHE_SIZE'] = 256
+
+# Odpowiedzi z raportami: ETag + Cache-Control i skompresowane treści trzymane w pamięci
+app.config['REPORT_PAYLOAD_CACHE_SIZE'] = 256
+app.config['REPORT_HTTP_MAX_AGE'] = 3600 # Raporty się nie zmieniają; po tym czasie przeglądarka pyta z If-None-Match
+
+# Historia raportów ładowana stronami (paginacja po Report.id)
+app.config['HISTORY_PAGE_SIZE'] = 30
+app.config['HISTORY_MAX_PAGE_SIZE'] = 100
+
+# Wyszukiwanie pełnotekstowe (SQLite FTS5)
+app.config['SEARCH_PAGE_SIZE'] = 20
+app.config['SEARCH_BACKFILL_BATCH'] = 200 # Raportów na jedną krótką transakcję
+app.config['SEARCH_BACKFILL_PAUSE'] = 0.05 # Przerwa między partiami (s), aby nie blokować zapisów
+
+# Źródło danych dla get_data_from_gus: 'gemini' (prawdziwe API) lub 'local' (fixture / dane syntetyczne)
+app.config['DATA_BACKEND'] = 'gemini'
+app.config['LOCAL_BACKEND_FIXTURE'] = None # Ścieżka do nagranej odpowiedzi (np. plik 'output'); None = dane syntetyczne
+app.config['LOCAL_BACKEND_SERIES'] = 2
+app.config['LOCAL_BACKEND_POINTS'] = 24
+app.config['LOCAL_BACKEND_LATENCY'] = 0.0 # Sztuczne opóźnienie odpowiedzi (s)
+
+# Limity zapytań (kubełki tokenów w SQLite, wspólne dla procesów serwera)
+app.config['RATE_LIMIT_ENABLED'] = True
+app.config['RATE_LIMIT_PATH'] = os.path.join(app.instance_path, 'rate_limits.db')
+app.config['RATE_LIMIT_USER_BURST'] = 20 # Tyle promptów użytkownik może wysłać naraz (także jedną partią)
+app.config['RATE_LIMIT_USER_PER_MINUTE'] = 10 # Tempo odnawiania limitu użytkownika
+app.config['RATE_LIMIT_MODEL_BURST'] = 20 # Budżet wywołań jednego modelu (wszyscy użytkownicy razem)
+app.config['RATE_LIMIT_MODEL_PER_MINUTE'] = 60
+app.config['RATE_LIMIT_MODEL_MAX_WAIT'] = 60.0 # Maks. czas (s), przez jaki zadanie czeka na budżet modelu
+
+# Zbiorcze zapytania (/api/prompts/batch): wiele promptów pobieranych równolegle w jednym żądaniu
+app.config['BATCH_MAX_PROMPTS'] = 20
+app.config['BATCH_CONCURRENCY'] = 6 # Maks. liczba równoległych wywołań modelu w jednej partii
+app.config['BATCH_ITEM_TIMEOUT'] = 90.0 # Limit czasu jednego wywołania modelu (s)
+
+# Wykresy: powyżej tej liczby punktów osi seria jest upraszczana (LTTB), pełne dane na żądanie
+app.config['CHART_MAX_POINTS'] = 500
+
+# Raporty z tabelą większą niż tyle komórek (wiersze x serie) /api/report/<id>/html wysyła strumieniowo
+app.config['REPORT_STREAM_MIN_CELLS'] = 20000
+
+# Dashboard łączący kilka zapisanych raportów w jeden wykres
+app.config['DASHBOARD_MAX_REPORTS'] = 20
+app.config['DASHBOARD_MAX_CHART_POINTS'] = 1000 # Powyżej tej liczby punktów osi wykres jest upraszczany
+
+# Eksport danych raportów (CSV / NDJSON / Parquet) - strumieniowo, ze stałym zużyciem pamięci
+app.config['EXPORT_BATCH_SIZE'] = 50 # Tyle raportów czytamy z bazy jednym zapytaniem
+app.config['EXPORT_CHUNK_ROWS'] = 5000 # Tyle wierszy trafia naraz do odpowiedzi (i do jednej grupy wierszy Parquet)
+
+# Metryki (format tekstowy Prometheusa pod /metrics) i log wolnych zadań
+app.config['METRICS_ENABLED'] = True
+# Gdy ustawiony, /metrics wymaga nagłówka 'Authorization: Bearer <token>' (scrape Prometheusa z bearer_token)
+app.config['METRICS_TOKEN'] = None
+app.config['SLOW_REQUEST_THRESHOLD'] = 20.0 # w sekundach; zadania wolniejsze logujemy z podziałem na etapy (None = wyłączone)
+
+# Baza danych: SQLite w trybie WAL (czytelnicy nie blokują zapisu) i pula połączeń SQLAlchemy
+app.config['DB_SQLITE_WAL'] = True
+app.config['DB_SQLITE_BUSY_TIMEOUT'] = 10000 # ms oczekiwania na blokadę zapisu zamiast "database is locked"
+app.config['DB_POOL_SIZE'] = 5
+app.config['DB_MAX_OVERFLOW'] = 10
+app.config['DB_POOL_TIMEOUT'] = 30 # s oczekiwania na wolne połączenie z puli
+app.config['DB_POOL_RECYCLE'] = 1800 # s; tylko serwery baz danych (PostgreSQL)
+# Stan zadań w tabeli report_job - potrzebne, gdy działa kilka procesów serwera (gunicorn)
+app.config['JOB_SHARED_STATE'] = False
+
+# Profil wdrożenia (config.py, APP_CONFIG=development/production)
+app.config.from_object(get_config())
+
+# Nadpisania z zmiennych środowiskowych, np. FLASK_DATA_BACKEND=local, FLASK_JOB_WORKERS=8
+app.config.from_prefixed_env()
+
+# Przykładowy klucz z tego pliku jest publiczny - z nim każdy mógłby podrobić ciasteczko sesji
+if app.config['SECRET_KEY_REQUIRED'] and app.config['SECRET_KEY'] in (None, '', DEFAULT_SECRET_KEY):
+    raise RuntimeError("Brak klucza SECRET_KEY: ustaw zmienną środowiskową SECRET_KEY przed uruchomieniem "
+                       "aplikacji w profilu produkcyjnym.")
+
+
+def build_engine_options(config):
+    """Opcje silnika SQLAlchemy (pula połączeń, limit oczekiwania na blokadę SQLite) z konfiguracji."""
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if uri.startswith('sqlite'):
+        if ':memory:' in uri or uri in ('sqlite://', 'sqlite:///'):
+            return {}
+        return {
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+            'connect_args': {'timeout': config['DB_SQLITE_BUSY_TIMEOUT'] / 1000}
+        }
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True # Zerwane połączenia wykrywamy przed użyciem, a nie w środku żądania
+    }
+
+
+app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', build_engine_options(app.config))
 
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
@@ -43,6 +224,19 @@ login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
 
 
+@db.event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    # WAL: odczyty nie czekają na zapis; busy_timeout: zapisujący czeka na blokadę zamiast zgłaszać błąd
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    if app.config['DB_SQLITE_WAL']:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL") # W trybie WAL bezpieczne, a dużo szybsze od FULL
+    cursor.execute(f"PRAGMA busy_timeout={int(app.config['DB_SQLITE_BUSY_TIMEOUT'])}")
+    cursor.close()
+
+
 # --- Modele Bazy Danych ---
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -54,22 +248,745 @@ class Report(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     prompt = db.Column(db.Text, nullable=False)
-    content = db.Column(db.Text, nullable=False) # Będzie przechowywać pełny HTML raportu
+    # Pełny HTML - tylko dla starych raportów, których nie udało się przenieść do kolumny 'data'
+    content = db.Column(db.Text, nullable=False, default='')
+    # Dane źródłowe raportu (JSON od modelu) skompresowane zlib; HTML renderujemy na żądanie
+    data = db.Column(db.LargeBinary, nullable=True)
+    # Wersja (hash treści) promptu systemowego, z którym wygenerowano raport
+    prompt_version = db.Column(db.String(64), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
+    # Indeks pod paginację historii: WHERE user_id = ? AND id < ? ORDER BY id DESC.
+    # AUTOINCREMENT: SQLite nie użyje ponownie id usuniętego raportu - cache renderowania i odpowiedzi
+    # są kluczowane id, a inne procesy serwera nie wiedzą o usunięciu (wyciek cudzego raportu)
+    __table_args__ = (db.Index('ix_report_user_id_id', 'user_id', 'id'), {'sqlite_autoincrement': True})
+
+    def get_gus_data(self):
+        return unpack_report_data(self.data) if self.data is not None else None
+
+
+class JobState(db.Model):
+    """Stan zadania generowania raportu widoczny dla wszystkich procesów serwera (JOB_SHARED_STATE)."""
+    __tablename__ = 'report_job'
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    status = db.Column(db.String(16), nullable=False)
+    state = db.Column(db.Text, nullable=False) # JSON z ReportJob.to_dict()
+    updated_at = db.Column(db.Float, nullable=False, index=True)
+
+# --- Metryki ---
+# Lekkie histogramy i liczniki bez zewnętrznych zależności. Pomiar etapu to dwa
+# wywołania perf_counter i jedno bisect pod blokadą - rzędu pojedynczych mikrosekund.
+
+# Przedziały (w sekundach / bajtach) dopasowane do typowych czasów modelu i rozmiarów odpowiedzi
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            yield self.name + _format_labels(self.label_names, label_values), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {} # wartości etykiet -> [liczniki przedziałów..., +Inf, suma, liczba]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 3)
+            series[index] += 1 # Przedział nieskumulowany; sumujemy dopiero przy eksporcie
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                yield self.name + '_bucket' + _format_labels(self.label_names, label_values, ('le', _format_number(float(bound)))), cumulative
+            yield self.name + '_sum' + _format_labels(self.label_names, label_values), series[-2]
+            yield self.name + '_count' + _format_labels(self.label_names, label_values), series[-1]
+
+
+class Gauge:
+    """Wartość odczytywana w chwili eksportu (np. długość kolejki)."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = ()
+        self._read = read
+
+    def samples(self):
+        yield self.name, self._read()
+
+
+class Span:
+    """
+    Pomiar czasu jednego etapu: `with Span(histogram, labels, timings, 'db_ms'):`.
+    Zapisuje obserwację w histogramie i (opcjonalnie) czas w ms w słowniku etapów zadania.
+    """
+
+    __slots__ = ('histogram', 'labels', 'timings', 'key', 'started', 'elapsed')
+
+    def __init__(self, histogram, labels=(), timings=None, key=None):
+        self.histogram = histogram
+        self.labels = labels
+        self.timings = timings
+        self.key = key
+        self.elapsed = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.started
+        self.histogram.observe(self.elapsed, *self.labels)
+        if self.timings is not None:
+            self.timings[self.key] = round(self.elapsed * 1000, 2)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, value in metric.samples():
+                lines.append(f"{name} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def series_count_bucket(count):
+    # Liczba serii jako etykieta o ograniczonej liczbie wartości
+    if count <= 1:
+        return '1'
+    if count <= 5:
+        return '2-5'
+    if count <= 20:
+        return '6-20'
+    return '21+'
+
+
+metrics = MetricsRegistry()
+MODEL_LATENCY = metrics.register(Histogram(
+    'gus_model_latency_seconds', 'Czas pobrania danych z modelu (źródła danych).', ('model',)))
+MODEL_RESPONSE_SIZE = metrics.register(Histogram(
+    'gus_model_response_bytes', 'Rozmiar surowej odpowiedzi modelu.', ('model',), buckets=SIZE_BUCKETS))
+MODEL_ERRORS = metrics.register(Counter(
+    'gus_model_errors_total', 'Odpowiedzi modelu zakończone błędem.', ('model',)))
+JSON_PARSE_TIME = metrics.register(Histogram(
+    'gus_json_parse_seconds', 'Czas parsowania i walidacji JSON z odpowiedzi modelu.'))
+MODEL_REPAIRS = metrics.register(Counter(
+    'gus_model_response_repairs_total', 'Usterki odpowiedzi modelu naprawione lokalnie.', ('issue',)))
+MODEL_RETRIES = metrics.register(Counter(
+    'gus_model_validation_retries_total', 'Ponowne zapytania do modelu po nienaprawialnym błędzie odpowiedzi.', ('error',)))
+RENDER_TIME = metrics.register(Histogram(
+    'gus_render_seconds', 'Czas renderowania raportu HTML.', ('series',)))
+RENDER_CACHE_REQUESTS = metrics.register(Counter(
+    'gus_render_cache_requests_total', 'Odczyty cache wyrenderowanych raportów.', ('result',)))
+DB_COMMIT_TIME = metrics.register(Histogram(
+    'gus_db_commit_seconds', 'Czas zapisu raportu w bazie (commit).'))
+RESPONSE_CACHE_REQUESTS = metrics.register(Counter(
+    'gus_response_cache_requests_total', 'Odczyty cache odpowiedzi modelu.', ('result',)))
+RATE_LIMITED = metrics.register(Counter(
+    'gus_rate_limited_total', 'Zapytania odrzucone lub wstrzymane przez limity.', ('scope',)))
+MODEL_DOWNGRADES = metrics.register(Counter(
+    'gus_model_downgrades_total', 'Wywołania skierowane do tańszego modelu z powodu długiej kolejki.', ('model',)))
+IDENTITY_CACHE_REQUESTS = metrics.register(Counter(
+    'gus_identity_cache_requests_total', 'Odczyty cache tożsamości użytkowników (load_user).', ('result',)))
+INDICATOR_STORE_REQUESTS = metrics.register(Counter(
+    'gus_indicator_store_requests_total', 'Zapytania obsłużone z lokalnej bazy wskaźników (hit, partial, miss).', ('result',)))
+JOB_DURATION = metrics.register(Histogram(
+    'gus_job_seconds', 'Czas całego zadania generowania raportu (od wejścia do kolejki).', ('status',)))
+
+
+# --- Przechowywanie danych raportów ---
+
+# Zwiększ przy każdej zmianie renderera, aby unieważnić cache wyrenderowanych raportów
+RENDERER_VERSION = 7
+
+
+def pack_report_data(gus_data):
+    payload = json_lib.dumps(gus_data, ensure_ascii=False, separators=(',', ':'))
+    return zlib.compress(payload.encode('utf-8'), 6)
+
+
+def unpack_report_data(blob):
+    return json_lib.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+class RenderCache:
+    """Prosty, bezpieczny wątkowo cache LRU wyrenderowanego HTML raportów."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, report_id):
+        with self._lock:
+            for key in [k for k in self._items if k[0] == report_id]:
+                del self._items[key]
+
+
+render_cache = RenderCache(app.config['REPORT_RENDER_CACHE_SIZE'])
+# Gotowe odpowiedzi JSON endpointów raportu (treść, ETag i wersje skompresowane)
+report_payload_cache = RenderCache(app.config['REPORT_PAYLOAD_CACHE_SIZE'])
+
+
+def render_report(report):
+    """Zwraca HTML raportu - z cache albo renderując go z zapisanych danych."""
+    if report.data is None:
+        return report.content # Stary raport zapisany tylko jako HTML
+
+    cache_key = (report.id, RENDERER_VERSION)
+    html = render_cache.get(cache_key)
+    if html is not None:
+        RENDER_CACHE_REQUESTS.inc('hit')
+        return html
+
+    RENDER_CACHE_REQUESTS.inc('miss')
+    gus_data = report.get_gus_data()
+    series = gus_data.get('data_series') if isinstance(gus_data, dict) else None
+    with Span(RENDER_TIME, (series_count_bucket(len(series or [])),)):
+        html = generate_interactive_report_html(gus_data, chart_data_url=f"/api/report/{report.id}/chart",
+                                                chart_id=f"report-chart-{report.id}")
+    render_cache.set(cache_key, html)
+    return html
+
+
+def parse_legacy_report_html(content):
+    """
+    Odtwarza dane strukturalne ze starego raportu zapisanego jako HTML.
+    Korzysta z osadzonej konfiguracji Chart.js (etykiety i wartości serii)
+    oraz z bloków tytułu, komentarza i źródła. Zwraca None, jeśli się nie da.
+    """
+    if not content or 'report-error' in content:
+        return None
+
+    def find(pattern):
+        match = re.search(pattern, content, re.S)
+        return match.group(1).strip() if match else None
+
+    commentary = find(r'<div class="markdown-content">\s*<pre>(.*?)</pre>')
+    config_json = find(r"data-chart-config='(.*?)'></canvas>")
+
+    # Prosta odpowiedź tekstowa (ścieżka B renderera)
+    if config_json is None:
+        if commentary is None:
+            return None
+        return {'status': 'not_found', 'data_meta': {'statistical_commentary': commentary}, 'data_series': []}
+
+    try:
+        chart_config = json_lib.loads(config_json)
+    except json_lib.JSONDecodeError:
+        return None
+
+    chart_data = chart_config.get('data', {})
+    labels = chart_data.get('labels', [])
+    scales = chart_config.get('options', {}).get('scales', {})
+
+    # Jednostka nie trafiała do wykresu - odczytujemy ją z pierwszej komórki wartości w tabeli
+    unit = ''
+    first_value = find(r'<tbody>\s*<tr><td>.*?</td><td>(.*?)</td>')
+    if first_value:
+        unit_match = re.match(r'-?\d+(?:\.\d+)?(?:e[-+]?\d+)?(.*)$', first_value)
+        if unit_match:
+            unit = unit_match.group(1)
+
+    data_meta = {
+        'title': find(r'<div class="interactive-report">\s*<h2>(.*?)</h2>') or 'Raport Danych',
+        'chart_type_suggestion': chart_config.get('type', 'line'),
+        'source_info': find(r'<p class="source-info">Źródło danych: (.*?)</p>') or 'Brak danych o źródle',
+        'latest_period': find(r'Aktualna wartość \((.*?)\)</span>') or 'N/A',
+        'unit': unit,
+        'x_axis_label': scales.get('x', {}).get('title', {}).get('text', 'Okres'),
+        'y_axis_label': scales.get('y', {}).get('title', {}).get('text', 'Wartość'),
+        'statistical_commentary': commentary or 'Brak komentarza analitycznego.'
+    }
+    data_series = []
+    for dataset in chart_data.get('datasets', []):
+        data_series.append({
+            'series_name': dataset.get('label', 'Nienazwana seria'),
+            'data_points': [
+                {'category': category, 'value': value}
+                for category, value in zip(labels, dataset.get('data', []))
+                if value is not None
+            ]
+        })
+    return {'status': 'success', 'data_meta': data_meta, 'data_series': data_series}
+
+
+def upgrade_schema():
+    """Dodaje brakujące kolumny do istniejących tabel (create_all nie modyfikuje tabel)."""
+    columns = {column['name'] for column in db.inspect(db.engine).get_columns('report')}
+    if 'data' not in columns:
+        print("Migracja: dodaję kolumnę report.data")
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE report ADD COLUMN data BLOB"))
+    if 'prompt_version' not in columns:
+        print("Migracja: dodaję kolumnę report.prompt_version")
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE report ADD COLUMN prompt_version VARCHAR(64)"))
+    if db.engine.dialect.name == 'sqlite':
+        upgrade_report_autoincrement()
+    for index in Report.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    ensure_search_index()
+
+
+def upgrade_report_autoincrement():
+    """
+    Przebudowuje tabelę report z AUTOINCREMENT (SQLite nie zmienia tego przez ALTER TABLE).
+    Indeksy odtwarza upgrade_schema; indeks FTS jest kluczowany tymi samymi id, więc zostaje.
+    """
+    with db.engine.begin() as conn:
+        table_sql = conn.execute(db.text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'report'")).scalar()
+        if not table_sql or 'AUTOINCREMENT' in table_sql.upper():
+            return
+        print("Migracja: przebudowuję tabelę report z AUTOINCREMENT")
+        columns = ', '.join(column.name for column in Report.__table__.columns)
+        create_sql = str(CreateTable(Report.__table__).compile(dialect=conn.dialect))
+        conn.execute(db.text(create_sql.replace('CREATE TABLE report ', 'CREATE TABLE report_new ', 1)))
+        conn.execute(db.text(f"INSERT INTO report_new ({columns}) SELECT {columns} FROM report"))
+        conn.execute(db.text("DROP TABLE report"))
+        conn.execute(db.text("ALTER TABLE report_new RENAME TO report"))
+
+
+def migrate_legacy_reports(batch_size=100, keep_html=False):
+    """
+    Przenosi stare raporty (sam HTML) do kolumny 'data', partiami po `batch_size`.
+    Raporty, których nie da się odtworzyć, zostają przy swoim HTML-u.
+    Zwraca (liczba_przeniesionych, liczba_pominiętych).
+    """
+    migrated = skipped = 0
+    last_id = 0
+    while True:
+        batch = (Report.query
+                 .filter(Report.data.is_(None), Report.id > last_id)
+                 .order_by(Report.id)
+                 .limit(batch_size)
+                 .all())
+        if not batch:
+            break
+        for report in batch:
+            last_id = report.id
+            gus_data = parse_legacy_report_html(report.content)
+            if gus_data is None:
+                skipped += 1
+                continue
+            report.data = pack_report_data(gus_data)
+            if not keep_html:
+                report.content = ''
+            migrated += 1
+        db.session.commit()
+    return migrated, skipped
+
+
+@app.cli.command('migrate-reports')
+@click.option('--batch-size', default=100, help='Liczba raportów przetwarzanych w jednej transakcji.')
+@click.option('--keep-html', is_flag=True, help='Nie usuwaj starego HTML-a po migracji.')
+@click.option('--vacuum', is_flag=True, help='Wykonaj VACUUM po migracji, aby zmniejszyć plik bazy.')
+def migrate_reports_command(batch_size, keep_html, vacuum):
+    """Aktualizuje schemat i przenosi stare raporty HTML do danych strukturalnych."""
+    db.create_all()
+    upgrade_schema()
+    migrated, skipped = migrate_legacy_reports(batch_size=batch_size, keep_html=keep_html)
+    click.echo(f"Przeniesiono raportów: {migrated}, pominięto: {skipped}")
+    if vacuum:
+        with db.engine.connect() as conn:
+            conn.execute(db.text("VACUUM"))
+        click.echo("VACUUM zakończony.")
+
+
+# --- Wyszukiwanie pełnotekstowe (FTS5) ---
+
+# Ustawiane przez ensure_search_index(); do tego czasu zdarzenia modelu nie dotykają indeksu
+search_index_ready = False
+
+# Wagi kolumn dla bm25: title, prompt, meta_title, commentary, series_names
+SEARCH_COLUMN_WEIGHTS = (10.0, 5.0, 8.0, 2.0, 3.0)
+
+
+def ensure_search_index():
+    """Tworzy tabelę wirtualną FTS5 (jeśli baza to SQLite z obsługą FTS5)."""
+    global search_index_ready
+    if db.engine.dialect.name != 'sqlite':
+        print("OSTRZEŻENIE: Wyszukiwanie pełnotekstowe wymaga SQLite (FTS5) - wyłączone.")
+        return
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS report_fts USING fts5(
+                    title, prompt, meta_title, commentary, series_names,
+                    user_id UNINDEXED,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            """))
+        search_index_ready = True
+    except Exception as e:
+        print(f"OSTRZEŻENIE: Nie udało się utworzyć indeksu FTS5: {e}")
+
+
+def search_document(report):
+    """Pola raportu trafiające do indeksu wyszukiwania."""
+    gus_data = report.get_gus_data() if report.data is not None else None
+    if not isinstance(gus_data, dict):
+        gus_data = {}
+    data_meta = gus_data.get('data_meta') or {}
+    data_series = gus_data.get('data_series') or []
+    return {
+        'id': report.id,
+        'title': report.title,
+        'prompt': report.prompt,
+        'meta_title': data_meta.get('title', ''),
+        'commentary': data_meta.get('statistical_commentary') or gus_data.get('message', ''),
+        'series_names': ' | '.join(str(s.get('series_name', '')) for s in data_series if isinstance(s, dict)),
+        'user_id': report.user_id
+    }
+
+
+def index_report(connection, report):
+    doc = search_document(report)
+    connection.execute(db.text("DELETE FROM report_fts WHERE rowid = :id"), {'id': doc['id']})
+    connection.execute(db.text("""
+        INSERT INTO report_fts (rowid, title, prompt, meta_title, commentary, series_names, user_id)
+        VALUES (:id, :title, :prompt, :meta_title, :commentary, :series_names, :user_id)
+    """), doc)
+
+
+# Indeks aktualizujemy w tej samej transakcji co zapis raportu
+@db.event.listens_for(Report, 'after_insert')
+@db.event.listens_for(Report, 'after_update')
+def _sync_search_index(mapper, connection, report):
+    if search_index_ready:
+        index_report(connection, report)
+
+
+@db.event.listens_for(Report, 'after_delete')
+def _remove_from_search_index(mapper, connection, report):
+    if search_index_ready:
+        connection.execute(db.text("DELETE FROM report_fts WHERE rowid = :id"), {'id': report.id})
+
+
+def backfill_search_index(batch_size=None, pause=None):
+    """
+    Indeksuje raporty, których brakuje w report_fts - krótkimi partiami,
+    każda we własnej transakcji, z przerwą pomiędzy nimi. Zwraca liczbę zaindeksowanych.
+    """
+    if not search_index_ready:
+        return 0
+    batch_size = batch_size or app.config['SEARCH_BACKFILL_BATCH']
+    pause = app.config['SEARCH_BACKFILL_PAUSE'] if pause is None else pause
+
+    indexed = 0
+    last_id = 0
+    while True:
+        batch = (Report.query
+                 .filter(Report.id > last_id)
+                 .filter(db.text("NOT EXISTS (SELECT 1 FROM report_fts WHERE report_fts.rowid = report.id)"))
+                 .order_by(Report.id)
+                 .limit(batch_size)
+                 .all())
+        if not batch:
+            break
+        with db.engine.begin() as conn:
+            for report in batch:
+                index_report(conn, report)
+        last_id = batch[-1].id
+        indexed += len(batch)
+        db.session.expunge_all() # Nie trzymamy w pamięci przetworzonych raportów
+        time.sleep(pause)
+    return indexed
+
+
+def start_search_backfill():
+    def run():
+        with app.app_context():
+            indexed = backfill_search_index()
+            if indexed:
+                print(f"Indeks wyszukiwania: dodano {indexed} raportów.")
+
+    threading.Thread(target=run, name='search-backfill', daemon=True).start()
+
+
+@app.cli.command('backfill-search-index')
+@click.option('--batch-size', default=None, type=int, help='Liczba raportów w jednej transakcji.')
+def backfill_search_index_command(batch_size):
+    """Uzupełnia indeks wyszukiwania pełnotekstowego o brakujące raporty."""
+    db.create_all()
+    upgrade_schema()
+    indexed = backfill_search_index(batch_size=batch_size)
+    click.echo(f"Zaindeksowano raportów: {indexed}")
+
+
+def build_fts_query(text):
+    # Każde słowo jako fraza w cudzysłowie z dopasowaniem prefiksu - użytkownik nie wstrzyknie składni FTS5
+    words = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def highlight_snippet(snippet):
+    # snippet() otacza trafienia znacznikami \x02...\x03; resztę tekstu escapujemy
+    return html_lib.escape(snippet).replace('\x02', '<mark>').replace('\x03', '</mark>')
+
+
+# --- Cache tożsamości użytkowników ---
+
+class SessionUser(UserMixin):
+    """
+    Lekka tożsamość zalogowanego użytkownika zwracana przez load_user: tylko id i e-mail,
+    bez hasła i bez powiązania z sesją SQLAlchemy, więc można ją trzymać w cache między żądaniami.
+    """
+
+    def __init__(self, id, email):
+        self.id = id
+        self.email = email
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.email)
+
+
+class IdentityCache:
+    """
+    Cache LRU z czasem życia (TTL) dla SessionUser, kluczowany id użytkownika.
+    Przy `shared_path` unieważnienia trafiają też do wspólnej tabeli SQLite; każdy proces
+    odczytuje nowe wpisy co `sync_interval` sekund (a nie przy każdym żądaniu) i usuwa
+    u siebie nieaktualnych użytkowników.
+    """
+
+    def __init__(self, max_size, ttl_seconds, shared_path=None, sync_interval=2.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.shared_path = shared_path
+        self.sync_interval = sync_interval
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._synced_at = time.time()
+        if shared_path:
+            self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.shared_path, timeout=10)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS identity_invalidation (
+                    user_id INTEGER PRIMARY KEY,
+                    invalidated_at REAL NOT NULL
+                )
+            """)
+
+    def get(self, user_id):
+        now = time.time()
+        if self.shared_path and now - self._synced_at >= self.sync_interval:
+            self._sync(now)
+        with self._lock:
+            entry = self._items.get(user_id)
+            if entry is None:
+                return None
+            user, loaded_at = entry
+            if now - loaded_at > self.ttl_seconds:
+                del self._items[user_id]
+                return None
+            self._items.move_to_end(user_id)
+            return user
+
+    def set(self, user):
+        with self._lock:
+            self._items[user.id] = (user, time.time())
+            self._items.move_to_end(user.id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._items.pop(user_id, None)
+        if not self.shared_path:
+            return
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO identity_invalidation (user_id, invalidated_at) VALUES (?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET invalidated_at = excluded.invalidated_at",
+                    (user_id, now)
+                )
+                # Starsze wpisy nie są potrzebne - takie dane i tak wygasły już z TTL
+                conn.execute("DELETE FROM identity_invalidation WHERE invalidated_at < ?", (now - self.ttl_seconds,))
+        except sqlite3.Error as e:
+            print(f"Ostrzeżenie: Nie udało się zapisać unieważnienia użytkownika {user_id}: {e}")
+
+    def _sync(self, now):
+        # Zapas 1 s na zapisy, które skończyły się tuż przed poprzednią synchronizacją
+        since = self._synced_at - 1.0
+        self._synced_at = now
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT user_id FROM identity_invalidation WHERE invalidated_at >= ?", (since,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Ostrzeżenie: Nie udało się odczytać unieważnień użytkowników: {e}")
+            return
+        with self._lock:
+            for (user_id,) in rows:
+                self._items.pop(user_id, None)
+
+
+identity_cache = IdentityCache(
+    app.config['IDENTITY_CACHE_SIZE'],
+    app.config['IDENTITY_CACHE_TTL'],
+    shared_path=app.config['IDENTITY_CACHE_PATH'] if app.config['IDENTITY_CACHE_SHARED'] else None,
+    sync_interval=app.config['IDENTITY_CACHE_SYNC_INTERVAL']
+)
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    if app.config['IDENTITY_CACHE_ENABLED']:
+        user = identity_cache.get(user_id)
+        if user is not None:
+            IDENTITY_CACHE_REQUESTS.inc('hit')
+            return user
+        IDENTITY_CACHE_REQUESTS.inc('miss')
+    # Tylko potrzebne kolumny - bez hasha hasła
+    row = db.session.execute(db.select(User.id, User.email).where(User.id == user_id)).first()
+    if row is None:
+        return None
+    user = SessionUser(row.id, row.email)
+    if app.config['IDENTITY_CACHE_ENABLED']:
+        identity_cache.set(user)
+    return user
+
+
+# Zmiana danych użytkownika (np. hasła) unieważnia jego wpis w cache - dopiero po commicie,
+# aby inne wątki nie zdążyły wczytać i zapamiętać danych sprzed zmiany
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def _mark_identity_changed(mapper, connection, user):
+    db.inspect(user).session.info.setdefault('changed_user_ids', set()).add(user.id)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_identities(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        identity_cache.invalidate(user_id)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _discard_identity_changes(session):
+    session.info.pop('changed_user_ids', None)
 
 # --- Trasy (Routes) ---
 
+def get_history_page(user_id, before_id=None, limit=None):
+    """
+    Zwraca (lista {id, title}, kursor następnej strony) dla historii użytkownika.
+    Paginacja po kluczu (id < before_id) zamiast OFFSET - koszt nie rośnie z długością historii.
+    """
+    limit = limit or app.config['HISTORY_PAGE_SIZE']
+    query = (db.session.query(Report.id, Report.title)
+             .filter(Report.user_id == user_id))
+    if before_id is not None:
+        query = query.filter(Report.id < before_id)
+    rows = query.order_by(Report.id.desc()).limit(limit + 1).all()
+
+    items = [{'id': row.id, 'title': row.title} for row in rows[:limit]]
+    next_cursor = items[-1]['id'] if len(rows) > limit else None
+    return items, next_cursor
+
+
 @app.route('/')
 @login_required
 def index():
-    user_reports = Report.query.filter_by(user_id=current_user.id).order_by(Report.id.desc()).all()
+    # Renderujemy tylko pierwszą stronę historii, kolejne dociąga main.js przy przewijaniu
+    history, next_cursor = get_history_page(current_user.id)
     # --- POPRAWKA ---
     # Upewniamy się, że ładujemy plik 'index.html'
-    return render_template('index.html', history=user_reports or [])
+    return render_template('index.html', history=history, next_cursor=next_cursor)
     # --- KONIEC POPRAWKI ---
 
 # --- Twoje trasy /login, /register, /logout (bez zmian) ---
@@ -82,7 +999,8 @@ def login():
         password = request.form.get('password')
         user = User.query.filter_by(email=email).first()
         if user and bcrypt.check_password_hash(user.password, password):
-            login_user(user, remember=True)
+            # W sesji trzymamy lekką tożsamość (bez hasła), tak jak zwraca ją load_user
+            login_user(SessionUser.from_user(user), remember=True)
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('index'))
         else:
@@ -110,472 +1028,3180 @@ def register():
 
 @app.route('/logout')
 def logout():
+    if current_user.is_authenticated:
+        identity_cache.invalidate(current_user.id)
     logout_user()
     return redirect(url_for('login'))
 
 
 # --- NOWA, ROZBUDOWANA FUNKCJA GENERUJĄCA RAPORT HTML ---
 
-def generate_interactive_report_html(gus_data):
+# --- Funkcje pomocnicze dla szablonów raportu (templates/report) ---
+
+@app.template_global()
+def get_diff_class(diff, unit):
+    if diff is None: return "diff-neutral"
+    # Zakładamy, że spadek to dobrze (jak w bezrobociu)
+    if unit == '%': # Specjalna logika dla procentów (np. bezrobocie)
+        if diff < 0: return "diff-positive" 
+        if diff > 0: return "diff-negative"
+    else: # Ogólna logika (wzrost = dobrze)
+        if diff > 0: return "diff-positive"
+        if diff < 0: return "diff-negative"
+    return "diff-neutral"
+
+@app.template_global()
+def get_diff_icon(diff, unit):
+    """Nazwa ikony Lucide dla zmiany (element <i data-lucide> buduje szablon)."""
+    if diff is None: return "minus"
+    if unit == '%':
+            if diff < 0: return "arrow-down-right"
+            if diff > 0: return "arrow-up-right"
+    else:
+            if diff > 0: return "arrow-up-right"
+            if diff < 0: return "arrow-down-right"
+    return "minus"
+
+@app.template_global()
+def format_diff(diff, unit):
+    if diff is None: return "Brak danych"
+    return f"{diff:+.1f} {unit if unit != '%' else 'p.p.'}"
+
+
+# --- Analityka serii (NumPy) ---
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def parse_series_values(data_points):
     """
-    Przetwarza pełny JSON z GUS (z Gemini) i generuje bogaty raport HTML.
-    Jest odporna na różne formaty wejściowe i obsługuje wiele serii danych.
+    Jednorazowa konwersja punktów serii na (lista kategorii, tablica float64).
+    Błędne wartości stają się NaN - maska `~np.isnan(values)` wskazuje poprawne punkty.
     """
+    categories = [str(p.get('category', '')) for p in data_points]
     try:
-        # --- ŚCIEŻKA A: Pełny raport z danymi (wykrywamy po 'data_series') ---
-        if isinstance(gus_data, dict) and gus_data.get('data_series'):
-            data_meta = gus_data.get('data_meta', {})
-            # Sprawdzamy, czy data_series nie jest pustą listą
-            if not gus_data['data_series']:
-                    raise ValueError("Klucz 'data_series' jest pustą listą.")
-                    
-            title = data_meta.get('title', 'Raport Danych')
-            source = data_meta.get('source_info', 'Brak danych o źródle')
-            statistical_commentary = data_meta.get('statistical_commentary', 'Brak komentarza analitycznego.')
-            unit = data_meta.get('unit', '') # Pobieramy jednostkę
-
-            # --- Funkcje pomocnicze do budowy HTML ---
-            def get_diff_class(diff):
-                if diff is None: return "diff-neutral"
-                # Zakładamy, że spadek to dobrze (jak w bezrobociu)
-                if unit == '%': # Specjalna logika dla procentów (np. bezrobocie)
-                    if diff < 0: return "diff-positive" 
-                    if diff > 0: return "diff-negative"
-                else: # Ogólna logika (wzrost = dobrze)
-                    if diff > 0: return "diff-positive"
-                    if diff < 0: return "diff-negative"
-                return "diff-neutral"
-
-            def get_diff_icon(diff):
-                if diff is None: return '<i data-lucide="minus"></i>'
-                if unit == '%':
-                        if diff < 0: return '<i data-lucide="arrow-down-right"></i>'
-                        if diff > 0: return '<i data-lucide="arrow-up-right"></i>'
-                else:
-                        if diff > 0: return '<i data-lucide="arrow-up-right"></i>'
-                        if diff < 0: return '<i data-lucide="arrow-down-right"></i>'
-                return '<i data-lucide="minus"></i>'
-            
-            def format_diff(diff):
-                if diff is None: return "Brak danych"
-                return f"{diff:+.1f} {unit if unit != '%' else 'p.p.'}"
-
-            # --- Przetwarzanie każdej serii danych osobno dla KPI i statystyk ---
-            series_analysis_html_parts = []
-            for series in gus_data['data_series']:
-                series_name = series.get('series_name', 'Nienazwana seria')
-                data_points = series.get('data_points', [])
-
-                if not data_points:
-                    # Jeśli seria nie ma punktów danych, pomijamy ją w analizie KPI
-                    series_analysis_html_parts.append(f"<h4>Analiza dla '{series_name}'</h4><p>Brak punktów danych do analizy.</p>")
-                    continue
+        # Szybka ścieżka: dane po walidacji mają liczby albo None (np.array zamienia None na NaN)
+        values = np.array([p['value'] for p in data_points], dtype=np.float64)
+    except (ValueError, TypeError, KeyError):
+        # Stare raporty zapisane przed walidacją odpowiedzi
+        values = np.fromiter((_to_float(p.get('value')) for p in data_points), dtype=np.float64, count=len(data_points))
+    return categories, values
 
-                # Konwersja na liczby z obsługą błędów
-                values = []
-                valid_data_points = []
-                for p in data_points:
-                    try:
-                        values.append(float(p['value']))
-                        valid_data_points.append(p)
-                    except (ValueError, TypeError):
-                        print(f"Ostrzeżenie: Pomijam błędny punkt danych w serii '{series_name}': {p}")
-                
-                if not values:
-                    series_analysis_html_parts.append(f"<h4>Analiza dla '{series_name}'</h4><p>Brak poprawnych punktów danych do analizy.</p>")
-                    continue
 
-                data_points = valid_data_points # Używamy tylko poprawnych punktów
-
-                # Obliczenia KPI dla bieżącej serii
-                latest_point = data_points[-1]
-                previous_point = data_points[-2] if len(data_points) > 1 else None
-                
-                yoy_point = None
-                latest_date_parts = latest_point['category'].split('-')
-                if len(latest_date_parts) >= 2:
-                    try:
-                        yoy_category = f"{int(latest_date_parts[0]) - 1}-{latest_date_parts[1]}"
-                        yoy_point = next((p for p in data_points if p['category'] == yoy_category), None)
-                    except (ValueError, IndexError):
-                        print(f"Ostrzeżenie: Nie można obliczyć r/r dla kategorii: {latest_point['category']}")
-
-                kpi_latest = latest_point['value']
-                kpi_mom_diff = round(kpi_latest - previous_point['value'], 2) if previous_point else None
-                kpi_yoy_diff = round(kpi_latest - yoy_point['value'], 2) if yoy_point else None
-
-                kpi_max = max(values)
-                kpi_max_point = next(p for p in data_points if p['value'] == kpi_max)
-                kpi_max_date = kpi_max_point['category']
-
-                kpi_min = min(values)
-                kpi_min_point = next(p for p in data_points if p['value'] == kpi_min)
-                kpi_min_date = kpi_min_point['category']
-
-                stat_mean = round(statistics.mean(values), 2)
-                stat_median = round(statistics.median(values), 2)
-                stat_stddev = round(statistics.stdev(values), 2) if len(values) > 1 else 0
-                
-                latest_period_str = data_meta.get('latest_period', 'N/A') # Bierzemy z meta, bo jest wspólne
-
-                # Budowanie HTML dla bieżącej serii
-                kpi_html = f"""
-                <div class="kpi-container">
-                    <div class="kpi-card">
-                        <span class="kpi-title">Aktualna wartość ({latest_period_str})</span>
-                        <span class="kpi-value">{kpi_latest}{unit}</span>
-                    </div>
-                    <div class="kpi-card">
-                        <span class="kpi-title">Zmiana (m/m)</span>
-                        <span class="kpi-value {get_diff_class(kpi_mom_diff)}">
-                            {get_diff_icon(kpi_mom_diff)} {format_diff(kpi_mom_diff)}
-                        </span>
-                    </div>
-                    <div class="kpi-card">
-                        <span class="kpi-title">Zmiana (r/r)</span>
-                        <span class="kpi-value {get_diff_class(kpi_yoy_diff)}">
-                            {get_diff_icon(kpi_yoy_diff)} {format_diff(kpi_yoy_diff)}
-                        </span>
-                    </div>
-                    <div class="kpi-card">
-                        <span class="kpi-title">Minimum</span>
-                        <span class="kpi-value">{kpi_min}{unit} <span class="kpi-date">({kpi_min_date})</span></span>
-                    </div>
-                    <div class="kpi-card">
-                        <span class="kpi-title">Maksimum</span>
-                        <span class="kpi-value">{kpi_max}{unit} <span class="kpi-date">({kpi_max_date})</span></span>
-                    </div>
-                </div>
-                """
-                
-                stats_summary_html = f"""
-                <ul class="stats-summary">
-                    <li>Średnia: <strong>{stat_mean}{unit}</strong></li>
-                    <li>Mediana: <strong>{stat_median}{unit}</strong></li>
-                    <li>Odch. standardowe: <strong>{stat_stddev:.2f} {unit if unit != '%' else 'p.p.'}</strong></li>
-                </ul>
-                """
-
-                series_analysis_html_parts.append(f"""
-                <div class="series-analysis-block">
-                    <h3>Analiza dla serii: {series_name}</h3>
-                    {kpi_html}
-                    {stats_summary_html}
-                </div>
-                """)
-            
-            # Połączenie wszystkich części analizy serii
-            all_series_analysis_html = "".join(series_analysis_html_parts)
+def _yoy_category(category):
+    # '2024-04' -> '2023-04' (działa też dla '2024-Q2'); None, jeśli kategoria nie jest okresem
+    parts = category.split('-')
+    if len(parts) < 2:
+        return None
+    try:
+        return f"{int(parts[0]) - 1}-{parts[1]}"
+    except ValueError:
+        return None
 
 
-            # B. Wykres (Canvas + dane dla Chart.js) - WERSJA DLA WIELU SERII
-            canvas_id = f"report-chart-{int(time.time() * 1000)}"
-            
-            # Zakładamy, że wszystkie serie mają te same etykiety (osie X)
-            # Bierzemy etykiety z pierwszej serii, która ma dane
-            first_valid_series = next((s for s in gus_data['data_series'] if s.get('data_points')), None)
-            chart_labels = [p['category'] for p in first_valid_series['data_points']] if first_valid_series else []
-
-            # Definiujemy paletę kolorów dla kolejnych linii
-            chart_colors = [
-                {"border": "#3e95cd", "bg": "rgba(62, 149, 205, 0.2)"}, # Niebieski
-                {"border": "#c45850", "bg": "rgba(196, 88, 80, 0.2)"}, # Czerwony
-                {"border": "#3cba9f", "bg": "rgba(60, 186, 159, 0.2)"}, # Zielony
-                {"border": "#e8c3b9", "bg": "rgba(232, 195, 185, 0.2)"}, # Różowy
-                {"border": "#8e5ea2", "bg": "rgba(142, 94, 162, 0.2)"}  # Fioletowy
-            ]
+def analyze_series(series):
+    """
+    Liczy wszystkie KPI i statystyki opisowe serii w jednym przebiegu na tablicy NumPy.
+    Zwraca słownik z kategoriami, wartościami, maską poprawnych punktów i wynikami.
+    """
+    categories, values = parse_series_values(series.get('data_points', []))
+    valid = ~np.isnan(values)
+    valid_idx = np.flatnonzero(valid)
 
-            datasets_list = []
-            # Iterujemy po WSZYSTKICH seriach zwróconych przez AI
-            for i, series in enumerate(gus_data['data_series']):
-                series_data_points = series.get('data_points', [])
-                # WAŻNE: Wartości dla wykresu muszą być pobrane z KAŻDEJ serii
-                # Musimy też obsłużyć błędy konwersji, tak jak robiliśmy to dla KPI
-                series_values = []
-                for p in series_data_points:
-                    try:
-                        series_values.append(float(p['value']))
-                    except (ValueError, TypeError):
-                        series_values.append(None) # Dodaj null, jeśli dana jest błędna
-                        
-                color = chart_colors[i % len(chart_colors)] # Wybierz kolor z palety (zapętla się)
-                
-                dataset_object = {
-                    "label": series.get('series_name', f'Seria {i+1}'),
-                    "data": series_values,
-                    "borderColor": color["border"],
-                    "backgroundColor": color["bg"],
-                    "fill": True,
-                    "tension": 0.1
-                }
-                datasets_list.append(dataset_object)
-
-            chart_config = {
-                "type": data_meta.get("chart_type_suggestion", "line"),
-                "data": {
-                    "labels": chart_labels,
-                    "datasets": datasets_list # <-- POPRAWKA: Używamy dynamicznej listy
-                },
-                "options": {
-                    "responsive": True,
-                    "maintainAspectRatio": False,
-                    "plugins": {
-                        "title": {
-                            "display": True, 
-                            "text": title, 
-                            "color": "#E0E0E0" # Jasnoszary kolor tytułu
-                        },
-                        "legend": {
-                            "labels": {
-                                "color": "#E0E0E0" # Jasnoszary kolor tekstu legendy
-                            }
-                        }
-                    },
-                    "scales": {
-                        "x": {
-                            "title": {
-                                "display": True, 
-                                "text": data_meta.get('x_axis_label', 'Okres'), 
-                                "color": "#B0B0B0" # Jasnoszary kolor osi
-                            },
-                            "ticks": { "color": "#B0B0B0" },
-                            "grid": { "color": "rgba(255, 255, 255, 0.1)" }
-                        },
-                        "y": {
-                            "title": {
-                                "display": True, 
-                                "text": data_meta.get('y_axis_label', 'Wartość'), 
-                                "color": "#B0B0B0" # Jasnoszary kolor osi
-                            },
-                            "ticks": { "color": "#B0B0B0" },
-                            "grid": { "color": "rgba(255, 255, 255, 0.1)" }
-                        }
-                    }
-                }
-            }
-            
-            # Serializujemy JSON i "wstrzykujemy" go do atrybutu data-
-            chart_html = f"""
-            <div class="chart-container">
-                <canvas id="{canvas_id}" data-chart-config='{json_lib.dumps(chart_config)}'></canvas>
-            </div>
-            """
-            
-            # C. Komentarz analityczny (jako Markdown)
-            analysis_html = f"""
-            <h3>Analiza Statystyczna</h3>
-            <div class="markdown-content">
-                <pre>{statistical_commentary}</pre>
-            </div>
-            """
-
-            # D. Tabela ze szczegółowymi danymi - WERSJA DLA WIELU SERII
-            
-            # 1. Nagłówki tabeli
-            headers = ["<th>Okres</th>"]
-            for series in gus_data['data_series']:
-                series_name = series.get('series_name', 'Brak nazwy')
-                headers.append(f"<th>{series_name}</th>")
-            header_html = "".join(headers)
-
-            # 2. Przygotowanie danych do tabeli
-            # Tworzymy słownik dla każdej serii, mapujący kategorię na wartość
-            series_data_maps = []
-            for series in gus_data['data_series']:
-                data_map = {}
-                for p in series.get('data_points', []):
-                    try:
-                        # Próbujemy przekonwertować wartość na float, jeśli się nie uda, zostawiamy oryginalną
-                        value_str = f"{float(p['value'])}{unit}"
-                    except (ValueError, TypeError, KeyError):
-                        value_str = p.get('value', 'Brak danych') # Jeśli nie ma 'value' lub nie jest liczbą
-                    data_map[p.get('category')] = value_str
-                series_data_maps.append(data_map)
-
-            # 3. Budowanie wierszy tabeli
-            # Używamy kategorii z pierwszej serii jako podstawy dla osi X
-            table_rows_list = []
-            # Iterujemy po odwróconych punktach danych pierwszej serii, aby najnowsze były na górze
-            if first_valid_series:
-                for p in reversed(first_valid_series.get('data_points', [])):
-                    category = p['category']
-                    row_cells = [f"<td>{category}</td>"]
-                    # Dla każdej serii, znajdujemy wartość dla danej kategorii
-                    for data_map in series_data_maps:
-                        value = data_map.get(category, "N/A") # 'N/A' jeśli w danej serii brakuje punktu dla tej kategorii
-                        row_cells.append(f"<td>{value}</td>")
-                    table_rows_list.append(f"<tr>{''.join(row_cells)}</tr>")
-            
-            table_rows = "".join(table_rows_list)
-
-            table_html = f"""
-            <h3>Szczegółowe Dane</h3>
-            <div class="table-container">
-                <table class="report-table">
-                    <thead>
-                        <tr>{header_html}</tr>
-                    </thead>
-                    <tbody>
-                        {table_rows}
-                    </tbody>
-                </table>
-            </div>
-            <p class="source-info">Źródło danych: {source}</p>
-            """
-
-            # --- Składanie końcowego HTML ---
-            final_html = f"""
-            <div class="interactive-report">
-                <h2>{title}</h2>
-                {all_series_analysis_html}
-                {chart_html}
-                {analysis_html}
-                {table_html}
-            </div>
-            """
-            return final_html
+    analysis = {
+        'name': series.get('series_name', 'Nienazwana seria'),
+        'categories': categories,
+        'values': values,
+        'valid': valid,
+        'count': len(categories),
+        'valid_count': len(valid_idx)
+    }
+    if not len(valid_idx):
+        return analysis
 
-        # --- ŚCIEŻKA B: Prosta odpowiedź tekstowa (brak 'data_series') ---
-        elif isinstance(gus_data, dict):
-            commentary = gus_data.get('data_meta', {}).get('statistical_commentary')
-            if not commentary:
-                commentary = gus_data.get('text_response') # Dodatkowy fallback
-            if not commentary:
-                commentary = gus_data.get('message', 'Otrzymano odpowiedź, ale bez treści do wyświetlenia.')
-            
-            # Zwracamy jako blok markdown
-            return f'<div class="markdown-content"><pre>{commentary}</pre></div>'
-            
-        # --- ŚCIEŻKA C: Odpowiedź nie jest słownikiem (np. błąd) ---
-        else:
-            return f'<div class="report-error"><p>Otrzymano nieoczekiwany format danych od AI.</p><pre>{str(gus_data)}</pre></div>'
+    valid_values = values[valid_idx]
+    latest_i = valid_idx[-1]
+    latest = values[latest_i]
 
-    except Exception as e:
-        print(f"Błąd podczas generowania raportu HTML: {e}")
-        # Zwróć prosty błąd jako HTML, który pojawi się w czacie
-        return f"""
-        <div class="report-error">
-            <h4>Błąd podczas generowania raportu</h4>
-            <p>Niestety, wystąpił problem podczas analizy danych. Spróbuj zadać pytanie ponownie.</p>
-            <p>Szczegóły błędu: {e}</p>
-        </div>
-        """
+    mom_diff = None
+    if len(valid_idx) > 1:
+        mom_diff = round(float(latest - values[valid_idx[-2]]), 2)
 
+    # r/r: słownik kategoria -> indeks zamiast liniowego wyszukiwania
+    yoy_diff = None
+    yoy_category = _yoy_category(categories[latest_i])
+    if yoy_category is not None:
+        index_by_category = {categories[i]: i for i in valid_idx.tolist()}
+        yoy_i = index_by_category.get(yoy_category)
+        if yoy_i is not None:
+            yoy_diff = round(float(latest - values[yoy_i]), 2)
 
-# --- ENDPOINTY API ---
+    max_i = valid_idx[int(np.argmax(valid_values))]
+    min_i = valid_idx[int(np.argmin(valid_values))]
 
-@app.route('/api/prompt', methods=['POST'])
-@login_required
-def handle_prompt():
-    data = request.json
-    prompt_text = data.get('prompt')
+    analysis.update({
+        'latest': float(latest),
+        'latest_category': categories[latest_i],
+        'mom_diff': mom_diff,
+        'yoy_diff': yoy_diff,
+        'max': float(values[max_i]),
+        'max_category': categories[max_i],
+        'min': float(values[min_i]),
+        'min_category': categories[min_i],
+        'mean': round(float(valid_values.mean()), 2),
+        'median': round(float(np.median(valid_values)), 2),
+        'stddev': round(float(valid_values.std(ddof=1)), 2) if len(valid_values) > 1 else 0
+    })
+    return analysis
 
-    if not prompt_text:
-        return jsonify({'error': 'Brak promptu'}), 400
 
-    try:
-        # 1. Pobierz pełne dane JSON od Gemini
-        gus_data = get_data_from_gus(prompt_text)
-        
-        # 2. Wygeneruj bogaty raport HTML na podstawie tych danych
-        ai_response_content = generate_interactive_report_html(gus_data)
-        
-        # 3. Wygeneruj tytuł dla historii
-        report_title = generate_title_for_history(prompt_text)
-
-        # 4. Zapisz raport (teraz jako HTML) do bazy danych
-        new_report = Report(
-            title=report_title,
-            prompt=prompt_text,
-            content=ai_response_content, # Zapisujemy pełny HTML
-            user_id=current_user.id
-        )
-        db.session.add(new_report)
-        db.session.commit()
+def values_to_json_list(values):
+    """Tablica float64 -> lista dla JSON-a, z NaN zamienionym na null."""
+    result = values.astype(object)
+    result[np.isnan(values)] = None
+    return result.tolist()
 
-        # 5. Zwróć HTML do frontendu
-        return jsonify({
-            'prompt': prompt_text,
-            'response': ai_response_content,
-            'new_history_item': { 'id': new_report.id, 'title': new_report.title }
-        })
 
-    except Exception as e:
-        print(f"Błąd w /api/prompt: {e}")
-        error_html = f'<div class="report-error"><p>Wystąpił błąd serwera: {e}</p></div>'
-        return jsonify({'response': error_html})
+# --- Wyrównanie serii do wspólnej osi kategorii ---
 
+# Częstotliwości od najdrobniejszej do najgrubszej
+PERIOD_FREQUENCIES = ('M', 'Q', 'A')
+PERIOD_PATTERNS = (
+    ('M', re.compile(r'^(\d{4})-(\d{1,2})$')),
+    ('Q', re.compile(r'^(\d{4})[- ]?[QK]([1-4])$', re.I)),
+    ('A', re.compile(r'^(\d{4})$')),
+)
+
+
+@functools.lru_cache(maxsize=1 << 16) # Serie zwykle dzielą te same kategorie
+def parse_period(category):
+    """
+    Zamienia kategorię okresu na (częstotliwość, liczba porządkowa):
+    '2024-03' -> ('M', 2024*12+2), '2024-Q1' -> ('Q', 2024*4), '2024' -> ('A', 2024).
+    Dla kategorii, które nie są okresem, zwraca None.
+    """
+    category = category.strip()
+    for freq, pattern in PERIOD_PATTERNS:
+        match = pattern.match(category)
+        if not match:
+            continue
+        year = int(match.group(1))
+        if freq == 'A':
+            return freq, year
+        sub = int(match.group(2))
+        if freq == 'M' and not 1 <= sub <= 12:
+            return None
+        return freq, year * (12 if freq == 'M' else 4) + sub - 1
+    return None
+
+
+def convert_period(ordinal, source_freq, target_freq):
+    if source_freq == target_freq:
+        return ordinal
+    if source_freq == 'M':
+        return ordinal // 12 if target_freq == 'A' else (ordinal // 12) * 4 + (ordinal % 12) // 3
+    return ordinal // 4 # 'Q' -> 'A'
+
+
+def format_period(ordinal, freq, quarter_prefix='-Q'):
+    if freq == 'A':
+        return str(ordinal)
+    if freq == 'Q':
+        return f"{ordinal // 4}{quarter_prefix}{ordinal % 4 + 1}"
+    return f"{ordinal // 12}-{ordinal % 12 + 1:02d}"
+
+
+def _detect_frequency(categories):
+    # Wspólna częstotliwość serii albo None (kategorie nieokresowe lub mieszane w jednej serii)
+    parsed = [parse_period(c) for c in categories]
+    if not parsed or any(p is None for p in parsed):
+        return None, None
+    frequencies = {freq for freq, _ in parsed}
+    if len(frequencies) != 1:
+        return None, None
+    return frequencies.pop(), np.fromiter((o for _, o in parsed), dtype=np.int64, count=len(parsed))
+
+
+def _resample(ordinals, values, source_freq, target_freq):
+    # Agreguje serię do grubszej częstotliwości (średnia z poprawnych punktów okresu)
+    target = np.fromiter((convert_period(o, source_freq, target_freq) for o in ordinals.tolist()),
+                         dtype=np.int64, count=len(ordinals))
+    keys, inverse = np.unique(target, return_inverse=True)
+    valid = ~np.isnan(values)
+    sums = np.bincount(inverse, weights=np.where(valid, values, 0.0), minlength=len(keys))
+    counts = np.bincount(inverse, weights=valid.astype(np.float64), minlength=len(keys))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    if source_freq == target_freq:
+        return keys, means
+    return keys, np.round(means, 2) # Uśrednione wartości zaokrąglamy jak pozostałe statystyki
+
+
+def align_series(analyses):
+    """
+    Buduje wspólną, posortowaną oś kategorii dla wszystkich serii i zwraca gęstą macierz wartości
+    (wiersz = seria, kolumna = kategoria, NaN = brak danych).
+    Serie okresowe o różnych częstotliwościach (miesięczne/kwartalne/roczne) są agregowane
+    do najgrubszej z nich; oś powstaje w jednym przebiegu scalania posortowanych list.
+    Kategorie nieokresowe (np. struktura) zachowują kolejność pierwszego wystąpienia.
+    """
+    detected = [_detect_frequency(a['categories']) if a['count'] else None for a in analyses]
+    non_empty = [d for d in detected if d is not None]
+    temporal = bool(non_empty) and all(freq is not None for freq, _ in non_empty)
+
+    if temporal:
+        target_freq = max((freq for freq, _ in non_empty), key=PERIOD_FREQUENCIES.index)
+        per_series = []
+        for analysis, detection in zip(analyses, detected):
+            if detection is None:
+                per_series.append((np.empty(0, dtype=np.int64), np.empty(0)))
+                continue
+            source_freq, ordinals = detection
+            per_series.append(_resample(ordinals, analysis['values'], source_freq, target_freq))
+
+        # Scalanie posortowanych kluczy wszystkich serii w jedną oś (bez duplikatów)
+        axis = []
+        for key in heapq.merge(*(keys.tolist() for keys, _ in per_series)):
+            if not axis or axis[-1] != key:
+                axis.append(key)
+        position = {key: i for i, key in enumerate(axis)}
+
+        matrix = np.full((len(analyses), len(axis)), np.nan)
+        for row, (keys, values) in enumerate(per_series):
+            if len(keys):
+                matrix[row, [position[k] for k in keys.tolist()]] = values
+        # Etykiety jak w danych źródłowych ('2021-K2' zostaje '2021-K2', tak jak na kartach KPI);
+        # okresy powstałe tylko z agregacji dostają ten sam zapis kwartału co pozostałe
+        labels = {}
+        for analysis, detection in zip(analyses, detected):
+            if detection is not None and detection[0] == target_freq:
+                for key, category in zip(detection[1].tolist(), analysis['categories']):
+                    labels.setdefault(key, str(category).strip())
+        quarter_prefix = '-Q'
+        if target_freq == 'Q' and labels:
+            quarter_prefix = re.match(r'^\d{4}([- ]?[QK])', next(iter(labels.values())), re.I).group(1)
+        categories = [labels.get(key) or format_period(key, target_freq, quarter_prefix) for key in axis]
+        resampled = any(freq != target_freq for freq, _ in non_empty)
+        return {'categories': categories, 'matrix': matrix, 'frequency': target_freq, 'resampled': resampled}
+
+    # Kategorie nieokresowe: suma zbiorów w kolejności pierwszego wystąpienia
+    position = {}
+    for analysis in analyses:
+        for category in analysis['categories']:
+            position.setdefault(category, len(position))
+
+    matrix = np.full((len(analyses), len(position)), np.nan)
+    for row, analysis in enumerate(analyses):
+        if analysis['count']:
+            # Przy zduplikowanych kategoriach wygrywa ostatnia wartość
+            matrix[row, [position[c] for c in analysis['categories']]] = analysis['values']
+    return {'categories': list(position), 'matrix': matrix, 'frequency': None, 'resampled': False}
+
+
+# --- Redukcja liczby punktów wykresu ---
+
+def lttb_indices(values, threshold):
+    """
+    Largest-Triangle-Three-Buckets: wybiera `threshold` indeksów punktów, które najlepiej
+    zachowują kształt serii. Braki (NaN) są pomijane; zwraca posortowaną tablicę indeksów.
+    """
+    valid = np.flatnonzero(~np.isnan(values))
+    n = len(valid)
+    if threshold >= n or threshold < 3:
+        return valid
+
+    x = valid.astype(float)
+    y = values[valid]
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        # Średnia następnego kubełka (dla ostatniego - ostatni punkt serii)
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return valid[selected]
+
+
+def minmax_buckets(categories, matrix, max_points):
+    """
+    Dzieli wspólną oś na max_points/2 kubełków i dla każdej serii zostawia minimum i maksimum
+    kubełka (w kolejności wystąpienia) - wszystkie serie dzielą nadal jedną oś etykiet.
+    Wartość trafia na pierwszą lub ostatnią kategorię kubełka, więc obwiednia serii jest zachowana.
+    """
+    bucket_count = max(1, max_points // 2)
+    edges = np.linspace(0, len(categories), bucket_count + 1).astype(np.int64)
+    labels, columns = [], []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end <= start:
+            continue
+        block = matrix[:, start:end]
+        if end - start == 1:
+            labels.append(categories[start])
+            columns.append(block[:, 0])
+            continue
+
+        missing = np.isnan(block)
+        i_min = np.argmin(np.where(missing, np.inf, block), axis=1)
+        i_max = np.argmax(np.where(missing, -np.inf, block), axis=1)
+        rows = np.arange(block.shape[0])
+        first = block[rows, np.minimum(i_min, i_max)]
+        second = block[rows, np.maximum(i_min, i_max)]
+        empty = missing.all(axis=1)
+        first[empty] = np.nan
+        second[empty] = np.nan
+
+        labels.extend((categories[start], categories[end - 1]))
+        columns.extend((first, second))
+    return labels, np.column_stack(columns) if columns else matrix[:, :0]
+
+
+def downsample_aligned(aligned, max_points):
+    """
+    Zmniejsza liczbę punktów wyrównanych serii na potrzeby wykresu (tabela dostaje pełne dane).
+    Jedna seria - LTTB; wiele serii na wspólnej osi - minimum/maksimum w kubełkach.
+    """
+    categories, matrix = aligned['categories'], aligned['matrix']
+    if not max_points or len(categories) <= max_points:
+        return aligned
+
+    if matrix.shape[0] == 1:
+        indices = lttb_indices(matrix[0], max_points)
+        labels, reduced = [categories[i] for i in indices.tolist()], matrix[:, indices]
+    else:
+        labels, reduced = minmax_buckets(categories, matrix, max_points)
+    return {**aligned, 'categories': labels, 'matrix': reduced, 'downsampled_from': len(categories)}
+
+
+# --- Szablony raportu (Jinja2) ---
+# Kompilowane raz przy starcie; autoescape chroni przed HTML-em w tekstach od modelu,
+# dzięki czemu wyrenderowane fragmenty można bezpiecznie cache'ować i udostępniać.
+
+REPORT_TEMPLATE_NAMES = ('report/report.html', 'report/_table.html', 'report/series.html',
+                         'report/text.html', 'report/error.html')
+report_templates = {name: app.jinja_env.get_template(name) for name in REPORT_TEMPLATE_NAMES}
+
+
+def report_template(name):
+    # W trybie debug pobieramy szablon przez środowisko, aby działało automatyczne przeładowanie
+    return app.jinja_env.get_template(name) if app.debug else report_templates[name]
+
+
+def render_error_html(message, details=None, heading=None, raw=None):
+    """Blok błędu wyświetlany w czacie zamiast raportu."""
+    return report_template('report/error.html').render(message=message, details=details, heading=heading, raw=raw)
+
+
+def warn_invalid_points(analysis):
+    if analysis['valid_count'] < analysis['count']:
+        print(f"Ostrzeżenie: Pominięto {analysis['count'] - analysis['valid_count']} błędnych punktów w serii '{analysis['name']}'")
+
+
+def render_series_analysis_html(series, data_meta, analysis=None):
+    """
+    Buduje blok KPI i statystyk opisowych dla jednej serii danych.
+    Używana przy strumieniowaniu kolejnych serii; pełny raport składa te bloki w report.html.
+    """
+    if analysis is None:
+        analysis = analyze_series(series)
+    warn_invalid_points(analysis)
+    return report_template('report/series.html').render(
+        analysis=analysis,
+        unit=data_meta.get('unit', ''),
+        latest_period=data_meta.get('latest_period', 'N/A') # Bierzemy z meta, bo jest wspólne
+    )
+
+
+# --- Etapy renderowania raportu ---
+# Każdy etap jest osobną funkcją, aby dało się go mierzyć niezależnie (bench_render.py)
+
+def build_series_analyses(data_series):
+    """Etap KPI: analiza każdej serii (dokładnie raz). Bloki HTML buduje szablon."""
+    analyses = [analyze_series(series) for series in data_series]
+    for analysis in analyses:
+        warn_invalid_points(analysis)
+    return analyses
+
+
+def build_chart_config(data_series, data_meta, aligned, full_data_url=None):
+    """
+    Etap wykresu: zwięzły opis wykresu - tylko etykiety osi i wartości serii.
+    Statyczne opcje Chart.js i paleta kolorów są po stronie przeglądarki (main.js).
+    Jeśli `aligned` zostało zredukowane, podajemy pełną liczbę punktów i adres pełnych danych.
+    """
+    chart = {
+        "type": data_meta.get("chart_type_suggestion", "line"),
+        "title": data_meta.get('title', 'Raport Danych'),
+        "xLabel": data_meta.get('x_axis_label', 'Okres'),
+        "yLabel": data_meta.get('y_axis_label', 'Wartość'),
+        "labels": aligned['categories'],
+        # Braki i błędne wartości (NaN) trafiają do wykresu jako null
+        "series": [
+            {"name": series.get('series_name', f'Seria {i+1}'), "data": values_to_json_list(aligned['matrix'][i])}
+            for i, series in enumerate(data_series)
+        ]
+    }
+    if 'downsampled_from' in aligned:
+        chart["total"] = aligned['downsampled_from']
+        if full_data_url:
+            chart["fullDataUrl"] = full_data_url
+    return chart
+
+
+TABLE_CHUNK_ROWS = 256 # Tyle wierszy tabeli szablon dostaje (i wysyła przy strumieniowaniu) naraz
+
+
+def table_row_chunks(categories, matrix, unit):
+    """
+    Wiersze tabeli (najnowsze okresy na górze) jako gotowe fragmenty HTML po TABLE_CHUNK_ROWS wierszy.
+    Wiersze składamy tutaj, a nie w pętli szablonu: liczby nie wymagają escapowania, jednostkę
+    escapujemy raz na tabelę, a kategorie raz na wiersz - pętla po komórkach w Jinja2 byłaby
+    kilka razy wolniejsza. Generator: przy strumieniowaniu cała tabela nie powstaje w pamięci.
+    """
+    unit_html = str(escape(unit))
+    # Bez str.format: jednostka od modelu może zawierać klamry ('{m2}')
+    cell_end = unit_html + '</td>'
+    separator = unit_html + '</td><td>'
+    rows = []
+    # Wiersz tabeli to kolumna wyrównanej macierzy; 'N/A' tam, gdzie seria nie ma punktu (NaN)
+    has_gaps = np.isnan(matrix).any(axis=0)[::-1].tolist()
+    for category, values, gaps in zip(reversed(categories), matrix.T[::-1].tolist(), has_gaps):
+        if gaps:
+            cells = ''.join(['<td>' + str(value) + cell_end if value == value else '<td>N/A</td>' for value in values])
+        else:
+            cells = '<td>' + separator.join(map(str, values)) + cell_end
+        rows.append(f"<tr><td>{escape(category)}</td>{cells}</tr>")
+        if len(rows) == TABLE_CHUNK_ROWS:
+            yield Markup(''.join(rows))
+            rows = []
+    if rows:
+        yield Markup(''.join(rows))
+
+
+def build_table_context(data_series, data_meta, aligned):
+    """
+    Etap tabeli: kontekst szablonu _table.html. Wiersze są generatorem - szablon
+    pobiera je po kolei, więc przy strumieniowaniu tabela nie powstaje w całości w pamięci.
+    """
+    unit = data_meta.get('unit', '')
+    return {
+        'series_names': [series.get('series_name', 'Brak nazwy') for series in data_series],
+        'row_chunks': table_row_chunks(aligned['categories'], aligned['matrix'], unit),
+        'unit': unit,
+        'source': data_meta.get('source_info', 'Brak danych o źródle')
+    }
+
+
+def build_report_context(data_series, data_meta, analyses, chart_config, table_context, chart_id=None):
+    """
+    Etap składania: pełny kontekst szablonu report.html. Id wykresu zależy tylko od treści
+    (albo od id raportu), aby ten sam raport zawsze dawał ten sam HTML.
+    """
+    # Zwięzły JSON (bez spacji) w atrybucie data-; cudzysłowy zamienia autoescape
+    chart_json = json_lib.dumps(chart_config, separators=(',', ':'))
+    return {
+        **table_context,
+        'title': data_meta.get('title', 'Raport Danych'),
+        'analyses': analyses,
+        'latest_period': data_meta.get('latest_period', 'N/A'),
+        'chart_id': chart_id or f"report-chart-{hashlib.sha1(chart_json.encode('utf-8')).hexdigest()[:12]}",
+        'chart_json': chart_json,
+        'commentary': data_meta.get('statistical_commentary', 'Brak komentarza analitycznego.')
+    }
+
+
+def build_interactive_report_context(gus_data, chart_data_url=None, chart_id=None):
+    """Kontekst raportu z danymi (ścieżka A renderera); cała analiza dzieje się przed renderowaniem."""
+    data_meta = gus_data.get('data_meta', {})
+    data_series = gus_data['data_series']
+
+    # A. KPI i statystyki - każda seria parsowana i analizowana dokładnie raz
+    analyses = build_series_analyses(data_series)
+
+    # Wszystkie serie wyrównujemy do wspólnej osi kategorii (z agregacją różnych częstotliwości)
+    aligned = align_series(analyses)
+
+    # B. Wykres (Canvas + dane dla Chart.js) - WERSJA DLA WIELU SERII
+    chart_aligned = downsample_aligned(aligned, app.config['CHART_MAX_POINTS'])
+    chart_config = build_chart_config(data_series, data_meta, chart_aligned, chart_data_url)
+
+    # D. Tabela ze szczegółowymi danymi - WERSJA DLA WIELU SERII
+    table_context = build_table_context(data_series, data_meta, aligned)
+
+    return build_report_context(data_series, data_meta, analyses, chart_config, table_context, chart_id)
+
+
+def generate_interactive_report_html(gus_data, chart_data_url=None, chart_id=None):
+    """
+    Przetwarza pełny JSON z GUS (z Gemini) i generuje bogaty raport HTML.
+    Jest odporna na różne formaty wejściowe i obsługuje wiele serii danych.
+    Długie serie trafiają na wykres w uproszczonej postaci; `chart_data_url` wskazuje pełne dane.
+    """
+    try:
+        # --- ŚCIEŻKA A: Pełny raport z danymi (wykrywamy po 'data_series') ---
+        if isinstance(gus_data, dict) and gus_data.get('data_series'):
+            context = build_interactive_report_context(gus_data, chart_data_url, chart_id)
+            # generate() zamiast render(): tabela powstaje z generatora wierszy, kawałek po kawałku
+            return "".join(report_template('report/report.html').generate(**context))
+
+        # --- ŚCIEŻKA B: Prosta odpowiedź tekstowa (brak 'data_series') ---
+        elif isinstance(gus_data, dict):
+            commentary = gus_data.get('data_meta', {}).get('statistical_commentary')
+            if not commentary:
+                commentary = gus_data.get('text_response') # Dodatkowy fallback
+            if not commentary:
+                commentary = gus_data.get('message', 'Otrzymano odpowiedź, ale bez treści do wyświetlenia.')
+            
+            # Zwracamy jako blok markdown
+            return report_template('report/text.html').render(commentary=commentary)
+            
+        # --- ŚCIEŻKA C: Odpowiedź nie jest słownikiem (np. błąd) ---
+        else:
+            return render_error_html("Otrzymano nieoczekiwany format danych od AI.", raw=str(gus_data))
 
-# Endpoint do usuwania (bez zmian)
-@app.route('/api/report/delete/<int:report_id>', methods=['DELETE'])
-@login_required
-def delete_report(report_id):
-    try:
-        report = Report.query.get(report_id)
-        if not report:
-            return jsonify({'error': 'Raport nie znaleziony'}), 404
-        if report.user_id != current_user.id:
-            return jsonify({'error': 'Brak autoryzacji'}), 403
-        
-        db.session.delete(report)
-        db.session.commit()
-        return jsonify({'success': True}), 200
+    except Exception as e:
+        print(f"Błąd podczas generowania raportu HTML: {e}")
+        # Zwróć prosty błąd jako HTML, który pojawi się w czacie
+        return render_error_html(
+            "Niestety, wystąpił problem podczas analizy danych. Spróbuj zadać pytanie ponownie.",
+            details=str(e), heading="Błąd podczas generowania raportu")
+
+
+def generate_dashboard_html(sources, max_chart_points):
+    """
+    Łączy serie z kilku zapisanych raportów w jeden raport: wspólna oś kategorii,
+    jeden wykres (ze zredukowaną liczbą punktów) i jedna tabela.
+    `sources` to lista par (tytuł raportu, dane GUS).
+    """
+    data_series, titles, units, source_infos = [], [], [], []
+    for report_title, gus_data in sources:
+        titles.append(report_title)
+        data_meta = gus_data.get('data_meta', {})
+        units.append(data_meta.get('unit', ''))
+        if data_meta.get('source_info'):
+            source_infos.append(data_meta['source_info'])
+        for series in gus_data.get('data_series') or []:
+            # Nazwa serii z tytułem raportu, aby serie z różnych raportów dało się odróżnić
+            name = series.get('series_name', 'Brak nazwy')
+            data_series.append({**series, 'series_name': f"{report_title}: {name}" if len(sources) > 1 else name})
+
+    if not data_series:
+        return render_error_html("Wybrane raporty nie zawierają serii danych.")
+
+    data_meta = {
+        'title': 'Dashboard: ' + ', '.join(titles),
+        'chart_type_suggestion': 'line',
+        'unit': units[0] if len(set(units)) == 1 else '', # Jednostkę pokazujemy tylko, gdy jest wspólna
+        'source_info': '; '.join(dict.fromkeys(source_infos)) or 'Brak danych o źródle',
+        'x_axis_label': 'Okres',
+        'y_axis_label': 'Wartość'
+    }
+
+    analyses = build_series_analyses(data_series)
+    aligned = align_series(analyses)
+    chart_aligned = downsample_aligned(aligned, max_chart_points)
+
+    commentary = f"Połączono {len(data_series)} serii z {len(sources)} raportów."
+    if 'downsampled_from' in chart_aligned:
+        commentary += (f" Wykres pokazuje {len(chart_aligned['categories'])} z {chart_aligned['downsampled_from']}"
+                       " punktów osi; pełne dane są w tabeli.")
+    data_meta['statistical_commentary'] = commentary
+
+    context = build_report_context(data_series, data_meta, analyses,
+                                   build_chart_config(data_series, data_meta, chart_aligned),
+                                   build_table_context(data_series, data_meta, aligned))
+    return "".join(report_template('report/report.html').generate(**context))
+
+
+# --- Kolejka zadań generowania raportów ---
+
+class QueueFullError(Exception):
+    """Kolejka zadań (globalna lub użytkownika) jest pełna."""
+
+
+class FairJobQueue:
+    """
+    Kolejka zadań sprawiedliwa między użytkownikami: każdy ma własną kolejkę FIFO,
+    a wątki robocze pobierają zadania kolejnych użytkowników po kolei (round-robin),
+    więc seria promptów jednej osoby nie blokuje pozostałych.
+    Udostępnia tę część interfejsu queue.Queue, której używa ReportJobQueue.
+    """
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self._queues = OrderedDict() # user_id -> deque zadań; kolejność = kolejka rotacji
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def qsize(self):
+        return self._size
+
+    def put_nowait(self, job):
+        with self._cond:
+            if self.maxsize and self._size >= self.maxsize:
+                raise queue.Full
+            self._queues.setdefault(job.user_id, deque()).append(job)
+            self._size += 1
+            self._cond.notify()
+
+    def get(self):
+        with self._cond:
+            while not self._size:
+                self._cond.wait()
+            user_id, jobs = next(iter(self._queues.items()))
+            job = jobs.popleft()
+            # Użytkownik przechodzi na koniec rotacji (albo wypada z niej, gdy nie ma więcej zadań)
+            del self._queues[user_id]
+            if jobs:
+                self._queues[user_id] = jobs
+            self._size -= 1
+            return job
+
+    def task_done(self):
+        pass
+
+
+class ReportJob:
+    """Pojedyncze zadanie: prompt -> dane z modelu -> raport HTML -> zapis w bazie."""
+
+    def __init__(self, prompt, user_id, prompt_variant='default'):
+        self.id = uuid.uuid4().hex
+        self.prompt = prompt
+        self.user_id = user_id
+        self.prompt_variant = prompt_variant
+        self.status = 'queued' # queued / running / retrying / done / failed
+        self.attempts = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.timings = {} # Czasy etapów w ms (model, zapis w bazie, renderowanie)
+        self.events = [] # Lista (nazwa_zdarzenia, dane) dla strumienia SSE
+        self.on_status = None # Wywoływane po każdej zmianie statusu (zapis stanu współdzielonego)
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def push_event(self, event, data):
+        with self._cond:
+            self.events.append((event, data))
+            self._cond.notify_all()
+
+    def set_status(self, status, **extra):
+        self.status = status
+        if status in ('done', 'failed'):
+            self.finished_at = time.time()
+        self.push_event('status', {'status': status, 'attempts': self.attempts, **extra})
+        if self.on_status is not None:
+            self.on_status(self)
+
+    def wait_for_events(self, cursor, timeout):
+        """Zwraca zdarzenia od pozycji `cursor`, czekając maks. `timeout` sekund na nowe."""
+        with self._cond:
+            if cursor >= len(self.events) and not self.finished:
+                self._cond.wait(timeout)
+            return self.events[cursor:]
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'timings': self.timings
+        }
+        if self.status == 'done':
+            data['result'] = self.result
+        if self.status == 'failed':
+            data['error'] = self.error
+            data['result'] = self.result
+        return data
+
+
+class SharedJobView:
+    """
+    Zadanie uruchomione w innym procesie serwera, odczytywane z tabeli report_job.
+    Ma ten sam interfejs co ReportJob, więc endpointy statusu i SSE działają bez zmian;
+    zdarzenia ze strumienia są odtwarzane ze zmian stanu (bez częściowych wyników serii).
+    """
+
+    poll_interval = 0.5
+
+    def __init__(self, job_id, user_id, state):
+        self.id = job_id
+        self.user_id = user_id
+        self.status = None
+        self.attempts = None
+        self.events = []
+        self._apply(state)
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def _apply(self, state):
+        if (state['status'], state['attempts']) == (self.status, self.attempts):
+            return
+        self.state = state
+        self.status = state['status']
+        self.attempts = state['attempts']
+        # Ta sama kolejność co w ReportJob: wynik przed końcowym statusem
+        if self.status == 'done':
+            self.events.append(('done', state['result']))
+        elif self.status == 'failed':
+            self.events.append(('failed', {'error': state.get('error'), **(state.get('result') or {})}))
+        self.events.append(('status', {'status': self.status, 'attempts': self.attempts}))
+
+    def to_dict(self):
+        return self.state
+
+    def wait_for_events(self, cursor, timeout):
+        deadline = time.monotonic() + timeout
+        while cursor >= len(self.events) and not self.finished and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            with app.app_context():
+                row = db.session.get(JobState, self.id)
+                if row is not None:
+                    self._apply(json_lib.loads(row.state))
+                db.session.remove()
+        return self.events[cursor:]
+
+
+class ReportJobQueue:
+    """
+    Ograniczona pula wątków generujących raporty w tle.
+    Wątki startują leniwie przy pierwszym zadaniu. Przy `shared_state` stan zadań trafia
+    też do tabeli report_job, aby status był dostępny z każdego procesu serwera.
+    """
+
+    def __init__(self, workers, max_queue, max_pending_per_user, max_retries, retry_backoff, result_ttl,
+                 shared_state=False):
+        self.workers = workers
+        self.max_pending_per_user = max_pending_per_user
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.result_ttl = result_ttl
+        self.shared_state = shared_state
+        self._queue = FairJobQueue(maxsize=max_queue)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker_loop, name=f"report-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _prune(self):
+        # Usuwamy zakończone zadania starsze niż TTL wyników
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and now - job.finished_at > self.result_ttl]
+            for job_id in expired:
+                del self._jobs[job_id]
+        if self.shared_state:
+            with db.engine.begin() as conn:
+                conn.execute(db.delete(JobState).where(JobState.updated_at < now - self.result_ttl))
+
+    def _publish(self, job):
+        # Zapis stanu zadania we wspólnej tabeli (osobna transakcja, niezależna od sesji wątku)
+        values = {'status': job.status, 'state': json_lib.dumps(job.to_dict()), 'updated_at': time.time()}
+        try:
+            with app.app_context(), db.engine.begin() as conn:
+                updated = conn.execute(db.update(JobState).where(JobState.id == job.id).values(**values)).rowcount
+                if not updated:
+                    conn.execute(db.insert(JobState).values(id=job.id, user_id=job.user_id, **values))
+        except Exception as e:
+            print(f"Ostrzeżenie: Nie udało się zapisać stanu zadania {job.id}: {e}")
+
+    def pending_for_user(self, user_id):
+        if self.shared_state:
+            # Limit obejmuje zadania użytkownika we wszystkich procesach serwera
+            return JobState.query.filter(JobState.user_id == user_id,
+                                         JobState.status.notin_(('done', 'failed'))).count()
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.user_id == user_id and not job.finished)
+
+    def submit(self, prompt, user_id, prompt_variant='default'):
+        self._prune()
+        self._ensure_started()
+
+        if self.pending_for_user(user_id) >= self.max_pending_per_user:
+            raise QueueFullError("Masz już zbyt wiele raportów w trakcie generowania.")
+
+        job = ReportJob(prompt, user_id, prompt_variant)
+        if self.shared_state:
+            job.on_status = self._publish
+        # Status ustawiamy przed wstawieniem do kolejki, aby wyprzedził zdarzenia wątku roboczego
+        job.set_status('queued', position=self._queue.qsize() + 1)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            if self.shared_state:
+                with db.engine.begin() as conn:
+                    conn.execute(db.delete(JobState).where(JobState.id == job.id))
+            raise QueueFullError("Serwer jest obecnie przeciążony. Spróbuj ponownie za chwilę.")
+        return job
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.shared_state:
+            # Zadanie z innego procesu serwera
+            row = db.session.get(JobState, job_id)
+            if row is not None:
+                job = SharedJobView(row.id, row.user_id, json_lib.loads(row.state))
+        return job
+
+    def shutdown(self, timeout):
+        """
+        Zamknięcie procesu serwera: czeka maks. `timeout` s na dokończenie zadań, a pozostałe oznacza
+        jako nieudane. Inaczej w report_job zostałyby jako 'queued'/'running' (klient czekałby bez końca,
+        a zadania blokowałyby limit JOB_MAX_PENDING_PER_USER do czasu JOB_RESULT_TTL).
+        Zwraca liczbę przerwanych zadań.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                unfinished = [job for job in self._jobs.values() if not job.finished]
+            if not unfinished or time.monotonic() >= deadline:
+                break
+            time.sleep(0.2)
+
+        message = "Serwer został zrestartowany przed zakończeniem zadania. Spróbuj ponownie."
+        with app.app_context():
+            for job in unfinished:
+                job.error = message
+                job.result = {'response': render_error_html(message)}
+                job.push_event('failed', {'error': job.error, **job.result})
+                job.set_status('failed', error=job.error)
+        if unfinished:
+            print(f"Zamykanie procesu: przerwano niezakończone zadania ({len(unfinished)})")
+        return len(unfinished)
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                with app.app_context():
+                    self._run(job)
+            except Exception as e:
+                print(f"Błąd w zadaniu {job.id}: {e}")
+                job.error = str(e)
+                job.result = {'response': render_error_html(f"Wystąpił błąd serwera: {e}")}
+                job.push_event('failed', {'error': job.error, **job.result})
+                job.set_status('failed', error=job.error)
+            finally:
+                self._queue.task_done()
+                self._record_job_metrics(job)
+
+    def _record_job_metrics(self, job):
+        duration = (job.finished_at or time.time()) - job.created_at
+        JOB_DURATION.observe(duration, job.status)
+        threshold = app.config['SLOW_REQUEST_THRESHOLD']
+        if threshold is not None and duration > threshold:
+            # Rozbicie na etapy; resztę czasu zadanie spędziło w kolejce lub na ponowieniach
+            stages = ", ".join(f"{name}={value:.0f}" for name, value in job.timings.items())
+            print(f"Wolne zadanie {job.id}: {duration:.2f} s (status: {job.status}, próby: {job.attempts}; {stages or 'brak pomiarów'})")
+
+    def _stream_handler(self, job):
+        # Przekazuje częściowe wyniki modelu do strumienia zadania (tytuł i karty KPI kolejnych serii)
+        stream_meta = {}
+
+        def on_model_event(event, payload):
+            try:
+                if event == 'meta':
+                    stream_meta.clear()
+                    stream_meta.update(payload)
+                    job.push_event('meta', {
+                        'title': payload.get('title', 'Raport Danych'),
+                        'latest_period': payload.get('latest_period'),
+                        'unit': payload.get('unit', ''),
+                        'source_info': payload.get('source_info')
+                    })
+                elif event == 'series':
+                    job.push_event('series', {
+                        'index': payload['index'],
+                        'html': render_series_analysis_html(payload['series'], stream_meta)
+                    })
+            except Exception as e:
+                print(f"Ostrzeżenie: Nie udało się przesłać częściowego wyniku zadania {job.id}: {e}")
+
+        return on_model_event
+
+    def _run(self, job):
+        # 1. Pobierz dane od modelu, ponawiając błędy z wykładniczym opóźnieniem
+        while True:
+            job.attempts += 1
+            job.set_status('running')
+            system_prompt = prompt_registry.get(job.prompt_variant)
+            started = time.perf_counter()
+            gus_data = get_data_from_gus(job.prompt, on_event=self._stream_handler(job), system_prompt=system_prompt)
+            job.timings['model_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            is_error = isinstance(gus_data, dict) and gus_data.get('status') == 'error'
+            if not is_error or not gus_data.get('retryable', True) or job.attempts > self.max_retries:
+                break
+            delay = self.retry_backoff * (2 ** (job.attempts - 1))
+            print(f"Zadanie {job.id}: błąd modelu, ponawiam za {delay:.1f}s (próba {job.attempts})")
+            job.set_status('retrying', retry_in=delay)
+            time.sleep(delay)
+
+        # 2. Zapisz dane w bazie i wyrenderuj raport (trafia od razu do cache renderowania)
+        started = time.perf_counter()
+        new_report = save_report(job.prompt, gus_data, job.user_id, prompt_version=system_prompt.version)
+        job.timings['db_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+        started = time.perf_counter()
+        ai_response_content = render_report(new_report)
+        job.timings['render_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+        job.result = {
+            'prompt': job.prompt,
+            'response': ai_response_content,
+            'new_history_item': { 'id': new_report.id, 'title': new_report.title }
+        }
+        # Zdarzenie z wynikiem musi trafić do strumienia przed zmianą statusu na końcowy
+        job.push_event('done', job.result)
+        job.set_status('done')
+
+
+report_jobs = ReportJobQueue(
+    workers=app.config['JOB_WORKERS'],
+    max_queue=app.config['JOB_QUEUE_MAX'],
+    max_pending_per_user=app.config['JOB_MAX_PENDING_PER_USER'],
+    max_retries=app.config['JOB_MAX_RETRIES'],
+    retry_backoff=app.config['JOB_RETRY_BACKOFF'],
+    result_ttl=app.config['JOB_RESULT_TTL'],
+    shared_state=app.config['JOB_SHARED_STATE']
+)
+
+
+def build_report(prompt_text, gus_data, user_id, prompt_version=None):
+    return Report(
+        title=generate_title_for_history(prompt_text),
+        prompt=prompt_text,
+        data=pack_report_data(gus_data), # Zapisujemy dane, HTML renderujemy na żądanie
+        prompt_version=prompt_version,
+        user_id=user_id
+    )
+
+
+def save_report(prompt_text, gus_data, user_id, prompt_version=None):
+    new_report = build_report(prompt_text, gus_data, user_id, prompt_version)
+    db.session.add(new_report)
+    with Span(DB_COMMIT_TIME):
+        db.session.commit()
+    return new_report
+
+
+def fetch_prompt_batch(prompts, system_prompt, concurrency, item_timeout):
+    """
+    Pobiera dane dla wielu promptów równolegle (maks. `concurrency` wywołań naraz).
+    Zwraca listę (gus_data, błąd) w kolejności promptów. Wywołanie, które trwa dłużej
+    niż `item_timeout` sekund, dostaje błąd przekroczenia czasu; jego wątek kończy się
+    w tle, a wynik jest pomijany.
+    """
+    started_at = {}
+
+    def call(index, prompt):
+        started_at[index] = time.monotonic()
+        with app.app_context():
+            return get_data_from_gus(prompt, system_prompt=system_prompt)
+
+    results = [(None, None)] * len(prompts)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch-worker')
+    try:
+        futures = {executor.submit(call, i, prompt): i for i, prompt in enumerate(prompts)}
+        pending = set(futures)
+        while pending:
+            # Czekamy do najbliższego limitu czasu spośród już rozpoczętych wywołań
+            now = time.monotonic()
+            deadlines = [started_at[futures[f]] + item_timeout for f in pending if futures[f] in started_at]
+            timeout = max(0.0, min(deadlines) - now) if deadlines else item_timeout
+            done, pending = wait_futures(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    results[futures[future]] = (future.result(), None)
+                except Exception as e:
+                    results[futures[future]] = (None, f"Błąd podczas pobierania danych: {e}")
+
+            now = time.monotonic()
+            for future in [f for f in pending if futures[f] in started_at and now - started_at[futures[f]] >= item_timeout]:
+                pending.discard(future)
+                results[futures[future]] = (None, f"Przekroczono limit czasu ({item_timeout:g} s)")
+    finally:
+        # Nie czekamy na wątki, które przekroczyły limit czasu
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+def format_sse(event, data, event_id=None):
+    message = f"event: {event}\ndata: {json_lib.dumps(data)}\n"
+    if event_id is not None:
+        message = f"id: {event_id}\n" + message
+    return message + "\n"
+
+
+# --- ENDPOINTY API ---
+
+@app.route('/api/prompt', methods=['POST'])
+@login_required
+def handle_prompt():
+    data = request.json
+    prompt_text = data.get('prompt')
+    prompt_variant = data.get('variant') or 'default'
+
+    if not prompt_text:
+        return jsonify({'error': 'Brak promptu'}), 400
+    # Sprawdzenie wariantu korzysta z rejestru (mtime co PROMPT_RELOAD_INTERVAL), bez listowania katalogu
+    try:
+        prompt_registry.get(prompt_variant)
+    except KeyError:
+        return jsonify({'error': f"Nieznany wariant promptu: {prompt_variant}"}), 400
+
+    rate_limited = check_user_rate_limit(current_user.id)
+    if rate_limited:
+        return rate_limited
+
+    # Zadanie trafia do puli wątków - odpowiadamy od razu identyfikatorem zadania
+    try:
+        job = report_jobs.submit(prompt_text, current_user.id, prompt_variant)
+    except QueueFullError as e:
+        # Zapytanie nie weszło do kolejki - nie powinno zużywać limitu użytkownika
+        refund_user_rate_limit(current_user.id)
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('job_status', job_id=job.id),
+        'events_url': url_for('job_events', job_id=job.id)
+    }), 202
+
+
+@app.route('/api/prompts/batch', methods=['POST'])
+@login_required
+def handle_prompt_batch():
+    data = request.json or {}
+    prompts = data.get('prompts')
+    prompt_variant = data.get('variant') or 'default'
+
+    if not isinstance(prompts, list) or not prompts:
+        return jsonify({'error': 'Brak listy promptów'}), 400
+    if len(prompts) > app.config['BATCH_MAX_PROMPTS']:
+        return jsonify({'error': f"Maksymalna liczba promptów w jednym zapytaniu to {app.config['BATCH_MAX_PROMPTS']}"}), 400
+    if not all(isinstance(p, str) and p.strip() for p in prompts):
+        return jsonify({'error': 'Każdy prompt musi być niepustym tekstem'}), 400
+    try:
+        system_prompt = prompt_registry.get(prompt_variant)
+    except KeyError:
+        return jsonify({'error': f"Nieznany wariant promptu: {prompt_variant}"}), 400
+
+    # Każdy prompt partii liczy się do limitu użytkownika
+    rate_limited = check_user_rate_limit(current_user.id, cost=len(prompts))
+    if rate_limited:
+        return rate_limited
+
+    # 1. Wywołania modelu równolegle - czas partii zbliżony do czasu najwolniejszego promptu
+    fetched = fetch_prompt_batch(
+        prompts, system_prompt,
+        concurrency=min(app.config['BATCH_CONCURRENCY'], len(prompts)),
+        item_timeout=app.config['BATCH_ITEM_TIMEOUT']
+    )
+
+    # Prompty, których nie obsłużyliśmy z naszej winy (przekroczony czas, wyjątek), nie zużywają limitu
+    refund_user_rate_limit(current_user.id, sum(1 for _, error in fetched if error is not None))
+
+    # 2. Wszystkie udane raporty zapisujemy w jednej transakcji
+    items, new_reports = [], []
+    for prompt_text, (gus_data, error) in zip(prompts, fetched):
+        if error is None and isinstance(gus_data, dict) and gus_data.get('status') == 'error':
+            error = gus_data.get('message', 'Nieznany błąd modelu')
+        if error is not None:
+            items.append({'prompt': prompt_text, 'error': error})
+            continue
+        report = build_report(prompt_text, gus_data, current_user.id, prompt_version=system_prompt.version)
+        new_reports.append(report)
+        items.append({'prompt': prompt_text, 'report': report})
+
+    if new_reports:
+        db.session.add_all(new_reports)
+        try:
+            with Span(DB_COMMIT_TIME):
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Błąd zapisu partii raportów: {e}")
+            refund_user_rate_limit(current_user.id, len(new_reports))
+            return jsonify({'error': 'Nie udało się zapisać raportów'}), 500
+
+    # 3. Renderowanie (wyniki trafiają też do cache renderowania)
+    results = []
+    for item in items:
+        report = item.pop('report', None)
+        if report is not None:
+            item.update({
+                'response': render_report(report),
+                'new_history_item': { 'id': report.id, 'title': report.title }
+            })
+        results.append(item)
+
+    return jsonify({
+        'results': results,
+        'succeeded': len(new_reports),
+        'failed': len(results) - len(new_reports)
+    })
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    job = report_jobs.get(job_id)
+    if not job or job.user_id != current_user.id:
+        return jsonify({'error': 'Zadanie nie znalezione'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+@login_required
+def job_events(job_id):
+    job = report_jobs.get(job_id)
+    if not job or job.user_id != current_user.id:
+        return jsonify({'error': 'Zadanie nie znalezione'}), 404
+
+    # Przy ponownym połączeniu EventSource wysyła numer ostatniego odebranego zdarzenia
+    try:
+        cursor = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        cursor = 0
+
+    def stream():
+        nonlocal cursor
+        while True:
+            events = job.wait_for_events(cursor, timeout=15)
+            if not events:
+                if job.finished:
+                    return
+                yield ": keep-alive\n\n" # Komentarz SSE podtrzymujący połączenie
+                continue
+            for event, payload in events:
+                yield format_sse(event, payload, event_id=cursor)
+                cursor += 1
+            if job.finished and cursor >= len(job.events):
+                return
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@app.route('/api/reports', methods=['GET'])
+@login_required
+def list_reports():
+    before_id = request.args.get('before', type=int)
+    limit = request.args.get('limit', default=app.config['HISTORY_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['HISTORY_MAX_PAGE_SIZE']))
+
+    items, next_cursor = get_history_page(current_user.id, before_id=before_id, limit=limit)
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+
+@app.route('/api/reports/search', methods=['GET'])
+@login_required
+def search_reports():
+    if not search_index_ready:
+        return jsonify({'error': 'Wyszukiwanie jest niedostępne'}), 503
+
+    fts_query = build_fts_query(request.args.get('q', ''))
+    if not fts_query:
+        return jsonify({'error': 'Brak zapytania'}), 400
+
+    page = max(1, request.args.get('page', default=1, type=int))
+    limit = max(1, min(request.args.get('limit', default=app.config['SEARCH_PAGE_SIZE'], type=int),
+                       app.config['HISTORY_MAX_PAGE_SIZE']))
+
+    rows = db.session.execute(db.text(f"""
+        SELECT rowid AS id, title,
+               snippet(report_fts, -1, char(2), char(3), '…', 12) AS snippet,
+               bm25(report_fts, {', '.join(str(w) for w in SEARCH_COLUMN_WEIGHTS)}) AS rank
+        FROM report_fts
+        WHERE report_fts MATCH :query AND user_id = :user_id
+        ORDER BY rank
+        LIMIT :limit OFFSET :offset
+    """), {'query': fts_query, 'user_id': current_user.id, 'limit': limit + 1, 'offset': (page - 1) * limit}).all()
+
+    return jsonify({
+        'items': [
+            {'id': row.id, 'title': row.title, 'snippet': highlight_snippet(row.snippet), 'rank': row.rank}
+            for row in rows[:limit]
+        ],
+        'page': page,
+        'has_more': len(rows) > limit
+    })
+
+
+# Mniejszych odpowiedzi nie opłaca się kompresować
+COMPRESS_MIN_SIZE = 1024
+
+
+def compress_payload(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def report_etag(report, kind):
+    """
+    Silny ETag zasobu raportu: id, wersja renderera, rodzaj zasobu i hash zapisanych danych.
+    Nie zależy od wyrenderowanej treści, więc jest taki sam w każdym procesie i po wypadnięciu z cache.
+    """
+    source = report.data if report.data is not None else (report.content or '').encode('utf-8')
+    return f"r{report.id}-v{RENDERER_VERSION}-{kind}-{hashlib.sha256(source).hexdigest()[:20]}"
+
+
+def cached_report_response(report, kind, build_payload):
+    """
+    Odpowiedź JSON dla niezmiennego zasobu raportu z silnym ETagiem (report_etag),
+    obsługą If-None-Match (304) i kompresją gzip/br liczoną raz i trzymaną w pamięci.
+    Wersje skompresowane to osobne reprezentacje - ich ETag ma przyrostek kodowania.
+    `build_payload(report)` zwraca słownik albo None, gdy zasobu nie ma.
+    """
+    cache_key = (report.id, RENDERER_VERSION, kind)
+    entry = report_payload_cache.get(cache_key)
+    if entry is None:
+        payload = build_payload(report)
+        if payload is None:
+            return None
+        body = app.json.dumps(payload).encode('utf-8')
+        entry = {'etag': report_etag(report, kind), 'identity': body}
+        report_payload_cache.set(cache_key, entry)
+
+    encoding = None
+    if len(entry['identity']) >= COMPRESS_MIN_SIZE:
+        if request.accept_encodings['br']:
+            encoding = 'br'
+        elif request.accept_encodings['gzip']:
+            encoding = 'gzip'
+    etag = f"{entry['etag']}-{encoding}" if encoding else entry['etag']
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = entry['identity']
+        if encoding:
+            if encoding not in entry:
+                entry[encoding] = compress_payload(entry['identity'], encoding)
+            body = entry[encoding]
+        response = Response(body, mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"private, max-age={app.config['REPORT_HTTP_MAX_AGE']}"
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def get_owned_report(report_id):
+    """Zwraca (raport, None) albo (None, odpowiedź z błędem). Duże kolumny ładują się dopiero przy użyciu."""
+    report = db.session.get(Report, report_id, options=[db.load_only(Report.id, Report.user_id)])
+    if not report:
+        return None, (jsonify({'error': 'Raport nie znaleziony'}), 404)
+    if report.user_id != current_user.id:
+        return None, (jsonify({'error': 'Brak autoryzacji'}), 403)
+    return report, None
+
+
+def report_payload(report):
+    return {
+        'id': report.id,
+        'title': report.title,
+        'prompt': report.prompt,
+        'response': render_report(report)
+    }
+
+
+def report_chart_payload(report):
+    # Pełne (nieuproszczone) dane wykresu raportu
+    gus_data = report.get_gus_data()
+    if not isinstance(gus_data, dict) or not gus_data.get('data_series'):
+        return None
+    data_series = gus_data['data_series']
+    aligned = align_series([analyze_series(series) for series in data_series])
+    return build_chart_config(data_series, gus_data.get('data_meta', {}), aligned)
+
+
+@app.route('/api/report/<int:report_id>', methods=['GET'])
+@login_required
+def get_report(report_id):
+    report, error = get_owned_report(report_id)
+    if error:
+        return error
+    return cached_report_response(report, 'report', report_payload)
+
+
+@app.route('/api/report/<int:report_id>/chart', methods=['GET'])
+@login_required
+def get_report_chart(report_id):
+    # Ładowane na żądanie przez przeglądarkę, gdy wykres w raporcie jest uproszczony
+    report, error = get_owned_report(report_id)
+    if error:
+        return error
+    response = cached_report_response(report, 'chart', report_chart_payload)
+    if response is None:
+        return jsonify({'error': 'Raport nie zawiera danych wykresu'}), 404
+    return response
+
+
+@app.route('/api/report/<int:report_id>/html', methods=['GET'])
+@login_required
+def get_report_html(report_id):
+    """
+    Sam HTML raportu. Duże raporty spoza cache renderujemy strumieniowo (stream_template):
+    przeglądarka dostaje początek raportu, zanim powstanie cała tabela.
+    """
+    report, error = get_owned_report(report_id)
+    if error:
+        return error
+
+    if report.data is not None and render_cache.get((report.id, RENDERER_VERSION)) is None:
+        gus_data = report.get_gus_data()
+        data_series = gus_data.get('data_series') if isinstance(gus_data, dict) else None
+        cells = sum(len(series.get('data_points') or []) for series in data_series or [])
+        if data_series and cells >= app.config['REPORT_STREAM_MIN_CELLS']:
+            try:
+                context = build_interactive_report_context(gus_data, chart_data_url=f"/api/report/{report.id}/chart",
+                                                           chart_id=f"report-chart-{report.id}")
+            except Exception as e:
+                print(f"Błąd podczas przygotowania raportu {report.id} do strumieniowania: {e}")
+            else:
+                return Response(stream_template(report_template('report/report.html'), **context),
+                                mimetype='text/html')
+
+    return Response(render_report(report), mimetype='text/html')
+
+
+@app.route('/api/dashboard', methods=['GET'])
+@login_required
+def get_dashboard():
+    # Identyfikatory raportów w parametrze ?ids=1,2,3 (kolejność zachowana)
+    try:
+        report_ids = list(dict.fromkeys(int(i) for i in request.args.get('ids', '').split(',') if i.strip()))
+    except ValueError:
+        return jsonify({'error': 'Nieprawidłowe identyfikatory raportów'}), 400
+    if not report_ids:
+        return jsonify({'error': 'Nie wybrano raportów'}), 400
+    if len(report_ids) > app.config['DASHBOARD_MAX_REPORTS']:
+        return jsonify({'error': f"Dashboard może łączyć maksymalnie {app.config['DASHBOARD_MAX_REPORTS']} raportów"}), 400
+
+    reports = Report.query.filter(Report.id.in_(report_ids), Report.user_id == current_user.id).all()
+    by_id = {report.id: report for report in reports}
+    missing = [i for i in report_ids if i not in by_id]
+    if missing:
+        return jsonify({'error': f"Raporty nie znalezione: {', '.join(map(str, missing))}"}), 404
+
+    sources = []
+    for report_id in report_ids:
+        report = by_id[report_id]
+        # Stare raporty bez danych strukturalnych odtwarzamy z zapisanego HTML
+        gus_data = report.get_gus_data() if report.data is not None else parse_legacy_report_html(report.content)
+        if isinstance(gus_data, dict) and gus_data.get('data_series'):
+            sources.append((report.title, gus_data))
+
+    try:
+        html = generate_dashboard_html(sources, app.config['DASHBOARD_MAX_CHART_POINTS'])
+    except Exception as e:
+        print(f"Błąd podczas generowania dashboardu: {e}")
+        html = render_error_html(f"Wystąpił błąd podczas tworzenia dashboardu: {e}")
+
+    return jsonify({
+        'title': 'Dashboard: ' + ', '.join(by_id[i].title for i in report_ids),
+        'report_ids': report_ids,
+        'response': html
+    })
+
+
+# --- Eksport danych raportów ---
+
+# Format "długi": jeden wiersz na punkt danych - wygodny w Excelu i pandas (pivot po series_name)
+EXPORT_COLUMNS = ('report_id', 'report_title', 'series_name', 'period', 'value', 'unit')
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson; charset=utf-8', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet')
+}
+
+
+def iter_export_reports(user_id, report_ids=None):
+    """
+    Zwraca po kolei (id, tytuł, dane GUS) raportów użytkownika. Raporty czytamy partiami
+    po EXPORT_BATCH_SIZE (paginacja po id), więc w pamięci jest najwyżej jedna partia.
+    """
+    last_id = 0
+    while True:
+        query = (db.session.query(Report.id, Report.title, Report.data, Report.content)
+                 .filter(Report.user_id == user_id, Report.id > last_id))
+        if report_ids is not None:
+            query = query.filter(Report.id.in_(report_ids))
+        rows = query.order_by(Report.id).limit(app.config['EXPORT_BATCH_SIZE']).all()
+        if not rows:
+            return
+        for row in rows:
+            # Stare raporty bez kolumny 'data' odtwarzamy z zapisanego HTML (jeśli się da)
+            gus_data = unpack_report_data(row.data) if row.data is not None else parse_legacy_report_html(row.content)
+            if isinstance(gus_data, dict):
+                yield row.id, row.title, gus_data
+        last_id = rows[-1].id
+
+
+def iter_export_rows(reports):
+    """Wiersze eksportu (zgodne z EXPORT_COLUMNS); brak lub błędna wartość -> None."""
+    for report_id, title, gus_data in reports:
+        unit = gus_data.get('data_meta', {}).get('unit', '')
+        for series in gus_data.get('data_series') or []:
+            series_name = series.get('series_name', 'Brak nazwy')
+            categories, values = parse_series_values(series.get('data_points') or [])
+            for category, value in zip(categories, values.tolist()):
+                yield report_id, title, series_name, category, (value if value == value else None), unit
+
+
+def batched_rows(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def export_csv(rows, chunk_rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff') # BOM - Excel rozpozna kodowanie UTF-8 (polskie znaki)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batched_rows(rows, chunk_rows):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue() # Sam nagłówek, gdy nie ma żadnych danych
+
+
+def export_ndjson(rows, chunk_rows):
+    for batch in batched_rows(rows, chunk_rows):
+        yield ''.join(json_lib.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n' for row in batch)
+
+
+class ChunkSink:
+    """Plik tylko do zapisu, z którego zapisane bajty odbieramy porcjami (dla ParquetWriter)."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def export_parquet(rows, chunk_rows):
+    """Każda porcja wierszy to jedna grupa wierszy (kolumnowy RecordBatch) wysyłana od razu po zapisie."""
+    schema = pa.schema([
+        ('report_id', pa.int64()),
+        ('report_title', pa.string()),
+        ('series_name', pa.string()),
+        ('period', pa.string()),
+        ('value', pa.float64()),
+        ('unit', pa.string())
+    ])
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for batch in batched_rows(rows, chunk_rows):
+            columns = list(zip(*batch))
+            writer.write_batch(pa.record_batch(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+            yield sink.take()
+    finally:
+        writer.close() # Stopka pliku (metadane grup wierszy)
+    yield sink.take()
+
+
+EXPORT_WRITERS = {'csv': export_csv, 'ndjson': export_ndjson, 'parquet': export_parquet}
+
+
+def export_response(user_id, report_ids, filename):
+    """Strumieniowa odpowiedź z danymi raportów w formacie z parametru ?format= (domyślnie csv)."""
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Nieobsługiwany format eksportu (dostępne: {', '.join(EXPORT_FORMATS)})"}), 400
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    rows = iter_export_rows(iter_export_reports(user_id, report_ids))
+    body = EXPORT_WRITERS[export_format](rows, app.config['EXPORT_CHUNK_ROWS'])
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}.{extension}"'
+    })
+
+
+@app.route('/api/report/<int:report_id>/export', methods=['GET'])
+@login_required
+def export_report(report_id):
+    report, error = get_owned_report(report_id)
+    if error:
+        return error
+    return export_response(current_user.id, [report.id], f"raport-{report.id}")
+
+
+@app.route('/api/reports/export', methods=['GET'])
+@login_required
+def export_reports():
+    # Wybrane raporty (?ids=1,2,3) albo cała historia użytkownika
+    ids = request.args.get('ids', '')
+    try:
+        report_ids = sorted({int(i) for i in ids.split(',') if i.strip()}) if ids else None
+    except ValueError:
+        return jsonify({'error': 'Nieprawidłowe identyfikatory raportów'}), 400
+    return export_response(current_user.id, report_ids, 'raporty')
+
+
+# Endpoint do usuwania (bez zmian)
+@app.route('/api/report/delete/<int:report_id>', methods=['DELETE'])
+@login_required
+def delete_report(report_id):
+    try:
+        report = Report.query.get(report_id)
+        if not report:
+            return jsonify({'error': 'Raport nie znaleziony'}), 404
+        if report.user_id != current_user.id:
+            return jsonify({'error': 'Brak autoryzacji'}), 403
+        
+        db.session.delete(report)
+        db.session.commit()
+        render_cache.invalidate(report_id)
+        report_payload_cache.invalidate(report_id)
+        return jsonify({'success': True}), 200
     except Exception as e:
         db.session.rollback()
         print(f"Błąd podczas usuwania raportu: {e}")
         return jsonify({'error': 'Błąd serwera'}), 500
 
 
+# --- Cache odpowiedzi modelu ---
+
+def normalize_prompt(prompt):
+    """
+    Sprowadza prompt do postaci kanonicznej, aby prawie identyczne pytania
+    (inna wielkość liter, interpunkcja, nadmiarowe spacje) trafiały w ten sam wpis cache.
+    """
+    text = unicodedata.normalize('NFC', prompt or '').casefold()
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+
+class ResponseCache:
+    """
+    Trwały cache sparsowanych odpowiedzi modelu w SQLite.
+    Wpisy wygasają po TTL, a po przekroczeniu limitu usuwane są najdawniej używane (LRU).
+    """
+
+    def __init__(self, path, ttl_seconds, max_entries):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL") # Kilka procesów serwera zapisuje do tego samego pliku
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_last_access ON response_cache (last_access)")
+
+    @staticmethod
+    def make_key(prompt, prompt_hash, model_name):
+        raw = f"{model_name}\x00{prompt_hash}\x00{normalize_prompt(prompt)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT payload, created_at FROM response_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                payload, created_at = row
+                if now - created_at > self.ttl_seconds:
+                    conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                    return None
+                conn.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            print(f"Ostrzeżenie: Błąd odczytu cache odpowiedzi: {e}")
+            return None
+        return json_lib.loads(payload)
+
+    def set(self, key, data):
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, payload, created_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, json_lib.dumps(data, ensure_ascii=False), now, now)
+                )
+                # Eksmisja: najpierw przeterminowane wpisy, potem nadmiar wg LRU
+                conn.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+                conn.execute("""
+                    DELETE FROM response_cache WHERE key IN (
+                        SELECT key FROM response_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_entries,))
+        except sqlite3.Error as e:
+            print(f"Ostrzeżenie: Błąd zapisu cache odpowiedzi: {e}")
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM response_cache")
+
+    def stats(self):
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+        # Trafienia i chybienia liczy metryka RESPONSE_CACHE_REQUESTS (get_data_from_gus) - jedno źródło liczb
+        hits, misses = RESPONSE_CACHE_REQUESTS.value('hit'), RESPONSE_CACHE_REQUESTS.value('miss')
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else 0.0,
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds
+        }
+
+
+response_cache = ResponseCache(
+    app.config['RESPONSE_CACHE_PATH'],
+    app.config['RESPONSE_CACHE_TTL'],
+    app.config['RESPONSE_CACHE_MAX_ENTRIES']
+)
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+@login_required
+def cache_stats():
+    return jsonify(response_cache.stats())
+
+
+def _response_cache_hit_ratio():
+    hits, misses = RESPONSE_CACHE_REQUESTS.value('hit'), RESPONSE_CACHE_REQUESTS.value('miss')
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+metrics.register(Gauge('gus_response_cache_hit_ratio', 'Udział trafień w cache odpowiedzi modelu.',
+                       _response_cache_hit_ratio))
+metrics.register(Gauge('gus_job_queue_depth', 'Liczba zadań czekających w kolejce.',
+                       lambda: report_jobs._queue.qsize()))
+metrics.register(Gauge('gus_render_cache_items', 'Liczba raportów w cache renderowania.',
+                       lambda: len(render_cache._items)))
+metrics.register(Gauge('gus_identity_cache_items', 'Liczba użytkowników w cache tożsamości.',
+                       lambda: len(identity_cache._items)))
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Bez logowania - endpoint odpytywany przez Prometheusa; chroniony tokenem (METRICS_TOKEN)
+    # albo wyłączony w konfiguracji (domyślnie w profilu produkcyjnym)
+    if not app.config['METRICS_ENABLED']:
+        return jsonify({'error': 'Metryki są wyłączone.'}), 404
+    token = app.config['METRICS_TOKEN']
+    if token:
+        auth = request.authorization
+        provided = auth.token if auth is not None and auth.type == 'bearer' else None
+        if not provided or not hmac.compare_digest(provided.encode('utf-8'), token.encode('utf-8')):
+            response = jsonify({'error': 'Brak dostępu do metryk.'})
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response, 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+# --- Limity zapytań ---
+
+class TokenBucketLimiter:
+    """
+    Kubełki tokenów zapisane w SQLite, dzięki czemu limit jest wspólny dla wszystkich procesów
+    serwera. Kubełek ma pojemność (dopuszczalna seria) i tempo uzupełniania (tokeny na sekundę);
+    pobranie tokenu odbywa się w jednej transakcji BEGIN IMMEDIATE.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_bucket (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+        finally:
+            conn.close()
+
+    def acquire(self, key, capacity, per_second, cost=1):
+        """Pobiera `cost` tokenów. Zwraca 0, jeśli się udało, albo liczbę sekund do uzupełnienia kubełka."""
+        if cost > capacity:
+            return float('inf') # Takiej liczby tokenów kubełek nigdy nie pomieści
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tokens, updated_at FROM rate_bucket WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * per_second)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / per_second
+            conn.execute(
+                "INSERT INTO rate_bucket (key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (key, tokens, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return wait
+
+    def refund(self, key, capacity, cost=1):
+        """Oddaje tokeny pobrane na zapytanie, którego ostatecznie nie obsłużyliśmy."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Czas ostatniej zmiany zostaje - uzupełnianie od tego momentu liczy się jak dotąd
+            conn.execute("UPDATE rate_bucket SET tokens = MIN(?, tokens + ?) WHERE key = ?", (capacity, cost, key))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def acquire_blocking(self, key, capacity, per_second, max_wait):
+        """Czeka na token maks. `max_wait` sekund; zwraca True, jeśli go dostał."""
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.acquire(key, capacity, per_second)
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM rate_bucket")
+        finally:
+            conn.close()
+
+
+rate_limiter = TokenBucketLimiter(app.config['RATE_LIMIT_PATH'])
+
+
+def check_user_rate_limit(user_id, cost=1):
+    """Pobiera `cost` tokenów z limitu użytkownika; zwraca None albo odpowiedź 429 z Retry-After."""
+    if not app.config['RATE_LIMIT_ENABLED']:
+        return None
+    wait = rate_limiter.acquire(
+        f"user:{user_id}",
+        app.config['RATE_LIMIT_USER_BURST'],
+        app.config['RATE_LIMIT_USER_PER_MINUTE'] / 60,
+        cost=cost
+    )
+    if not wait:
+        return None
+
+    RATE_LIMITED.inc('user')
+    if wait == float('inf'):
+        response = jsonify({'error': f"Jednorazowo można wysłać maksymalnie {app.config['RATE_LIMIT_USER_BURST']} promptów."})
+        return response, 429
+    retry_after = math.ceil(wait)
+    response = jsonify({
+        'error': "Zbyt wiele zapytań - przekroczono limit promptów.",
+        'retry_after': retry_after
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+
+def refund_user_rate_limit(user_id, cost=1):
+    """Zwraca tokeny użytkownikowi, gdy zapytanie odrzucił serwer (pełna kolejka, błąd zapisu)."""
+    if not app.config['RATE_LIMIT_ENABLED'] or cost <= 0:
+        return
+    try:
+        rate_limiter.refund(f"user:{user_id}", app.config['RATE_LIMIT_USER_BURST'], cost)
+    except sqlite3.Error as e:
+        print(f"Ostrzeżenie: Nie udało się zwrócić tokenów limitu użytkownika {user_id}: {e}")
+
+
+def acquire_model_budget(model_name):
+    """Czeka na budżet wywołań modelu (wspólny dla wszystkich użytkowników)."""
+    if not app.config['RATE_LIMIT_ENABLED']:
+        return True
+    acquired = rate_limiter.acquire_blocking(
+        f"model:{model_name}",
+        app.config['RATE_LIMIT_MODEL_BURST'],
+        app.config['RATE_LIMIT_MODEL_PER_MINUTE'] / 60,
+        app.config['RATE_LIMIT_MODEL_MAX_WAIT']
+    )
+    if not acquired:
+        RATE_LIMITED.inc('model')
+    return acquired
+
+
+def select_model_name():
+    # Przy długiej kolejce przechodzimy na tańszy, szybszy model, aby ją rozładować
+    fallback = app.config['GEMINI_FALLBACK_MODEL']
+    depth = app.config['MODEL_DOWNGRADE_QUEUE_DEPTH']
+    if fallback and depth and report_jobs.queue_depth() >= depth:
+        return fallback
+    return app.config['GEMINI_MODEL']
+
+
 # --- Logika AI (Teraz używa prawdziwego API) ---
 
-def get_gemini_response(prompt):
+PromptVersion = namedtuple('PromptVersion', ['name', 'text', 'version'])
+
+
+class PromptRegistry:
+    """
+    Rejestr promptów systemowych wczytywanych raz i przeładowywanych po zmianie pliku (mtime).
+    Wariant 'default' to prompt.txt, pozostałe to pliki prompt.<wariant>.txt.
+    Każda wersja promptu ma hash treści, który trafia do klucza cache i do zapisanego raportu.
+    """
+
+    DEFAULT_NAME = 'default'
+    FALLBACK_TEXT = "Jesteś asystentem AI. Odpowiedz na pytanie użytkownika."
+
+    def __init__(self, directory, check_interval):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._entries = {} # nazwa -> {'prompt', 'mtime', 'checked_at'}
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        filename = 'prompt.txt' if name == self.DEFAULT_NAME else f'prompt.{name}.txt'
+        return os.path.join(self.directory, filename)
+
+    @staticmethod
+    def _make_version(name, text):
+        return PromptVersion(name, text, hashlib.sha256(text.encode('utf-8')).hexdigest()[:16])
+
+    def get(self, name=DEFAULT_NAME):
+        """Aktualna wersja promptu; KeyError dla nieznanego wariantu (np. z zapytania użytkownika)."""
+        now = time.monotonic()
+        entry = self._entries.get(name)
+        if entry is not None and now - entry['checked_at'] < self.check_interval:
+            return entry['prompt']
+
+        if not isinstance(name, str) or not re.fullmatch(r'[\w-]+', name):
+            raise KeyError(f"Nieznany wariant promptu: {name}") # Nazwa trafia do ścieżki pliku
+
+        with self._lock:
+            entry = self._entries.get(name)
+            path = self._path(name)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                if name != self.DEFAULT_NAME:
+                    raise KeyError(f"Nieznany wariant promptu: {name}")
+                if entry is None or entry['mtime'] is not None:
+                    print("BŁĄD: Brak pliku 'prompt.txt'. Używam domyślnego promptu systemowego.")
+                entry = {'prompt': self._make_version(name, self.FALLBACK_TEXT), 'mtime': None}
+                self._entries[name] = entry
+            else:
+                if entry is None or entry['mtime'] != mtime:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        prompt = self._make_version(name, f.read().strip())
+                    if entry is not None:
+                        print(f"Przeładowano prompt '{name}' (wersja {prompt.version})")
+                    entry = {'prompt': prompt, 'mtime': mtime}
+                    self._entries[name] = entry
+            entry['checked_at'] = now
+            return entry['prompt']
+
+
+prompt_registry = PromptRegistry(app.config['PROMPT_DIR'], app.config['PROMPT_RELOAD_INTERVAL'])
+prompt_registry.get() # Wczytujemy domyślny prompt przy starcie aplikacji
+
+# Klienci modeli tworzeni raz na nazwę modelu i współdzieleni między żądaniami
+_model_clients = {}
+_model_clients_lock = threading.Lock()
+
+# Ustawienia generowania - wymuszamy odpowiedź JSON
+JSON_GENERATION_CONFIG = genai.types.GenerationConfig(
+    response_mime_type="application/json"
+)
+
+
+def get_model(model_name):
+    model = _model_clients.get(model_name)
+    if model is None:
+        with _model_clients_lock:
+            model = _model_clients.get(model_name)
+            if model is None:
+                # Używamy modelu skonfigurowanego przez genai.configure()
+                model = genai.GenerativeModel(model_name)
+                _model_clients[model_name] = model
+    return model
+
+
+class IncrementalJsonParser:
+    """
+    Przyrostowy parser odpowiedzi modelu przychodzącej we fragmentach.
+    Śledzi zagnieżdżenie JSON-a i zgłasza zdarzenia, gdy tylko domknie się
+    obiekt 'data_meta' lub kolejny element listy 'data_series'.
+    Tekst przed pierwszym '{' (np. znacznik bloku kodu ```json) jest ignorowany.
+    """
+
+    # Znaki, które zmieniają stan parsera - resztę tekstu przeskakujemy wyszukiwaniem wyrażenia regularnego
+    _STRUCTURAL = re.compile(r'["{}\[\]:]')
+    _STRING_SPECIAL = re.compile(r'["\\]')
+
+    def __init__(self):
+        self._chunks = [] # Cały dotychczasowy tekst (właściwość text)
+        self._retained = [] # (pozycja początku, fragment) - tylko fragmenty potrzebne do wycięcia wartości
+        self._length = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None # Ostatni łańcuch na poziomie korzenia (kandydat na klucz)
+        self._root_key = None # Klucz, którego wartość jest aktualnie czytana
+        self._value_start = None # Początek obiektu 'data_meta'
+        self._item_start = None # Początek bieżącego elementu 'data_series'
+        self.series_count = 0
+
+    @property
+    def text(self):
+        if len(self._chunks) > 1:
+            self._chunks = [''.join(self._chunks)]
+        return self._chunks[0] if self._chunks else ''
+
+    def _slice(self, start, end):
+        # Tekst z zakresu [start, end) pozycji bezwzględnych, złożony z zachowanych fragmentów
+        parts = []
+        for chunk_start, chunk in self._retained:
+            if chunk_start + len(chunk) <= start or chunk_start >= end:
+                continue
+            parts.append(chunk[max(start - chunk_start, 0):end - chunk_start])
+        return ''.join(parts)
+
+    def _loads_fragment(self, start, end):
+        try:
+            return json_lib.loads(self._slice(start, end))
+        except json_lib.JSONDecodeError:
+            return None
+
+    def feed(self, chunk):
+        """
+        Dokłada fragment tekstu i zwraca listę zdarzeń (nazwa, dane). Każdy znak jest czytany raz:
+        wyszukiwanie skacze do kolejnego znaku strukturalnego, a tekst sprzed otwartej wartości
+        nie jest przechowywany do wycinania.
+        """
+        self._chunks.append(chunk)
+        base = self._length
+        self._retained.append((base, chunk))
+        self._length += len(chunk)
+        events = []
+        i, n = 0, len(chunk)
+
+        while i < n:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    i += 1
+                    continue
+                match = self._STRING_SPECIAL.search(chunk, i)
+                if match is None:
+                    break
+                i = match.start()
+                if chunk[i] == '\\':
+                    self._escape = True
+                else:
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = self._slice(self._string_start + 1, base + i)
+                i += 1
+                continue
+
+            match = self._STRUCTURAL.search(chunk, i)
+            if match is None:
+                break
+            i = match.start()
+            ch = chunk[i]
+            if ch == '"':
+                self._in_string = True
+                self._string_start = base + i
+            elif ch == ':':
+                if self._depth == 1:
+                    self._root_key = self._last_string
+            elif ch in '{[':
+                self._depth += 1
+                if ch == '{' and self._depth == 2 and self._root_key == 'data_meta':
+                    self._value_start = base + i
+                elif ch == '{' and self._depth == 3 and self._root_key == 'data_series':
+                    self._item_start = base + i
+            else:
+                if ch == '}' and self._depth == 2 and self._value_start is not None:
+                    meta = self._loads_fragment(self._value_start, base + i + 1)
+                    if isinstance(meta, dict):
+                        events.append(('meta', meta))
+                    self._value_start = None
+                elif ch == '}' and self._depth == 3 and self._item_start is not None:
+                    series = self._loads_fragment(self._item_start, base + i + 1)
+                    if isinstance(series, dict):
+                        events.append(('series', {'index': self.series_count, 'series': series}))
+                        self.series_count += 1
+                    self._item_start = None
+                self._depth -= 1
+            i += 1
+
+        # Zostawiamy tylko fragmenty od początku najwcześniejszej otwartej wartości
+        open_starts = [start for start in (self._value_start, self._item_start,
+                                           self._string_start if self._in_string else None)
+                       if start is not None]
+        keep_from = min(open_starts, default=self._length)
+        retained, drop = self._retained, 0
+        while drop < len(retained) and retained[drop][0] + len(retained[drop][1]) <= keep_from:
+            drop += 1
+        del retained[:drop]
+        return events
+
+
+# --- Walidacja i naprawa odpowiedzi modelu ---
+# Etap między modelem a rendererem: naprawia typowe usterki odpowiedzi (ogrodzenie
+# bloku kodu, ucięty JSON, liczby jako tekst, zduplikowane okresy) zamiast pytać
+# model ponownie. Ponowne zapytanie tylko przy błędach, które model może poprawić.
+
+class DataPointModel(BaseModel):
+    category: str
+    value: Optional[float] = None
+
+
+class DataSeriesModel(BaseModel):
+    model_config = ConfigDict(extra='allow')
+
+    series_name: str = 'Nienazwana seria'
+    data_points: List[DataPointModel] = Field(default_factory=list)
+
+
+class DataMetaModel(BaseModel):
+    model_config = ConfigDict(extra='allow')
+
+    title: str = 'Raport Danych'
+    chart_type_suggestion: str = 'line'
+    unit: str = ''
+
+
+class GusResponseModel(BaseModel):
+    model_config = ConfigDict(extra='allow')
+
+    status: str = 'success'
+    data_meta: DataMetaModel = Field(default_factory=DataMetaModel)
+    data_series: List[DataSeriesModel] = Field(default_factory=list)
+
+
+ValidationIssue = namedtuple('ValidationIssue', ['code', 'message'])
+
+
+class ModelResponseResult:
+    """Wynik walidacji: dane gotowe dla renderera, lista poprawek i ewentualny błąd krytyczny."""
+
+    def __init__(self, data=None, repairs=None, error=None, retryable=False):
+        self.data = data
+        self.repairs = repairs or []
+        self.error = error
+        self.retryable = retryable # Czy jedno ponowne zapytanie z opisem błędu ma sens
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def strip_code_fences(text):
+    # Usuwa ogrodzenie bloku kodu Markdown (```json ... ```) i tekst przed pierwszym '{'
+    text = re.sub(r'^\s*```(?:json)?\s*|\s*```\s*$', '', text)
+    start = text.find('{')
+    return text[start:] if start > 0 else text
+
+
+def repair_truncated_json(text):
+    """
+    Domyka ucięty JSON: przycina tekst do ostatniej kompletnej wartości (przed przecinkiem
+    albo po nawiasie zamykającym) i dopisuje brakujące nawiasy. Zwraca obiekt albo None.
+    """
+    cut_points = [] # (pozycja cięcia, otwarte nawiasy w tym miejscu)
+    stack = []
+    in_string = escaped = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+        elif char in '}]':
+            if not stack:
+                break
+            stack.pop()
+            cut_points.append((i + 1, ''.join(reversed(stack))))
+        elif char == ',':
+            cut_points.append((i, ''.join(reversed(stack))))
+
+    # Od najdłuższego kandydata; kilka prób wystarcza, bo cięcia przy przecinkach są gęste
+    for position, closers in reversed(cut_points[-50:]):
+        try:
+            return json_lib.loads(text[:position] + closers)
+        except json_lib.JSONDecodeError:
+            continue
+    return None
+
+
+def coerce_number(value):
+    """'4,6', '1 234.5', '4.6%' -> float; brak lub tekst nieliczbowy -> None."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value == value else None
+    text = str(value).strip().replace('\xa0', '').replace(' ', '').rstrip('%')
+    if text.count(',') == 1 and '.' not in text:
+        text = text.replace(',', '.') # Polski przecinek dziesiętny
+    else:
+        text = text.replace(',', '') # Separator tysięcy
+    try:
+        number = float(text)
+    except ValueError:
+        return None
+    return number if number == number else None
+
+
+def normalize_series(series, index, repairs):
+    """Porządkuje punkty jednej serii w miejscu: liczby, brakujące kategorie, duplikaty, kolejność okresów."""
+    name = series.get('series_name') or f"Seria {index + 1}"
+    points = {}
+    for point in series.get('data_points') or []:
+        if not isinstance(point, dict):
+            repairs.append(ValidationIssue('invalid_point', f"'{name}': pominięto punkt, który nie jest obiektem"))
+            continue
+        category = point.get('category')
+        if category is None or not str(category).strip():
+            repairs.append(ValidationIssue('missing_category', f"'{name}': pominięto punkt bez kategorii"))
+            continue
+        category = str(category).strip()
+        raw_value = point.get('value')
+        value = coerce_number(raw_value)
+        if raw_value is not None and not isinstance(raw_value, (int, float)):
+            repairs.append(ValidationIssue(
+                'coerced_value' if value is not None else 'invalid_value',
+                f"'{name}' {category}: wartość {raw_value!r} -> {value}"))
+        if category in points:
+            # Zduplikowany okres - zostawiamy ostatnią (zwykle poprawioną) poprawną wartość;
+            # późniejszy brak albo nieliczbowa wartość nie zastępuje wcześniejszej liczby
+            repairs.append(ValidationIssue('duplicate_category', f"'{name}': zduplikowana kategoria {category}"))
+            if value is None and points[category]['value'] is not None:
+                continue
+            del points[category]
+        points[category] = {**point, 'category': category, 'value': value}
+
+    data_points = list(points.values())
+    periods = [parse_period(p['category']) for p in data_points]
+    if periods and all(periods) and len({freq for freq, _ in periods}) == 1:
+        ordinals = [ordinal for _, ordinal in periods]
+        if any(a > b for a, b in zip(ordinals, ordinals[1:])):
+            repairs.append(ValidationIssue('unsorted_categories', f"'{name}': posortowano okresy"))
+            data_points = [p for _, p in sorted(zip(ordinals, data_points), key=lambda item: item[0])]
+
+    series['series_name'] = name
+    series['data_points'] = data_points
+    return series
+
+
+def validate_model_response(raw):
+    """
+    Parsuje (tekst) i waliduje odpowiedź modelu względem schematu GUS, naprawiając to,
+    co da się naprawić lokalnie. Zwraca ModelResponseResult.
+    """
+    repairs = []
+    if isinstance(raw, str):
+        text = strip_code_fences(raw.strip())
+        if text != raw.strip():
+            repairs.append(ValidationIssue('code_fence', 'usunięto ogrodzenie bloku kodu'))
+        try:
+            data = json_lib.loads(text)
+        except json_lib.JSONDecodeError as e:
+            data = repair_truncated_json(text)
+            if data is None:
+                return ModelResponseResult(
+                    repairs=repairs, retryable=True,
+                    error=ValidationIssue('invalid_json', f"Odpowiedź nie jest poprawnym JSON ({e.msg}, znak {e.pos})."))
+            repairs.append(ValidationIssue('truncated_json', 'domknięto ucięty JSON'))
+    else:
+        data = raw
+
+    if not isinstance(data, dict):
+        return ModelResponseResult(repairs=repairs, retryable=True,
+                                   error=ValidationIssue('not_object', 'Odpowiedź nie jest obiektem JSON.'))
+
+    # Błąd zgłoszony przez sam model (np. brak danych) - przekazujemy bez zmian
+    if data.get('status') == 'error':
+        return ModelResponseResult(data=data, repairs=repairs)
+
+    series_list = data.get('data_series')
+    if series_list is not None and not isinstance(series_list, list):
+        return ModelResponseResult(repairs=repairs, retryable=True,
+                                   error=ValidationIssue('schema', "Pole 'data_series' musi być listą."))
+    for i, series in enumerate(series_list or []):
+        if isinstance(series, dict):
+            normalize_series(series, i, repairs)
+    if series_list:
+        kept = [s for s in series_list if isinstance(s, dict)]
+        if len(kept) < len(series_list):
+            repairs.append(ValidationIssue('invalid_series', 'pominięto serie, które nie są obiektami'))
+        data['data_series'] = kept
+
+    try:
+        validated = GusResponseModel.model_validate(data)
+    except ValidationError as e:
+        details = '; '.join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()[:5])
+        return ModelResponseResult(repairs=repairs, retryable=True,
+                                   error=ValidationIssue('schema', f"Niezgodność ze schematem: {details}"))
+
+    has_values = any(p.value is not None for s in validated.data_series for p in s.data_points)
+    if validated.data_series and not has_values:
+        return ModelResponseResult(repairs=repairs, retryable=True,
+                                   error=ValidationIssue('no_values', 'Żadna seria nie zawiera poprawnych wartości liczbowych.'))
+    if not has_values and any(issue.code == 'truncated_json' for issue in repairs):
+        # Odpowiedź ucięta, zanim pojawiły się jakiekolwiek dane - naprawa niewiele daje
+        return ModelResponseResult(repairs=repairs, retryable=True,
+                                   error=ValidationIssue('truncated', 'Odpowiedź została ucięta przed danymi.'))
+
+    return ModelResponseResult(data=validated.model_dump(), repairs=repairs)
+
+
+def record_validation(result):
+    for issue in result.repairs:
+        MODEL_REPAIRS.inc(issue.code)
+    if result.repairs:
+        print(f"Naprawiono odpowiedź modelu: {', '.join(sorted({issue.code for issue in result.repairs}))}")
+
+
+def build_repair_prompt(prompt, error):
+    # Ukierunkowane ponowne zapytanie: model dostaje konkretny opis błędu poprzedniej odpowiedzi
+    return (f"{prompt}\n\nTwoja poprzednia odpowiedź była niepoprawna: {error.message} "
+            "Zwróć kompletny, poprawny obiekt JSON zgodny z wymaganym formatem, bez dodatkowego tekstu.")
+
+
+def get_gemini_response(prompt, on_event=None, system_prompt=None, retry_on_invalid=True, model_name=None):
+    """
+    Wysyła prompt do Gemini i zwraca sparsowany, zwalidowany JSON.
+    Jeśli podano `on_event`, odpowiedź jest strumieniowana, a callback dostaje
+    zdarzenia ('meta', data_meta) i ('series', {'index', 'series'}) zanim model skończy generować.
+    Odpowiedź, której nie da się naprawić lokalnie, powoduje jedno ponowne zapytanie z opisem błędu.
+    Każde wywołanie zużywa token z budżetu modelu (czeka na niego, gdy budżet jest wyczerpany).
+    """
     
     print(f"Wysyłanie promptu do Gemini: {prompt}")
-    try:
-        with open('prompt.txt', 'r', encoding='utf-8') as f:
-            system_prompt_content = f.read().strip()
-    except FileNotFoundError:
-        print("BŁĄD: Brak pliku 'prompt.txt'. Używam domyślnego promptu systemowego.")
-        # Możesz tu zdefiniować domyślny prompt systemowy, jeśli pliku nie ma
-        system_prompt_content = "Jesteś asystentem AI. Odpowiedz na pytanie użytkownika." 
-        # return {"status": "error", "message": "Brak pliku konfiguracyjnego 'prompt.txt'."}
-
-    final_prompt = f"{system_prompt_content}\n\nZapytanie Użytkownika: \"{prompt}\""
+    system_prompt = system_prompt or prompt_registry.get()
+
+    final_prompt = f"{system_prompt.text}\n\nZapytanie Użytkownika: \"{prompt}\""
     
+    model_name = model_name or app.config['GEMINI_MODEL']
+    if not acquire_model_budget(model_name):
+        return {"status": "error", "message": "Przekroczono limit zapytań do modelu AI. Spróbuj ponownie za chwilę."}
+
     try:
-        # Używamy modelu skonfigurowanego przez genai.configure()
-        model = genai.GenerativeModel('gemini-2.5-pro') # Lub inny model, np. 2.5-pro
-        
-        # Ustawienia generowania - wymuszamy odpowiedź JSON
-        generation_config = genai.types.GenerationConfig(
-            response_mime_type="application/json" 
-        )
+        model = get_model(model_name)
+
+        if on_event is not None and app.config['GEMINI_STREAMING']:
+            # Tryb strumieniowy: każdy fragment od razu trafia do parsera przyrostowego
+            response = model.generate_content(
+                final_prompt,
+                generation_config=JSON_GENERATION_CONFIG,
+                stream=True
+            )
+            parser = IncrementalJsonParser()
+            for chunk in response:
+                for event, payload in parser.feed(chunk.text):
+                    on_event(event, payload)
+            raw_text = parser.text.strip()
+        else:
+            response = model.generate_content(
+                final_prompt,
+                generation_config=JSON_GENERATION_CONFIG
+            )
+            # Dostęp do surowego tekstu JSON (Gemini powinien zwrócić sam JSON)
+            raw_text = response.text.strip()
 
-        response = model.generate_content(
-            final_prompt,
-            generation_config=generation_config
-        )
-        
-        # Dostęp do surowego tekstu JSON (Gemini powinien zwrócić sam JSON)
-        raw_text = response.text.strip()
         print(f"Otrzymano surową odpowiedź od Gemini:\n{raw_text}") # Logowanie odpowiedzi
+        MODEL_RESPONSE_SIZE.observe(len(raw_text.encode('utf-8')), model_name)
 
-        # Parsowanie JSON
-        try:
-            parsed_json = json_lib.loads(raw_text)
-            return parsed_json
-        except json_lib.JSONDecodeError as e:
-            print(f"JSON Decode Error: {e}")
+        # Parsowanie, walidacja i naprawa JSON
+        with Span(JSON_PARSE_TIME):
+            result = validate_model_response(raw_text)
+        record_validation(result)
+
+        if not result.ok and result.retryable and retry_on_invalid:
+            # Jedno ukierunkowane ponowne zapytanie z opisem błędu (bez strumieniowania)
+            print(f"Odpowiedź modelu niepoprawna ({result.error.code}), ponawiam z opisem błędu")
+            MODEL_RETRIES.inc(result.error.code)
+            return get_gemini_response(build_repair_prompt(prompt, result.error),
+                                       system_prompt=system_prompt, retry_on_invalid=False, model_name=model_name)
+
+        if not result.ok:
+            print(f"Błąd walidacji odpowiedzi modelu: {result.error.message}")
             print(f"Surowy tekst, który nie dał się sparsować: {raw_text}")
-            return {"status": "error", "message": f"Model zwrócił odpowiedź, która nie jest poprawnym formatem JSON. Treść: {raw_text}"}
+            # Ponowne zapytanie już było - kolejka zadań nie powinna ponawiać tego błędu
+            return {"status": "error", "retryable": False,
+                    "message": f"Model zwrócił niepoprawną odpowiedź: {result.error.message}"}
+        return result.data
 
     except Exception as e:
         print(f"Błąd podczas komunikacji z Google GenAI: {e}")
         return {"status": "error", "message": f"Wystąpił błąd podczas komunikacji z API AI: {e}"}
 
 
-def get_data_from_gus(prompt):
-    return get_gemini_response(prompt)
+# --- Źródła danych (backendy) ---
+
+class DataBackend:
+    """Interfejs źródła danych używanego przez get_data_from_gus."""
+
+    name = None
+
+    @property
+    def cache_name(self):
+        # Identyfikator źródła w kluczu cache odpowiedzi
+        return self.name
+
+    def fetch(self, prompt, on_event=None, system_prompt=None):
+        raise NotImplementedError
+
+    def for_request(self):
+        # Backend z ustawieniami zamrożonymi na czas jednego zapytania (klucz cache, metryki i fetch zgodne)
+        return self
+
+
+class GeminiBackend(DataBackend):
+    """Prawdziwe zapytania do modelu Gemini."""
+
+    name = 'gemini'
+
+    def __init__(self, model_name=None):
+        self.model_name = model_name
+
+    @property
+    def cache_name(self):
+        # Model wybrany dla bieżącego obciążenia - odpowiedzi tańszego modelu mają osobne wpisy w cache
+        return self.model_name or select_model_name()
+
+    def for_request(self):
+        # Model wybieramy raz na zapytanie - długość kolejki może się zmienić między kluczem cache a fetch
+        return GeminiBackend(select_model_name())
+
+    def fetch(self, prompt, on_event=None, system_prompt=None):
+        model_name = self.model_name or select_model_name()
+        if model_name != app.config['GEMINI_MODEL']:
+            MODEL_DOWNGRADES.inc(model_name)
+        return get_gemini_response(prompt, on_event=on_event, system_prompt=system_prompt, model_name=model_name)
+
+
+def make_synthetic_gus_data(prompt, series_count=2, points=24, end_date=None):
+    """
+    Generuje deterministyczną odpowiedź w formacie GUS (ziarno z hasha promptu):
+    'series_count' serii miesięcznych po 'points' punktów, kończących się na 'end_date'
+    (domyślnie bieżący miesiąc). Używane przez LocalBackend i benchmark renderowania.
+    """
+    rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).hexdigest())
+    end_date = end_date or datetime.date.today()
+    end = end_date.year * 12 + end_date.month - 1
+    categories = [f"{o // 12}-{o % 12 + 1:02d}" for o in range(end - points + 1, end + 1)]
+
+    data_series = []
+    for i in range(series_count):
+        value = rng.uniform(2, 10)
+        data_points = []
+        for category in categories:
+            value = max(0.0, value + rng.gauss(0, 0.3))
+            data_points.append({'category': category, 'value': round(value, 1)})
+        data_series.append({'series_name': f"Seria syntetyczna {i + 1}", 'data_points': data_points})
+
+    return {
+        'query_original': prompt,
+        'status': 'success',
+        'data_meta': {
+            'title': f"Dane syntetyczne: {prompt}",
+            'chart_type_suggestion': 'line',
+            'source_info': 'Lokalny backend testowy',
+            'latest_period': categories[-1] if categories else 'N/A',
+            'unit': '%',
+            'y_axis_label': 'Wartość (%)',
+            'x_axis_label': 'Okres',
+            'statistical_commentary': 'Dane wygenerowane lokalnie na potrzeby testów wydajności.'
+        },
+        'data_series': data_series
+    }
+
+
+class LocalBackend(DataBackend):
+    """
+    Lokalny zamiennik modelu do testów wydajności: odtwarza nagraną odpowiedź
+    (np. plik 'output', także w bloku ```json) albo generuje serie syntetyczne
+    o zadanym rozmiarze. Opóźnienie symuluje czas odpowiedzi modelu.
+    """
+
+    name = 'local'
+
+    def __init__(self, fixture_path=None, series_count=2, points=24, latency=0.0):
+        self.fixture_path = fixture_path
+        self.series_count = series_count
+        self.points = points
+        self.latency = latency
+        self._fixture_text = None
+        if fixture_path:
+            with open(fixture_path, 'r', encoding='utf-8') as f:
+                raw = f.read().strip()
+            # Usuwamy ewentualne ogrodzenie bloku kodu Markdown
+            self._fixture_text = strip_code_fences(raw)
+
+    @property
+    def cache_name(self):
+        source = os.path.basename(self.fixture_path) if self.fixture_path else f"synthetic-{self.series_count}x{self.points}"
+        return f"local:{source}"
+
+    def fetch(self, prompt, on_event=None, system_prompt=None):
+        text = self._fixture_text if self._fixture_text is not None else json_lib.dumps(
+            make_synthetic_gus_data(prompt, self.series_count, self.points), ensure_ascii=False)
+        if self.latency:
+            time.sleep(self.latency)
+        if on_event is not None:
+            # Ta sama ścieżka co przy strumieniowaniu z Gemini: tekst trafia do parsera fragmentami
+            parser = IncrementalJsonParser()
+            for start in range(0, len(text), 512):
+                for event, payload in parser.feed(text[start:start + 512]):
+                    on_event(event, payload)
+        MODEL_RESPONSE_SIZE.observe(len(text.encode('utf-8')), self.cache_name)
+        with Span(JSON_PARSE_TIME):
+            result = validate_model_response(text)
+        record_validation(result)
+        if not result.ok:
+            return {"status": "error", "message": f"Niepoprawna odpowiedź lokalnego backendu: {result.error.message}"}
+        return result.data
+
+
+_data_backend = None
+_data_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _data_backend
+    if _data_backend is None:
+        with _data_backend_lock:
+            if _data_backend is None:
+                _data_backend = create_backend(app.config['DATA_BACKEND'])
+    return _data_backend
+
+
+def create_backend(name):
+    if name == 'gemini':
+        return GeminiBackend()
+    if name == 'local':
+        return LocalBackend(
+            fixture_path=app.config['LOCAL_BACKEND_FIXTURE'],
+            series_count=app.config['LOCAL_BACKEND_SERIES'],
+            points=app.config['LOCAL_BACKEND_POINTS'],
+            latency=app.config['LOCAL_BACKEND_LATENCY']
+        )
+    raise ValueError(f"Nieznany backend danych: {name}")
+
+
+def fetch_from_backend(backend, prompt, on_event=None, system_prompt=None):
+    # Czas odpowiedzi i błędy modelu liczymy osobno dla każdego źródła danych
+    with Span(MODEL_LATENCY, (backend.cache_name,)):
+        gus_data = backend.fetch(prompt, on_event=on_event, system_prompt=system_prompt)
+    if isinstance(gus_data, dict) and gus_data.get('status') == 'error':
+        MODEL_ERRORS.inc(backend.cache_name)
+    return gus_data
+
+
+# --- Lokalna baza wskaźników ---
+# Wartości z poprawnych odpowiedzi modelu i z importów BDL, kluczowane (wskaźnik, obszar, jednostka, okres).
+# Powtarzające się pytania o te same dane obsługujemy lokalnie, a model pytamy tylko o brakujące okresy.
+
+# Słowa pytań, które nie mówią nic o wskaźniku ani obszarze (porównujemy ich rdzenie, patrz text_stems).
+# Określenia okresu i częstotliwości są tu tylko dlatego, że czyta je osobno parse_period_qualifiers;
+# nazw miesięcy celowo brak - pytanie o konkretny miesiąc nie pasuje do żadnej serii i trafia do modelu.
+INDICATOR_STOP_WORDS = (
+    "jaka jaki jakie jak jest był była było były są ile pokaż pokaz podaj przedstaw wykres tabela dane danych "
+    "dla oraz lub albo latach lata lat roku rok rocznie od do we na ze za po przez według wg "
+    "ostatnie ostatnich ostatni obecnie aktualna aktualny aktualne miesięcy miesiące miesiąc miesięcznie "
+    "kwartał kwartały kwartałów kwartalnie zmiana zmiany trend poziom wartość wartości"
+)
+# Częstotliwość, o którą prosi pytanie ('kwartalnie', 'dane miesięczne', 'w ujęciu rocznym')
+INDICATOR_FREQ_PATTERNS = (
+    ('A', r'\broczn\w*'),
+    ('Q', r'\bkwartaln\w*'),
+    ('M', r'\bmiesięczn\w*'),
+)
+# Względny zakres: 'w ostatnich 2 latach', 'ostatnie dwanaście miesięcy', 'ostatni rok'
+INDICATOR_LAST_PATTERN = re.compile(r'\bostatni\w*\s+(?:(\d+|[^\W\d_]+)\s+)?(lat|rok|miesi|kwarta)\w*')
+INDICATOR_UNIT_MONTHS = {'lat': 12, 'rok': 12, 'miesi': 1, 'kwarta': 3}
+INDICATOR_NUMBER_WORDS = {
+    'dwa': 2, 'dwie': 2, 'dwóch': 2, 'dwu': 2, 'trzy': 3, 'trzech': 3, 'cztery': 4, 'czterech': 4,
+    'pięć': 5, 'pięciu': 5, 'sześć': 6, 'sześciu': 6, 'siedem': 7, 'siedmiu': 7, 'osiem': 8, 'ośmiu': 8,
+    'dziewięć': 9, 'dziewięciu': 9, 'dziesięć': 10, 'dziesięciu': 10, 'dwanaście': 12, 'dwunastu': 12,
+}
+# Części nazw obszarów, które same nie wskazują konkretnego obszaru
+INDICATOR_GENERIC_REGION_WORDS = (
+    "powiat powiaty gmina gminy miasto miasta województwo woj prawach powiatu podregion region makroregion "
+    "obszar wiejski wiejska miejska miejsko część ogółem"
+)
+
+StoreSeries = namedtuple('StoreSeries', ['id', 'indicator', 'region', 'unit', 'source_info',
+                                         'indicator_stems', 'region_stems'])
+
+
+def text_stems(text):
+    """
+    Zbiór rdzeni słów: pierwsze 4 litery bez polskich znaków. Prosta odporność na odmianę
+    ('Płock' / 'w Płocku', 'Łódź' / 'w Łodzi') bez słownika fleksyjnego.
+    """
+    text = unicodedata.normalize('NFKD', (text or '').casefold().replace('ł', 'l'))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return {word[:4] for word in re.findall(r'[^\W\d_]{3,}', text)}
+
+
+INDICATOR_STOP_STEMS = frozenset(text_stems(INDICATOR_STOP_WORDS) | text_stems(' '.join(INDICATOR_NUMBER_WORDS)))
+INDICATOR_GENERIC_REGION_STEMS = frozenset(text_stems(INDICATOR_GENERIC_REGION_WORDS))
+
+
+def indicator_from_meta(data_meta):
+    # Starsze wersje promptu nie zwracały 'indicator' - wtedy tytuł bez okresu i dopisków w nawiasach
+    indicator = data_meta.get('indicator')
+    if not indicator:
+        indicator = re.sub(r'\(.*?\)', '', data_meta.get('title', ''))
+        indicator = re.sub(r'\s+(w\s+)?(latach|roku|r\.)?\s*\d{4}(\s*[-–]\s*\d{4})?.*$', '', indicator)
+    return ' '.join(indicator.split())
+
+
+def current_period(freq, today=None):
+    today = today or datetime.date.today()
+    if freq == 'A':
+        return today.year
+    if freq == 'Q':
+        return today.year * 4 + (today.month - 1) // 3
+    return today.year * 12 + today.month - 1
+
+
+def period_range_for_years(freq, first_year, last_year):
+    per_year = {'A': 1, 'Q': 4, 'M': 12}[freq]
+    return first_year * per_year, (last_year + 1) * per_year - 1
+
+
+def format_period_ranges(freq, ordinals):
+    """[2024-01, 2024-02, 2024-03, 2024-06] -> '2024-01 – 2024-03, 2024-06'"""
+    ranges, ordinals = [], sorted(ordinals)
+    start = previous = ordinals[0]
+    for ordinal in ordinals[1:] + [None]:
+        if ordinal is not None and ordinal == previous + 1:
+            previous = ordinal
+            continue
+        ranges.append(format_period(start, freq) if start == previous
+                      else f"{format_period(start, freq)} – {format_period(previous, freq)}")
+        start = previous = ordinal
+    return ', '.join(ranges)
+
+
+class IndicatorStore:
+    """
+    Wartości wskaźników w SQLite (osobny plik, wspólny dla procesów serwera).
+    Pierwsza zapisana wartość z odpowiedzi modelu zostaje - kolejne pytania dostają te same liczby;
+    import z BDL nadpisuje wartości pochodzące od modelu.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._candidates = None
+        self._candidates_version = None
+        self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS indicator_series (
+                    id INTEGER PRIMARY KEY,
+                    indicator TEXT NOT NULL,
+                    region TEXT NOT NULL,
+                    unit TEXT NOT NULL,
+                    indicator_key TEXT NOT NULL,
+                    region_key TEXT NOT NULL,
+                    source_info TEXT NOT NULL DEFAULT '',
+                    UNIQUE (indicator_key, region_key, unit)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS indicator_value (
+                    series_id INTEGER NOT NULL,
+                    freq TEXT NOT NULL,
+                    period INTEGER NOT NULL,
+                    value REAL NOT NULL,
+                    source TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (series_id, freq, period)
+                ) WITHOUT ROWID
+            """)
+            # Okresy, o które pytaliśmy model bez skutku - nie pytamy o nie przy każdym żądaniu
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS indicator_miss (
+                    series_id INTEGER NOT NULL,
+                    freq TEXT NOT NULL,
+                    period INTEGER NOT NULL,
+                    checked_at REAL NOT NULL,
+                    PRIMARY KEY (series_id, freq, period)
+                ) WITHOUT ROWID
+            """)
+
+    def _series_id(self, conn, indicator, region, unit, source_info):
+        conn.execute(
+            "INSERT OR IGNORE INTO indicator_series (indicator, region, unit, indicator_key, region_key, source_info) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (indicator, region, unit, normalize_prompt(indicator), normalize_prompt(region), source_info)
+        )
+        return conn.execute(
+            "SELECT id FROM indicator_series WHERE indicator_key = ? AND region_key = ? AND unit = ?",
+            (normalize_prompt(indicator), normalize_prompt(region), unit)
+        ).fetchone()[0]
+
+    def add_values(self, series_values, source, overwrite=False):
+        """
+        Zapisuje wartości: `series_values` to lista ((wskaźnik, obszar, jednostka, źródło), [(freq, okres, wartość)]).
+        Zwraca liczbę zapisanych punktów.
+        """
+        now = time.time()
+        verb = "INSERT OR REPLACE" if overwrite else "INSERT OR IGNORE"
+        stored = 0
+        with self._connect() as conn:
+            for (indicator, region, unit, source_info), points in series_values:
+                series_id = self._series_id(conn, indicator, region, unit, source_info)
+                cursor = conn.executemany(
+                    f"{verb} INTO indicator_value (series_id, freq, period, value, source, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(series_id, freq, period, value, source, now) for freq, period, value in points]
+                )
+                stored += max(cursor.rowcount, 0)
+        return stored
+
+    def add_points(self, series_id, points, source):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO indicator_value (series_id, freq, period, value, source, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(series_id, freq, period, value, source, now) for freq, period, value in points]
+            )
+
+    def candidates(self):
+        """Wszystkie serie z rdzeniami nazw; odświeżane tylko, gdy w bazie pojawiły się nowe serie."""
+        with self._connect() as conn:
+            version = conn.execute("SELECT COUNT(*), MAX(id) FROM indicator_series").fetchone()
+            with self._lock:
+                if version == self._candidates_version:
+                    return self._candidates
+            rows = conn.execute("SELECT id, indicator, region, unit, source_info FROM indicator_series").fetchall()
+        candidates = [
+            StoreSeries(series_id, indicator, region, unit, source_info,
+                        frozenset(text_stems(indicator) - INDICATOR_STOP_STEMS),
+                        frozenset(text_stems(region) - INDICATOR_GENERIC_REGION_STEMS - INDICATOR_STOP_STEMS))
+            for series_id, indicator, region, unit, source_info in rows
+        ]
+        with self._lock:
+            self._candidates, self._candidates_version = candidates, version
+        return candidates
+
+    def values(self, series_ids):
+        """{id serii: {freq: {okres: wartość}}} oraz zbiór źródeł tych wartości."""
+        result, sources = {series_id: {} for series_id in series_ids}, set()
+        placeholders = ','.join('?' * len(series_ids))
+        with self._connect() as conn:
+            for series_id, freq, period, value, source in conn.execute(
+                    f"SELECT series_id, freq, period, value, source FROM indicator_value "
+                    f"WHERE series_id IN ({placeholders})", list(series_ids)):
+                result[series_id].setdefault(freq, {})[period] = value
+                sources.add(source)
+        return result, sources
+
+    def recent_misses(self, series_id, freq, max_age):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT period FROM indicator_miss WHERE series_id = ? AND freq = ? AND checked_at >= ?",
+                (series_id, freq, time.time() - max_age)
+            ).fetchall()
+        return {period for (period,) in rows}
+
+    def record_misses(self, series_id, freq, periods):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO indicator_miss (series_id, freq, period, checked_at) VALUES (?, ?, ?, ?)",
+                [(series_id, freq, period, now) for period in periods]
+            )
+
+
+indicator_store = IndicatorStore(app.config['INDICATOR_STORE_PATH'])
+
+
+def series_period_points(series):
+    """Punkty serii, których kategoria jest okresem: [(freq, okres, wartość)] (bez braków)."""
+    points = []
+    for point in series.get('data_points') or []:
+        period = parse_period(str(point.get('category', '')))
+        value = point.get('value')
+        if period is not None and isinstance(value, (int, float)) and value == value:
+            points.append((period[0], period[1], float(value)))
+    return points
+
+
+def remember_indicators(gus_data):
+    """Zapisuje szeregi czasowe z poprawnej odpowiedzi modelu w lokalnej bazie wskaźników."""
+    if not app.config['INDICATOR_STORE_ENABLED'] or not isinstance(gus_data, dict):
+        return
+    if gus_data.get('status') == 'error' or not gus_data.get('data_series') or gus_data.get('source') == 'indicator_store':
+        return
+    data_meta = gus_data.get('data_meta', {})
+    indicator = indicator_from_meta(data_meta)
+    if not indicator:
+        return
+    series_values = []
+    for series in gus_data['data_series']:
+        points = series_period_points(series)
+        region = series.get('region') or series.get('series_name')
+        if points and region:
+            series_values.append(((indicator, region, data_meta.get('unit', ''), data_meta.get('source_info', '')), points))
+    if not series_values:
+        return
+    try:
+        indicator_store.add_values(series_values, source='model')
+    except sqlite3.Error as e:
+        print(f"Ostrzeżenie: Nie udało się zapisać wskaźników w lokalnej bazie: {e}")
+
+
+def match_indicator_series(prompt, candidates):
+    """
+    Serie z bazy, o które pyta prompt: jeden wskaźnik (z jedną jednostką), jeden lub więcej obszarów.
+    Dopasowanie jest ostrożne - każde znaczące słowo promptu musi pasować do nazwy wskaźnika
+    albo obszaru; w przeciwnym razie prompt pyta o coś, czego baza nie ma (wtedy zwraca []).
+    """
+    prompt_stems = text_stems(prompt) - INDICATOR_STOP_STEMS
+    if not prompt_stems:
+        return []
+    min_coverage = app.config['INDICATOR_MATCH_MIN_COVERAGE']
+
+    groups = {}
+    for candidate in candidates:
+        if not candidate.indicator_stems or not candidate.region_stems & prompt_stems:
+            continue
+        coverage = len(candidate.indicator_stems & prompt_stems) / len(candidate.indicator_stems)
+        if coverage >= min_coverage:
+            groups.setdefault((candidate.indicator_stems, candidate.unit), []).append((coverage, candidate))
+
+    best, best_coverage = [], 0.0
+    for (indicator_stems, _), members in groups.items():
+        explained = indicator_stems.union(*(candidate.region_stems for _, candidate in members))
+        if prompt_stems - explained - INDICATOR_GENERIC_REGION_STEMS:
+            continue
+        coverage = members[0][0]
+        if coverage > best_coverage:
+            best, best_coverage = [candidate for _, candidate in members], coverage
+    return best
+
+
+def parse_period_qualifiers(prompt):
+    """
+    Częstotliwość i względny zakres (w miesiącach) z treści pytania:
+    'kwartalnie w ostatnich 2 latach' -> ('Q', 24). Zwraca None, gdy pytanie zawiera określenie
+    okresu, którego nie umiemy przełożyć na zakres z bazy - wtedy odpowiada model.
+    """
+    text = prompt.casefold()
+    freqs = {freq for freq, pattern in INDICATOR_FREQ_PATTERNS if re.search(pattern, text)}
+    if len(freqs) > 1:
+        return None
+    text = re.sub('|'.join(pattern for _, pattern in INDICATOR_FREQ_PATTERNS), ' ', text)
+
+    last_months = None
+    match = INDICATOR_LAST_PATTERN.search(text)
+    if match:
+        count = match.group(1)
+        if count is None:
+            count = 1 if match.group(2) == 'rok' else None # 'ostatni rok', ale nie 'ostatnie lata'
+        elif count.isdigit():
+            count = int(count)
+        else:
+            count = INDICATOR_NUMBER_WORDS.get(count)
+        if not count:
+            return None
+        last_months = count * INDICATOR_UNIT_MONTHS[match.group(2)]
+        if re.search(r'\b(?:19|20)\d{2}\b', text):
+            return None # Względny zakres i konkretne lata naraz - niejednoznaczne
+        text = text[:match.start()] + ' ' + text[match.end():]
+
+    # Pozostałe określenia okresu ('ostatnie dane', 'w II kwartale', 'miesiąc po miesiącu') zostawiamy modelowi
+    if re.search(r'\b(?:ostatni|kwarta|miesi)\w*', text):
+        return None
+    return (freqs.pop() if freqs else None), last_months
+
+
+def requested_period_range(prompt, freq, stored_periods, last_months=None):
+    """
+    (pierwszy, ostatni) okres, o który pyta prompt: ostatnie `last_months` miesięcy, lata z treści
+    albo wszystko, co jest w bazie, aż do najnowszego okresu, dla którego dane powinny już być opublikowane.
+    """
+    latest_expected = current_period(freq) - app.config['INDICATOR_PUBLICATION_LAG'].get(freq, 1)
+    newest = max(latest_expected, max(stored_periods, default=latest_expected))
+    if last_months:
+        periods = -(-last_months * {'A': 1, 'Q': 4, 'M': 12}[freq] // 12) # Zaokrąglenie w górę
+        return newest - periods + 1, newest
+    years = sorted({int(year) for year in re.findall(r'\b((?:19|20)\d{2})\b', prompt)})
+    if not years:
+        return min(stored_periods, default=latest_expected), newest
+    first, last = period_range_for_years(freq, years[0], years[-1])
+    if len(years) == 1 and re.search(r'\bod\b', prompt.casefold()):
+        return first, newest # 'od 2019 roku' - do najnowszych danych
+    return first, min(last, newest)
+
+
+def resolve_from_indicator_store(prompt, backend, system_prompt):
+    """
+    Odpowiedź zbudowana z lokalnej bazy wskaźników albo None, gdy baza nie zna wskaźnika
+    (wtedy pytamy model o całość). Brakujące okresy uzupełnia jedno zapytanie do modelu.
+    """
+    qualifiers = parse_period_qualifiers(prompt)
+    if qualifiers is None:
+        INDICATOR_STORE_REQUESTS.inc('miss')
+        return None
+    requested_freq, last_months = qualifiers
+    try:
+        matched = match_indicator_series(prompt, indicator_store.candidates())
+        if not matched:
+            INDICATOR_STORE_REQUESTS.inc('miss')
+            return None
+        values, sources = indicator_store.values([series.id for series in matched])
+    except sqlite3.Error as e:
+        print(f"Ostrzeżenie: Błąd odczytu lokalnej bazy wskaźników: {e}")
+        return None
+
+    retry_after = app.config['INDICATOR_GAP_RETRY_AFTER']
+    plan = []
+    for series in matched:
+        by_freq = values[series.id]
+        if requested_freq is not None:
+            if not by_freq.get(requested_freq):
+                INDICATOR_STORE_REQUESTS.inc('miss')
+                return None # Np. dane roczne, a w bazie tylko miesięczne - agregację zostawiamy modelowi
+            freq = requested_freq
+        elif by_freq:
+            freq = max(by_freq, key=lambda f: len(by_freq[f])) # Częstotliwość z największą liczbą punktów
+        else:
+            continue
+        first, last = requested_period_range(prompt, freq, by_freq[freq], last_months)
+        gaps = set(range(first, last + 1)) - set(by_freq[freq]) - indicator_store.recent_misses(series.id, freq, retry_after)
+        plan.append((series, freq, first, last, gaps))
+    if not plan:
+        INDICATOR_STORE_REQUESTS.inc('miss')
+        return None
+
+    if any(gaps for *_, gaps in plan):
+        INDICATOR_STORE_REQUESTS.inc('partial')
+        had_values = plan_has_values(plan, values)
+        gap_data = fill_indicator_gaps(prompt, plan, backend, system_prompt)
+        if gap_data is not None and not had_values:
+            return gap_data # Baza nie miała nic z żądanego zakresu, a model nie odpowiedział
+        values, sources = indicator_store.values([series.id for series, *_ in plan])
+    elif not plan_has_values(plan, values):
+        # Żądany zakres jest w całości poza bazą, a braki sprawdzaliśmy niedawno - pusty raport nic nie da
+        INDICATOR_STORE_REQUESTS.inc('miss')
+        return None
+    else:
+        INDICATOR_STORE_REQUESTS.inc('hit')
+
+    return build_store_gus_data(prompt, plan, values, sources)
+
+
+def plan_has_values(plan, values):
+    """Czy baza ma choć jedną wartość z zakresu, o który pyta prompt."""
+    return any(first <= period <= last
+               for series, freq, first, last, _ in plan for period in values[series.id].get(freq, ()))
+
+
+def fill_indicator_gaps(prompt, plan, backend, system_prompt):
+    """Pyta model tylko o brakujące okresy i zapisuje je w bazie. Zwraca odpowiedź z błędem albo None."""
+    series = plan[0][0]
+    wanted = '; '.join(f"{item[0].region}: {format_period_ranges(item[1], item[4])}" for item in plan if item[4])
+    gap_prompt = (f"{prompt}\n\nPodaj wyłącznie brakujące dane dla wskaźnika '{series.indicator}' "
+                  f"(jednostka: '{series.unit}'), dla okresów: {wanted}.")
+    print(f"Lokalna baza wskaźników: pytam model o brakujące okresy ({wanted})")
+
+    gus_data = fetch_from_backend(backend, gap_prompt, system_prompt=system_prompt)
+    if not isinstance(gus_data, dict) or gus_data.get('status') == 'error':
+        return gus_data
+    # Wartości w innej jednostce niż zapisane nie pasują do serii z bazy
+    response_series = []
+    if gus_data.get('data_meta', {}).get('unit', '') in ('', series.unit):
+        response_series = gus_data.get('data_series') or []
+
+    for item_series, item_freq, _, _, gaps in plan:
+        if not gaps:
+            continue
+        source_series = next(
+            (s for s in response_series
+             if item_series.region_stems & text_stems(f"{s.get('region', '')} {s.get('series_name', '')}")),
+            response_series[0] if len(plan) == 1 and len(response_series) == 1 else None
+        )
+        points = [point for point in series_period_points(source_series or {})
+                  if point[0] == item_freq and point[1] in gaps]
+        try:
+            indicator_store.add_points(item_series.id, points, source='model')
+            indicator_store.record_misses(item_series.id, item_freq, gaps - {point[1] for point in points})
+        except sqlite3.Error as e:
+            print(f"Ostrzeżenie: Nie udało się zapisać uzupełnionych wskaźników: {e}")
+    return None
+
+
+def build_store_gus_data(prompt, plan, values, sources):
+    """Odpowiedź w formacie GUS (jak od modelu) z wartości zapisanych w bazie."""
+    data_series, all_periods, missing = [], [], []
+    for series, freq, first, last, _ in plan:
+        stored = values[series.id].get(freq, {})
+        periods = [period for period in sorted(stored) if first <= period <= last]
+        data_series.append({
+            'series_name': series.region,
+            'region': series.region,
+            'data_points': [{'category': format_period(period, freq), 'value': stored[period]} for period in periods]
+        })
+        all_periods.extend((freq, period) for period in periods)
+        absent = set(range(first, last + 1)) - set(stored)
+        if absent:
+            missing.append(f"{series.region}: {format_period_ranges(freq, absent)}")
+
+    indicator, unit = plan[0][0].indicator, plan[0][0].unit
+    first_label = format_period(min(all_periods)[1], min(all_periods)[0]) if all_periods else 'N/A'
+    latest_label = format_period(max(all_periods)[1], max(all_periods)[0]) if all_periods else 'N/A'
+    commentary = (f"Dane z lokalnej bazy wskaźników: {len(all_periods)} wartości "
+                  f"z okresu {first_label} – {latest_label}.")
+    if missing:
+        commentary += f" Brak danych dla: {'; '.join(missing)}."
+
+    return {
+        'query_original': prompt,
+        'status': 'success',
+        'source': 'indicator_store',
+        'data_meta': {
+            'title': f"{indicator} ({first_label} – {latest_label})",
+            'indicator': indicator,
+            'chart_type_suggestion': 'line',
+            'source_info': 'GUS, Bank Danych Lokalnych (BDL)' if 'bdl' in sources else (plan[0][0].source_info or 'GUS'),
+            'latest_period': latest_label,
+            'unit': unit,
+            'y_axis_label': f"{indicator} ({unit})" if unit else indicator,
+            'x_axis_label': 'Okres',
+            'statistical_commentary': commentary
+        },
+        'data_series': data_series
+    }
+
+
+# --- Import danych z Banku Danych Lokalnych (BDL) ---
+
+BDL_MONTHS = {name: i for i, name in enumerate(
+    ('styczeń', 'luty', 'marzec', 'kwiecień', 'maj', 'czerwiec', 'lipiec', 'sierpień',
+     'wrzesień', 'październik', 'listopad', 'grudzień'), start=1)}
+BDL_PERIOD_COLUMNS = ('miesiące', 'miesiace', 'kwartały', 'kwartaly', 'okresy', 'okres')
+BDL_SKIPPED_COLUMNS = ('kod', 'nazwa', 'rok', 'wartosc', 'wartość', 'jednostka miary', 'atrybut')
+
+
+def parse_bdl_period(year, label):
+    """Rok i etykieta okresu z BDL ('styczeń', 'kwartał 2', 'II kwartał', pusta) -> (freq, okres)."""
+    label = (label or '').strip().casefold()
+    if not label or label in ('rok', 'ogółem'):
+        return 'A', year
+    if label in BDL_MONTHS:
+        return 'M', year * 12 + BDL_MONTHS[label] - 1
+    match = re.search(r'\b([1-4]|i{1,3}|iv)\b', label)
+    if 'kwarta' in label and match:
+        quarter = {'i': 1, 'ii': 2, 'iii': 3, 'iv': 4}.get(match.group(1)) or int(match.group(1))
+        return 'Q', year * 4 + quarter - 1
+    return None
+
+
+def read_bdl_csv(path, indicator, unit=None):
+    """
+    Czyta eksport CSV z BDL w układzie pionowym (kolumny m.in. Kod;Nazwa;Rok;Wartosc;Jednostka miary).
+    Dodatkowe kolumny wymiarów (np. płeć) różne od 'ogółem' trafiają do nazwy wskaźnika.
+    Zwraca listę ((wskaźnik, obszar, jednostka, źródło), [(freq, okres, wartość)]).
+    """
+    for encoding in ('utf-8-sig', 'cp1250'):
+        try:
+            with open(path, 'r', encoding=encoding, newline='') as f:
+                rows = list(csv.DictReader(f, delimiter=';'))
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise click.ClickException(f"Nie udało się odczytać pliku {path} (kodowanie UTF-8 ani CP1250)")
+
+    series, skipped = {}, 0
+    for row in rows:
+        row = {(key or '').strip().casefold(): (value or '').strip() for key, value in row.items()}
+        try:
+            year = int(row['rok'])
+        except (KeyError, ValueError):
+            skipped += 1
+            continue
+        value = coerce_number(row.get('wartosc', row.get('wartość')))
+        period_label = next((row[column] for column in BDL_PERIOD_COLUMNS if column in row), '')
+        period = parse_bdl_period(year, period_label)
+        if value is None or period is None or not row.get('nazwa'):
+            skipped += 1
+            continue
+        dimensions = [row[column] for column in row
+                      if column and column not in BDL_SKIPPED_COLUMNS and column not in BDL_PERIOD_COLUMNS
+                      and row[column] and row[column].casefold() != 'ogółem']
+        name = f"{indicator} ({', '.join(dimensions)})" if dimensions else indicator
+        key = (name, row['nazwa'], unit if unit is not None else row.get('jednostka miary', ''),
+               'GUS, Bank Danych Lokalnych (BDL)')
+        series.setdefault(key, []).append((period[0], period[1], value))
+    return list(series.items()), skipped
+
+
+@app.cli.command('import-bdl')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--indicator', required=True, help="Nazwa wskaźnika, np. 'Stopa bezrobocia rejestrowanego'.")
+@click.option('--unit', default=None, help="Jednostka (domyślnie z kolumny 'Jednostka miary').")
+def import_bdl_command(paths, indicator, unit):
+    """Importuje eksporty CSV z Banku Danych Lokalnych GUS do lokalnej bazy wskaźników."""
+    for path in paths:
+        series_values, skipped = read_bdl_csv(path, indicator, unit)
+        stored = indicator_store.add_values(series_values, source='bdl', overwrite=True)
+        click.echo(f"{os.path.basename(path)}: zapisano wartości: {stored} (serie: {len(series_values)}), "
+                   f"pominięto wierszy: {skipped}")
+
+
+def get_data_from_gus(prompt, on_event=None, system_prompt=None):
+    system_prompt = system_prompt or prompt_registry.get()
+    backend = get_backend().for_request()
+
+    cache_key = None
+    if app.config['RESPONSE_CACHE_ENABLED']:
+        # Klucz cache: znormalizowany prompt + wersja promptu systemowego + model (źródło danych)
+        cache_key = ResponseCache.make_key(prompt, system_prompt.version, backend.cache_name)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            RESPONSE_CACHE_REQUESTS.inc('hit')
+            print(f"Cache hit dla promptu: {prompt}")
+            return cached
+        RESPONSE_CACHE_REQUESTS.inc('miss')
+
+    # Potem lokalna baza wskaźników - te same liczby dla podobnych pytań, model tylko dla braków.
+    # Warianty eksperymentalne (prompt.<wariant>.txt) zawsze pytają model, aby porównanie wariantów miało sens.
+    if app.config['INDICATOR_STORE_ENABLED'] and system_prompt.name == PromptRegistry.DEFAULT_NAME:
+        stored = resolve_from_indicator_store(prompt, backend, system_prompt)
+        if stored is not None:
+            return stored
+
+    gus_data = fetch_from_backend(backend, prompt, on_event=on_event, system_prompt=system_prompt)
+    if cache_key is None:
+        remember_indicators(gus_data)
+        return gus_data
+    # Nie zapisujemy błędów - przy kolejnym pytaniu warto spróbować ponownie
+    if isinstance(gus_data, dict) and gus_data.get('status') != 'error':
+        response_cache.set(cache_key, gus_data)
+        remember_indicators(gus_data)
+    return gus_data
 
 
 def generate_title_for_history(prompt):
@@ -585,8 +4211,48 @@ def generate_title_for_history(prompt):
     return title
 
 # --- Uruchomienie ---
-if __name__ == '__main__':
+
+def prepare_database():
+    """Tworzy brakujące tabele, kolumny i indeksy. Bezpieczne przy wielokrotnym wywołaniu."""
     with app.app_context():
         db.create_all()
+        upgrade_schema()
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Przygotowuje schemat bazy danych (przed pierwszym uruchomieniem serwera produkcyjnego)."""
+    prepare_database()
+    click.echo("Baza danych gotowa.")
+
+
+_app_ready = False
+
+
+def get_app(prepare_db=None):
+    """
+    Punkt wejścia dla serwerów WSGI (wsgi.py, gunicorn). To nie jest fabryka: zwraca globalną
+    instancję `app` tego modułu, skonfigurowaną przy imporcie (main.py -> config.py -> zmienne FLASK_*).
+    Przy pierwszym wywołaniu w procesie przygotowuje bazę i uzupełnianie indeksu wyszukiwania w tle;
+    gdy zrobił to już proces główny serwera (APP_DB_PREPARED=1, gunicorn.conf.py), worker tylko
+    sprawdza indeks. Kolejne wywołania zwracają tę samą instancję bez zmian.
+    """
+    global _app_ready
+    if _app_ready:
+        return app
+    if prepare_db is None:
+        prepare_db = os.environ.get('APP_DB_PREPARED') != '1'
+    if prepare_db:
+        prepare_database()
+        start_search_backfill()
+    else:
+        with app.app_context():
+            ensure_search_index()
+    _app_ready = True
+    return app
+
+
+if __name__ == '__main__':
+    get_app()
     # Użyj host='0.0.0.0' jeśli chcesz, aby aplikacja była dostępna w sieci lokalnej
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    app.run(debug=app.config['DEBUG'], port=5000)
@@ -101,10 +101,213 @@ document.addEventListener('DOMContentLoaded', () => {
                     console.error('Błąd sieci:', error);
                     alert('Wystąpił błąd sieci. Nie można usunąć raportu.');
                 }
+                return;
+            }
+
+            // Kliknięcie w sam element historii - ładujemy treść raportu
+            // (z Ctrl/Cmd - zaznaczamy raport do dashboardu)
+            const historyItem = e.target.closest('.history-item');
+            if (historyItem) {
+                e.preventDefault();
+                if (e.ctrlKey || e.metaKey) {
+                    toggleDashboardSelection(historyItem);
+                } else {
+                    loadReport(historyItem.dataset.id);
+                }
+            }
+        });
+    }
+
+    // --- Dashboard: kilka zaznaczonych raportów na jednym wykresie ---
+    const dashboardButton = document.getElementById('dashboard-btn');
+    const dashboardSelection = [];
+
+    function toggleDashboardSelection(historyItem) {
+        const reportId = historyItem.dataset.id;
+        const index = dashboardSelection.indexOf(reportId);
+        if (index === -1) {
+            dashboardSelection.push(reportId);
+        } else {
+            dashboardSelection.splice(index, 1);
+        }
+        historyItem.classList.toggle('selected', index === -1);
+        updateDashboardButton();
+    }
+
+    function updateDashboardButton() {
+        if (!dashboardButton) return;
+        dashboardButton.hidden = dashboardSelection.length < 2;
+        dashboardButton.querySelector('span').textContent = `Połącz w dashboard (${dashboardSelection.length})`;
+    }
+
+    if (dashboardButton) {
+        dashboardButton.addEventListener('click', async () => {
+            const reportIds = dashboardSelection.splice(0);
+            document.querySelectorAll('.history-item.selected').forEach(item => item.classList.remove('selected'));
+            updateDashboardButton();
+
+            const welcome = document.getElementById('welcome-message');
+            if (welcome) {
+                welcome.style.display = 'none';
+            }
+            const loadingElement = addMessageToUI('ai', null);
+            try {
+                const response = await fetch(`/api/dashboard?ids=${reportIds.join(',')}`);
+                const data = await response.json();
+                if (!response.ok) {
+                    throw new Error(data.error || 'Nie udało się utworzyć dashboardu');
+                }
+                const userMessage = addMessageToUI('user', data.title);
+                loadingElement.closest('.message').before(userMessage);
+                renderAiResponse(loadingElement, data);
+            } catch (error) {
+                console.error('Błąd:', error);
+                loadingElement.innerHTML = `<div class="report-error"><p>${error.message}</p></div>`;
+            }
+        });
+    }
+
+    // --- Doładowywanie historii przy przewijaniu (infinite scroll) ---
+    const historySentinel = document.getElementById('history-sentinel');
+    let historyLoading = false;
+
+    async function loadMoreHistory() {
+        const nextCursor = historyList.dataset.nextCursor;
+        if (historyLoading || !nextCursor) return;
+
+        historyLoading = true;
+        try {
+            const response = await fetch(`/api/reports?before=${encodeURIComponent(nextCursor)}`);
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || 'Nie udało się pobrać historii');
+            }
+
+            data.items.forEach(item => historyList.appendChild(createHistoryItem(item)));
+            historyList.dataset.nextCursor = data.next_cursor || '';
+        } catch (error) {
+            console.error('Błąd podczas ładowania historii:', error);
+        } finally {
+            historyLoading = false;
+        }
+    }
+
+    if (historyList && historySentinel && 'IntersectionObserver' in window) {
+        const historyObserver = new IntersectionObserver((entries) => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                loadMoreHistory();
+            }
+        });
+        historyObserver.observe(historySentinel);
+    }
+
+    // --- Wyszukiwanie w raportach ---
+    const searchInput = document.getElementById('history-search-input');
+    const searchResults = document.getElementById('search-results');
+    let searchTimeout = null;
+
+    async function searchReports(query) {
+        const response = await fetch(`/api/reports/search?q=${encodeURIComponent(query)}`);
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || 'Wyszukiwanie nie powiodło się');
+        }
+
+        searchResults.innerHTML = '';
+        if (!data.items.length) {
+            searchResults.innerHTML = '<li class="search-empty">Brak wyników</li>';
+            return;
+        }
+
+        data.items.forEach(item => {
+            const result = document.createElement('a');
+            result.href = '#';
+            result.className = 'history-item search-result';
+            result.dataset.id = item.id;
+            result.innerHTML = `<span class="search-title"></span><span class="search-snippet">${item.snippet}</span>`;
+            result.querySelector('.search-title').textContent = item.title;
+            searchResults.appendChild(result);
+        });
+    }
+
+    if (searchInput && searchResults && historyList) {
+        searchInput.addEventListener('input', () => {
+            clearTimeout(searchTimeout);
+            const query = searchInput.value.trim();
+
+            // Pusta fraza - wracamy do zwykłej historii
+            if (!query) {
+                searchResults.hidden = true;
+                historyList.hidden = false;
+                return;
+            }
+
+            searchTimeout = setTimeout(() => {
+                searchReports(query)
+                    .then(() => {
+                        searchResults.hidden = false;
+                        historyList.hidden = true;
+                    })
+                    .catch(error => console.error('Błąd wyszukiwania:', error));
+            }, 250);
+        });
+
+        searchResults.addEventListener('click', (e) => {
+            const result = e.target.closest('.search-result');
+            if (result) {
+                e.preventDefault();
+                loadReport(result.dataset.id);
             }
         });
     }
 
+    // Element listy historii (tytuł wstawiamy jako tekst, nie HTML)
+    function createHistoryItem(item) {
+        const historyItem = document.createElement('a');
+        historyItem.href = '#';
+        historyItem.className = 'history-item';
+        historyItem.dataset.id = item.id;
+
+        historyItem.innerHTML = `
+            <i data-lucide="message-square"></i>
+            <span></span>
+            <button class="delete-history-btn" title="Usuń raport">
+                <i data-lucide="trash-2"></i>
+            </button>
+        `;
+        historyItem.querySelector('span').textContent = item.title;
+        lucide.createIcons({ context: historyItem });
+        return historyItem;
+    }
+
+    // --- Wyświetlenie zapisanego raportu z historii ---
+    async function loadReport(reportId) {
+        const welcome = document.getElementById('welcome-message');
+        if (welcome) {
+            welcome.style.display = 'none';
+        }
+        if (sidebar && window.innerWidth < 768) {
+            sidebar.classList.remove('open');
+        }
+
+        const loadingElement = addMessageToUI('ai', null);
+        try {
+            const response = await fetch(`/api/report/${reportId}`);
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || 'Nie udało się pobrać raportu');
+            }
+
+            // Pytanie użytkownika pokazujemy nad raportem, tak jak w zwykłej rozmowie
+            const userMessage = addMessageToUI('user', data.prompt);
+            loadingElement.closest('.message').before(userMessage);
+            renderAiResponse(loadingElement, data);
+        } catch (error) {
+            console.error('Błąd:', error);
+            loadingElement.innerHTML = `<div class="report-error"><p>${error.message}</p></div>`;
+        }
+    }
+
 
     // --- Obsługa formularza (AJAX/Fetch) ---
     const promptForm = document.getElementById('prompt-form');
@@ -166,83 +369,252 @@ document.addEventListener('DOMContentLoaded', () => {
                 body: JSON.stringify({ prompt: promptText }),
             });
 
-            // Nawet jeśli jest błąd 500, serwer zwróci JSON z HTML-em błędu
-            const data = await response.json();
-
-            // 1. Wstrzyknij surowy HTML z serwera
-            loadingElement.innerHTML = data.response;
-            
-            // 2. Znajdź i wyrenderuj wykresy wewnątrz wstrzykniętego HTML
-            renderChartsInResponse(loadingElement);
-
-            // 3. Znajdź bloki .markdown-content i sparsuj je
-            loadingElement.querySelectorAll('.markdown-content').forEach(el => {
-                // Pobieramy treść z <pre> w środku, aby zachować formatowanie
-                const preElement = el.querySelector('pre');
-                const content = preElement ? preElement.textContent : el.textContent;
-                el.innerHTML = marked.parse(content || '');
-            });
+            const job = await response.json();
 
-            // 4. Zaktualizuj ikony Lucide w nowej wiadomości
-            lucide.createIcons({ context: loadingElement });
-            
-            // 5. Dodaj nowy element do historii
-            if (data.new_history_item) {
-                const newHistoryItem = document.createElement('a');
-                newHistoryItem.href = '#'; // TODO: Zaimplementuj ładowanie historii
-                newHistoryItem.className = 'history-item';
-                newHistoryItem.dataset.id = data.new_history_item.id;
-                
-                newHistoryItem.innerHTML = `
-                    <i data-lucide="message-square"></i>
-                    <span>${data.new_history_item.title}</span>
-                    <button class="delete-history-btn" title="Usuń raport">
-                        <i data-lucide="trash-2"></i>
-                    </button>
-                `;
-
-                if (historyList) {
-                    historyList.prepend(newHistoryItem);
-                }
-                lucide.createIcons({ context: newHistoryItem });
+            // Serwer przeciążony lub błędny prompt - pokazujemy komunikat zamiast raportu
+            if (!response.ok) {
+                const retryAfter = response.headers.get('Retry-After');
+                const retryInfo = retryAfter ? ` Spróbuj ponownie za ${retryAfter} s.` : '';
+                loadingElement.innerHTML = `<div class="report-error"><p>${job.error || 'Wystąpił błąd serwera.'}${retryInfo}</p></div>`;
+                return;
             }
 
+            // Raport generuje się w tle - czekamy na wynik zadania,
+            // a w międzyczasie pokazujemy tytuł i karty KPI kolejnych serii
+            const data = await waitForJob(job, createPartialReportRenderer(loadingElement));
+            renderAiResponse(loadingElement, data);
+
         } catch (error) {
             console.error('Błąd:', error);
             loadingElement.innerHTML = `<div class="report-error"><p>Wystąpił krytyczny błąd: ${error.message}. Spróbuj ponownie.</p></div>`;
         }
     });
 
+    // --- Oczekiwanie na zadanie generowania raportu ---
+    // Subskrybujemy strumień SSE zadania, a gdy EventSource nie jest dostępny - odpytujemy status
+    function waitForJob(job, handlers = {}) {
+        if (!window.EventSource) {
+            return pollJob(job.status_url);
+        }
+
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(job.events_url);
+
+            // Częściowe wyniki strumieniowane przez model
+            source.addEventListener('meta', (e) => {
+                if (handlers.onMeta) handlers.onMeta(JSON.parse(e.data));
+            });
+
+            source.addEventListener('series', (e) => {
+                if (handlers.onSeries) handlers.onSeries(JSON.parse(e.data));
+            });
+
+            source.addEventListener('done', (e) => {
+                source.close();
+                resolve(JSON.parse(e.data));
+            });
+
+            source.addEventListener('failed', (e) => {
+                source.close();
+                resolve(JSON.parse(e.data));
+            });
+
+            source.onerror = () => {
+                // Połączenie zerwane - przechodzimy na odpytywanie statusu
+                source.close();
+                pollJob(job.status_url).then(resolve, reject);
+            };
+        });
+    }
+
+    async function pollJob(statusUrl, intervalMs = 1000) {
+        while (true) {
+            const response = await fetch(statusUrl);
+            const status = await response.json();
+
+            if (!response.ok) {
+                throw new Error(status.error || 'Nie udało się pobrać statusu zadania');
+            }
+            if (status.status === 'done' || status.status === 'failed') {
+                return status.result;
+            }
+            await new Promise(r => setTimeout(r, intervalMs));
+        }
+    }
+
+    // --- Częściowy raport (podgląd w trakcie generowania) ---
+    function createPartialReportRenderer(loadingElement) {
+        let seriesContainer = null;
+
+        function onMeta(meta) {
+            loadingElement.innerHTML = `
+                <div class="interactive-report report-partial">
+                    <h2></h2>
+                    <div class="partial-series"></div>
+                    <div class="loading-spinner"></div>
+                </div>
+            `;
+            loadingElement.querySelector('h2').textContent = meta.title || 'Raport Danych';
+            seriesContainer = loadingElement.querySelector('.partial-series');
+        }
+
+        function onSeries(series) {
+            if (!seriesContainer) {
+                onMeta({});
+            }
+            // Przy ponowieniu zadania ta sama seria może przyjść drugi raz - podmieniamy ją
+            let block = seriesContainer.querySelector(`[data-index="${series.index}"]`);
+            if (!block) {
+                block = document.createElement('div');
+                block.dataset.index = series.index;
+                seriesContainer.appendChild(block);
+            }
+            block.innerHTML = series.html;
+            lucide.createIcons({ context: block });
+            messageList.scrollTop = messageList.scrollHeight;
+        }
+
+        return { onMeta, onSeries };
+    }
+
+    // --- Wstawienie gotowej odpowiedzi AI do czatu ---
+    function renderAiResponse(loadingElement, data) {
+        // 1. Wstrzyknij surowy HTML z serwera
+        loadingElement.innerHTML = data.response;
+        
+        // 2. Znajdź i wyrenderuj wykresy wewnątrz wstrzykniętego HTML
+        renderChartsInResponse(loadingElement);
+
+        // 3. Znajdź bloki .markdown-content i sparsuj je
+        loadingElement.querySelectorAll('.markdown-content').forEach(el => {
+            // Pobieramy treść z <pre> w środku, aby zachować formatowanie
+            const preElement = el.querySelector('pre');
+            const content = preElement ? preElement.textContent : el.textContent;
+            el.innerHTML = marked.parse(content || '');
+        });
+
+        // 4. Zaktualizuj ikony Lucide w nowej wiadomości
+        lucide.createIcons({ context: loadingElement });
+        
+        // 5. Dodaj nowy element do historii
+        if (data.new_history_item && historyList) {
+            historyList.prepend(createHistoryItem(data.new_history_item));
+        }
+    }
+
     // --- NOWA FUNKCJA: Renderowanie wykresów ---
+    // Paleta kolorów kolejnych serii (zapętla się)
+    const CHART_COLORS = [
+        { border: '#3e95cd', bg: 'rgba(62, 149, 205, 0.2)' }, // Niebieski
+        { border: '#c45850', bg: 'rgba(196, 88, 80, 0.2)' }, // Czerwony
+        { border: '#3cba9f', bg: 'rgba(60, 186, 159, 0.2)' }, // Zielony
+        { border: '#e8c3b9', bg: 'rgba(232, 195, 185, 0.2)' }, // Różowy
+        { border: '#8e5ea2', bg: 'rgba(142, 94, 162, 0.2)' }  // Fioletowy
+    ];
+
+    // Stałe opcje wykresów - serwer przysyła tylko etykiety i wartości (atrybut data-chart)
+    function buildChartConfig(chart) {
+        return {
+            type: chart.type || 'line',
+            data: {
+                labels: chart.labels,
+                datasets: chart.series.map((series, i) => {
+                    const color = CHART_COLORS[i % CHART_COLORS.length];
+                    return {
+                        label: series.name,
+                        data: series.data,
+                        borderColor: color.border,
+                        backgroundColor: color.bg,
+                        fill: true,
+                        tension: 0.1,
+                        // Przy wielu punktach nie rysujemy znaczników - szybsze renderowanie
+                        pointRadius: chart.labels.length > 200 ? 0 : 3
+                    };
+                })
+            },
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                animation: chart.labels.length > 200 ? false : undefined,
+                plugins: {
+                    title: { display: true, text: chart.title },
+                    legend: { labels: {} }
+                },
+                scales: {
+                    x: { title: { display: true, text: chart.xLabel } },
+                    y: { title: { display: true, text: chart.yLabel } }
+                }
+            }
+        };
+    }
+
+    function applyChartTheme(config) {
+        // Pobierz opcje motywu
+        const themeOptions = getChartThemeOptions();
+
+        // Zastosuj kolory motywu do konfiguracji wykresu
+        // Używamy "głębokiego" łączenia, aby nie nadpisać istniejących opcji
+        config.options = {
+            ...config.options,
+            plugins: {
+                ...config.options.plugins,
+                title: { ...config.options.plugins.title, ...themeOptions.plugins.title },
+                legend: { ...config.options.plugins.legend, ...themeOptions.plugins.legend }
+            },
+            scales: {
+                x: { ...config.options.scales.x, ...themeOptions.scales.axis },
+                y: { ...config.options.scales.y, ...themeOptions.scales.axis }
+            }
+        };
+        return config;
+    }
+
+    // Przycisk doładowania pełnych danych dla wykresu uproszczonego po stronie serwera
+    function addFullDataButton(canvas, chart, chartInstance) {
+        const button = document.createElement('button');
+        button.type = 'button';
+        button.className = 'chart-full-data-btn';
+        button.textContent = `Wykres uproszczony (${chart.labels.length} z ${chart.total} punktów) - pokaż wszystkie`;
+        button.addEventListener('click', async () => {
+            button.disabled = true;
+            try {
+                const response = await fetch(chart.fullDataUrl);
+                const fullChart = await response.json();
+                if (!response.ok) {
+                    throw new Error(fullChart.error || 'Nie udało się pobrać danych');
+                }
+                chartInstance.destroy();
+                new Chart(canvas, applyChartTheme(buildChartConfig(fullChart)));
+                button.remove();
+            } catch (error) {
+                console.error('Błąd:', error);
+                button.disabled = false;
+            }
+        });
+        canvas.parentElement.after(button);
+    }
+
     function renderChartsInResponse(containerElement) {
-        const chartCanvases = containerElement.querySelectorAll('canvas[data-chart-config]');
+        // Nowe raporty: zwięzły opis wykresu; stare raporty (zapisany HTML): pełna konfiguracja Chart.js
+        const chartCanvases = containerElement.querySelectorAll('canvas[data-chart], canvas[data-chart-config]');
         
         chartCanvases.forEach(canvas => {
             try {
-                const configString = canvas.dataset.chartConfig;
-                if (!configString) return;
-
-                const config = JSON.parse(configString);
-                
-                // Pobierz opcje motywu
-                const themeOptions = getChartThemeOptions();
-                
-                // Zastosuj kolory motywu do konfiguracji wykresu
-                // Używamy "głębokiego" łączenia, aby nie nadpisać istniejących opcji
-                config.options = {
-                    ...config.options,
-                    plugins: {
-                        ...config.options.plugins,
-                        title: { ...config.options.plugins.title, ...themeOptions.plugins.title },
-                        legend: { ...config.options.plugins.legend, ...themeOptions.plugins.legend }
-                    },
-                    scales: {
-                        x: { ...config.options.scales.x, ...themeOptions.scales.axis },
-                        y: { ...config.options.scales.y, ...themeOptions.scales.axis }
-                    }
-                };
+                let config;
+                let chart = null;
+                if (canvas.dataset.chart) {
+                    chart = JSON.parse(canvas.dataset.chart);
+                    config = buildChartConfig(chart);
+                } else {
+                    const configString = canvas.dataset.chartConfig;
+                    if (!configString) return;
+                    config = JSON.parse(configString);
+                }
 
-                new Chart(canvas, config);
+                const chartInstance = new Chart(canvas, applyChartTheme(config));
+                if (chart && chart.total && chart.fullDataUrl) {
+                    addFullDataButton(canvas, chart, chartInstance);
+                }
 
             } catch (e) {
                 console.error("Błąd renderowania wykresu:", e);
@@ -330,6 +702,7 @@ document.addEventListener('DOMContentLoaded', () => {
         if (role === 'ai') {
             return messageElement.querySelector('.message-content');
         }
+        return messageElement;
     }
 
     // Obsługa naciśnięcia Enter (bez Shift) do wysyłania
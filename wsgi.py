@@ -0,0 +1,8 @@
+"""
+Punkt wejścia WSGI dla trybu produkcyjnego:
+
+    APP_CONFIG=production gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from main import get_app
+
+app = get_app()